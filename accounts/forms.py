@@ -3,6 +3,8 @@ from transactions.models import Transaction
 
 class TransactionForm(forms.ModelForm):
     receiving_account_id = forms.UUIDField()
+    # issued with the form so that a resubmitted form is only posted once
+    idempotency_key = forms.CharField(max_length=64, required=False, widget=forms.HiddenInput)
 
     class Meta:
         model = Transaction
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from swd_django_demo.containers import Container
+
+
+class Command(BaseCommand):
+    help = "Recompute the materialized account balances from the journal and report any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Only report drifting accounts without writing the recomputed balances.",
+        )
+
+    def handle(self, *args, **options):
+        account_service = Container().account_service()
+        fix = not options["verify"]
+
+        drifts = account_service.rebuild_balances(fix=fix)
+
+        for drift in drifts:
+            self.stdout.write(
+                f"Account {drift['account_id']}: stored {drift['stored_balance']}, "
+                f"expected {drift['expected_balance']}"
+            )
+
+        if not drifts:
+            self.stdout.write(self.style.SUCCESS("All account balances match the journal."))
+        elif fix:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(drifts)} drifting account balance(s)."))
+        else:
+            self.stdout.write(self.style.WARNING(f"Found {len(drifts)} drifting account balance(s)."))
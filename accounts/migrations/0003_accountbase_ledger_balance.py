@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:57
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def backfill_ledger_balance(apps, schema_editor):
+    # Seed the materialized balance from the transactions that were posted before the column existed
+    AccountBase = apps.get_model("accounts", "AccountBase")
+    Transaction = apps.get_model("transactions", "Transaction")
+
+    received = (
+        Transaction.objects.filter(receiving_account_id__isnull=False)
+        .values("receiving_account_id")
+        .annotate(total=Sum("amount"))
+    )
+    for row in received:
+        AccountBase.objects.filter(account_id=row["receiving_account_id"]).update(
+            ledger_balance=F("ledger_balance") + row["total"]
+        )
+
+    sent = (
+        Transaction.objects.filter(sending_account_id__isnull=False)
+        .values("sending_account_id")
+        .annotate(total=Sum("amount"))
+    )
+    for row in sent:
+        AccountBase.objects.filter(account_id=row["sending_account_id"]).update(
+            ledger_balance=F("ledger_balance") - row["total"]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0002_initial"),
+        ("transactions", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="accountbase",
+            name="ledger_balance",
+            field=models.DecimalField(
+                decimal_places=2, default=0.0, editable=False, max_digits=14
+            ),
+        ),
+        migrations.RunPython(backfill_ledger_balance, migrations.RunPython.noop),
+    ]
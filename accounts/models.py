@@ -11,6 +11,8 @@ class AccountBase(Account):
 
     customer_id = models.ForeignKey(CUSTOMER_MODEL, related_name='accounts', on_delete=models.PROTECT, null=True, blank=True)
     type : str = models.CharField(max_length=50, null=False, default='checking', choices=[('checking', 'Checking'), ('savings', 'Savings'), ('custody', 'Custody')])
+    # net amount of all ledger transactions of this account, maintained by the transaction service on every posting
+    ledger_balance = models.DecimalField(max_digits=14, decimal_places=2, default=0.00, editable=False)
 
     class Meta:
         # swappable is used to be able to change the product model
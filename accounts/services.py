@@ -1,4 +1,6 @@
-from typing import List
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Union
 from uuid import UUID
 
 from dependency_injector.wiring import Provide, inject
@@ -7,7 +9,16 @@ from marshmallow import ValidationError
 
 from accounts.models import AccountBase, CheckingAccount, SavingsAccount, CustodyAccount
 from core.models import Account
+from core.money import Money
 from core.services import IAccountService
+from core.timeframes import DateRange
+
+
+# Number of account ids resolved per query by the batch balance lookup
+BALANCE_BATCH_SIZE = 500
+
+# How far a checking account may be overdrawn
+OVERDRAFT_LIMIT = Money.of("1000.00")
 
 
 # Concrete implementation of the IAccountService
@@ -39,47 +50,189 @@ class AccountService(IAccountService):
         except CustodyAccount.DoesNotExist:
             raise ValueError("Bank custody account is not set up. Please check the database configuration.")
 
-    def get_balance(self, account_id: UUID) -> float:
+    def get_balance(self, account_id: UUID) -> Money:
         account = self.get_account(account_id)
 
         if isinstance(account, CustodyAccount):
-            return 0.0
+            return Money(0)
         else:
-            opening_balance = account.opening_balance
-            balance = float(opening_balance)
-
-            # Fetch transaction history and calculate the balance
-            transactions = self.transaction_service.get_transaction_history(account_id, "all_time")
-            for single_transaction in transactions:
-                if single_transaction["sending_account_id"] == str(account_id):
-                    balance -= float(single_transaction["amount"])
-                elif single_transaction["receiving_account_id"] == str(account_id):
-                    balance += float(single_transaction["amount"])
+            # The ledger balance is kept up to date by the transaction service, so no history replay is needed
+            return Money.of(account.opening_balance) + Money.of(account.ledger_balance)
+
+    def get_balance_at(self, account_id: UUID, timestamp: datetime) -> Money:
+        """
+        Compute the balance an account had at a point in time, for statements, interest and disputes.
+
+        :param account_id: UUID of the account.
+        :param timestamp: The point in time, transactions at or after it are not included.
+        :return: The opening balance plus the net ledger amount before the point in time.
+        :raises ValidationError: If the account does not exist.
+        """
+        account = self.get_account(account_id)
+        if not account:
+            raise ValidationError(f"Account with ID {account_id} does not exist.")
+
+        if isinstance(account, CustodyAccount):
+            return Money(0)
+        return Money.of(account.opening_balance) + Money.of(self.transaction_service.get_ledger_balance_at(account_id, timestamp))
+
+    def get_balance_series(self, account_id: UUID, timeframe: Union[str, DateRange], interval: str = "day", max_points: int = 366) -> List[dict]:
+        """
+        Compute the closing balance of an account for every day or hour of a timeframe, for balance charts.
+
+        :param account_id: UUID of the account.
+        :param timeframe: A DateRange or a timeframe option.
+        :param interval: 'day' or 'hour'.
+        :param max_points: Maximum number of points, longer series are thinned out.
+        :return: A list of dictionaries with the 'date' of each point and the 'balance' at its end, in time order,
+                 empty for custody accounts.
+        :raises ValidationError: If the account does not exist.
+        :raises ValueError: If the timeframe, the interval or the point count is invalid.
+        """
+        account = self.get_account(account_id)
+        if not account:
+            raise ValidationError(f"Account with ID {account_id} does not exist.")
+
+        # custody accounts hold stocks, they have no money balance to chart
+        if isinstance(account, CustodyAccount):
+            return []
+
+        series = self.transaction_service.get_balance_series(account_id, timeframe, interval=interval, max_points=max_points)
+        opening_balance = Money.of(account.opening_balance)
+        return [{"date": point["date"], "balance": opening_balance + Money.of(point["balance"])} for point in series]
+
+    def get_balances(self, account_ids: List[UUID]) -> Dict[UUID, Decimal]:
+        """
+        Fetch the balances of many accounts at once.
+
+        :param account_ids: UUIDs of the accounts, unknown accounts are left out of the result.
+        :return: A dictionary mapping account ids to their exact balance.
+        """
+        return self._fetch_balances(account_ids)
+
+    def _fetch_balances(self, account_ids: List[UUID], lock: bool = False) -> Dict[UUID, Decimal]:
+        account_ids = list(account_ids)
+        balances = {}
+
+        for i in range(0, len(account_ids), BALANCE_BATCH_SIZE):
+            accounts = AccountBase.objects.filter(account_id__in=account_ids[i:i + BALANCE_BATCH_SIZE])
+            if lock:
+                accounts = accounts.select_for_update()
+            # The opening balances live on the concrete account tables and are joined into the same query
+            rows = accounts.values_list(
+                "account_id",
+                "type",
+                "ledger_balance",
+                "checkingaccount__opening_balance",
+                "savingsaccount__opening_balance",
+            )
+            for account_id, account_type, ledger_balance, checking_opening_balance, savings_opening_balance in rows:
+                if account_type == "custody":
+                    balances[account_id] = Decimal("0.00")
                 else:
-                    raise ValidationError(f"Transaction not made with this account")
+                    opening_balance = checking_opening_balance if checking_opening_balance is not None else savings_opening_balance
+                    balances[account_id] = (opening_balance or Decimal("0.00")) + ledger_balance
+
+        return balances
+
+    def get_account_totals(self, account_id: UUID, timeframe: Union[str, DateRange]) -> dict:
+        # Sent and received amounts are summed by the database instead of replaying the history in Python
+        totals = self.transaction_service.aggregate_account_amounts(account_id, timeframe)
+
+        return {"total_sent": totals["total_sent"], "total_received": totals["total_received"]}
+
+    def rebuild_balances(self, fix: bool = True) -> List[dict]:
+        """
+        Recompute the ledger balance of every account from the journal and report any drift.
 
-            return round(balance, 2)
+        :param fix: Write the recomputed balance back to every drifting account.
+        :return: A list of dictionaries describing the drifting accounts.
+        """
+        drifts = []
+        with transaction.atomic():
+            # Lock the accounts first so that no posting can slip in between recomputing and writing
+            accounts = list(AccountBase.objects.select_for_update().only("account_id", "ledger_balance"))
+            net_amounts = self.transaction_service.get_net_amounts()
+
+            for account in accounts:
+                expected_balance = net_amounts.get(account.account_id, Decimal("0.00"))
+                if account.ledger_balance != expected_balance:
+                    drifts.append({
+                        "account_id": account.account_id,
+                        "stored_balance": account.ledger_balance,
+                        "expected_balance": expected_balance,
+                    })
+                    if fix:
+                        AccountBase.objects.filter(account_id=account.account_id).update(ledger_balance=expected_balance)
+
+        return drifts
+
+    def create_transactions_batch(self, transfers: List[dict], all_or_nothing: bool = False) -> dict:
+        """
+        Validate and post a batch of transfers, e.g. from a payroll or payment file, in a single commit.
+
+        All accounts are resolved in one query and locked, every transfer is checked against the
+        overdraft limit using the running balances of the transfers before it, and the valid
+        transfers are written in bulk.
+
+        :param transfers: Dictionaries with the 'amount', 'sending_account_id' and 'receiving_account_id' of each transfer.
+        :param all_or_nothing: Write nothing if any transfer fails validation.
+        :return: A dictionary with the number of 'created' transactions and the per-item 'failures' as
+                 dictionaries with the 'index' of the transfer and the 'error'.
+        """
+        failures = []
+        valid_transfers = []
+
+        def as_uuid(value):
+            try:
+                return value if isinstance(value, UUID) else UUID(str(value))
+            except ValueError:
+                return None
 
-    def get_account_totals(self, account_id: UUID, timeframe: str) -> dict:
-        total_received = 0.0
-        total_sent = 0.0
+        with transaction.atomic():
+            account_ids = {as_uuid(t.get(key)) for t in transfers for key in ("sending_account_id", "receiving_account_id")}
+            fetched_balances = self._fetch_balances([account_id for account_id in account_ids if account_id], lock=True)
+            balances = {account_id: Money.of(balance) for account_id, balance in fetched_balances.items()}
+
+            for index, transfer in enumerate(transfers):
+                sending_account_id = as_uuid(transfer.get("sending_account_id"))
+                receiving_account_id = as_uuid(transfer.get("receiving_account_id"))
+
+                try:
+                    amount = Money.of(transfer.get("amount"))
+                except ValueError:
+                    failures.append({"index": index, "error": "Transaction amount must be a number."})
+                    continue
+
+                if sending_account_id not in balances:
+                    error = f"Sending account with ID {transfer.get('sending_account_id')} does not exist."
+                elif receiving_account_id not in balances:
+                    error = f"Receiving account with ID {transfer.get('receiving_account_id')} does not exist."
+                elif amount <= 0:
+                    error = "Transaction amount must be greater than zero."
+                elif balances[sending_account_id] - amount + OVERDRAFT_LIMIT < 0:
+                    error = f"Overdraft limit ({float(OVERDRAFT_LIMIT)}) overreached"
+                else:
+                    error = None
 
-        transaction_history = self.transaction_service.get_transaction_history(account_id, timeframe)
+                if error:
+                    failures.append({"index": index, "error": error})
+                    continue
 
-        # Calculate total sent and received amounts
-        for single_transaction in transaction_history:
-            if str(single_transaction["sending_account_id"]) == str(account_id):
-                total_sent += float(single_transaction["amount"])
-            elif str(single_transaction["receiving_account_id"]) == str(account_id):
-                total_received += float(single_transaction["amount"])
-            else:
-                raise ValidationError(f"Rogue transaction.")
+                # Later transfers of the batch see the balances after this one
+                balances[sending_account_id] -= amount
+                balances[receiving_account_id] += amount
+                valid_transfers.append({
+                    "amount": amount.to_decimal(),
+                    "sending_account_id": sending_account_id,
+                    "receiving_account_id": receiving_account_id,
+                })
 
-        # Round totals to 2 decimal places
-        total_sent = round(total_sent, 2)
-        total_received = round(total_received, 2)
+            created = 0
+            if valid_transfers and not (all_or_nothing and failures):
+                created = self.transaction_service.bulk_create_transactions(valid_transfers)
 
-        return {"total_sent": total_sent, "total_received": total_received}
+        return {"created": created, "failures": failures}
 
     def validate_accounts_for_transaction(self, amount: float, sending_account_id: UUID, receiving_account_id: UUID) -> bool:
         with transaction.atomic():
@@ -94,22 +247,20 @@ class AccountService(IAccountService):
                 raise ValidationError(f"Receiving account with ID {receiving_account_id} does not exist.")
 
             # Validate the transaction amount
-            amount = float(amount)
+            amount = Money.of(amount)
             if amount <= 0:
                 raise ValidationError("Transaction amount must be greater than zero.")
 
-            overdraft_limit = 1000.00  # Overdraft limit in float
-
             # Calculate the current balance of the sending account
-            current_balance = self.get_balance(sending_account_id)
+            current_balance = Money.of(self.get_balance(sending_account_id))
 
             # Check if the transaction exceeds the overdraft limit
-            if current_balance - amount + overdraft_limit < 0:
-                raise ValidationError(f"Overdraft limit ({overdraft_limit}) overreached")
+            if current_balance - amount + OVERDRAFT_LIMIT < 0:
+                raise ValidationError(f"Overdraft limit ({float(OVERDRAFT_LIMIT)}) overreached")
 
         return True
 
-    def validate_account_for_atm(self, amount: float, account_id: UUID, pin: str) -> bool:
+    def validate_account_for_atm(self, amount: float, account_id: UUID, pin: str, check_balance: bool = True) -> bool:
         with transaction.atomic():
             account = self.get_account(account_id)
             if not account:
@@ -121,13 +272,15 @@ class AccountService(IAccountService):
             if account.PIN != pin:
                 raise ValidationError("Invalid PIN.")
 
-            overdraft_limit = 1000.00  # Overdraft limit in float
+            # A retried withdrawal is already included in the balance
+            if not check_balance:
+                return True
 
             # Calculate the current balance of the sending account
-            current_balance = self.get_balance(account_id)
+            current_balance = Money.of(self.get_balance(account_id))
 
-            if current_balance - amount + overdraft_limit < 0:
-                raise ValidationError(f"Overdraft limit ({overdraft_limit}) overreached")
+            if current_balance - Money.of(amount) + OVERDRAFT_LIMIT < 0:
+                raise ValidationError(f"Overdraft limit ({float(OVERDRAFT_LIMIT)}) overreached")
 
         return True
 
@@ -155,7 +308,7 @@ class AccountService(IAccountService):
             raise ValidationError(f"Deposit failed: {str(e)}")
 
     def withdraw_savings(self, account_id: UUID, amount: float):
-        amount = float(amount)
+        amount = Money.of(amount)
         if amount <= 0:
             raise ValidationError("Withdrawal amount must be greater than zero.")
 
@@ -169,10 +322,10 @@ class AccountService(IAccountService):
 
         try:
             with transaction.atomic():
-                if amount > self.get_balance(savings_account.account_id):
-                    raise ValidationError(f"Withdrawal amount ({amount}) exceeds balance.")
+                if amount > Money.of(self.get_balance(savings_account.account_id)):
+                    raise ValidationError(f"Withdrawal amount ({float(amount)}) exceeds balance.")
                 self.transaction_service.create_new_transaction(
-                    amount=amount,
+                    amount=amount.to_decimal(),
                     sending_account_id=savings_account.account_id,
                     receiving_account_id=reference_account_id,
                 )
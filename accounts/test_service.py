@@ -1,10 +1,15 @@
 import unittest
+from django.test import TestCase as DjangoTestCase
 from unittest.mock import Mock, patch, MagicMock
+from datetime import datetime, timezone
 from decimal import Decimal
 from marshmallow import ValidationError
 from uuid import uuid4, UUID
 
 from accounts.services import AccountService
+from core.money import Money
+from core.timeframes import INVALID_TIMEFRAME_MESSAGE
+from transactions.services import TransactionService
 from accounts.models import Account
 from accounts.models import CheckingAccount, SavingsAccount, CustodyAccount
 
@@ -124,94 +129,78 @@ class TestAccountService(unittest.TestCase):
             self.transaction_service.get_transaction_history.assert_not_called()
 
     def test_get_balance_checking_account(self):
-            # Mock a checking account with opening balance and transaction history
+            # Mock a checking account with opening balance and materialized ledger balance
             checking_account = FakeCheckingAccount()
             checking_account.account_id = UUID("123e4567-e89b-12d3-a456-426614174003")
             checking_account.opening_balance = 1000.0
+            checking_account.ledger_balance = Decimal("-50.00")
 
             # Mock get_account to return the checking account
             self.account_service.get_account = Mock(return_value=checking_account)
 
-            # Mock transaction history with the correct structure
-            self.transaction_service.get_transaction_history = Mock(return_value=[
-                {
-                    "transaction_id": "txn-001",
-                    "sending_account_id": str(checking_account.account_id),
-                    "receiving_account_id": "another-account-id",
-                    "amount": "100.0",
-                    "date": "2025-01-16 12:00:00",
-                },
-                {
-                    "transaction_id": "txn-002",
-                    "sending_account_id": "another-account-id",
-                    "receiving_account_id": str(checking_account.account_id),
-                    "amount": "50.0",
-                    "date": "2025-01-16 12:30:00",
-                },
-            ])
-
             # Mock isinstance for CheckingAccount
             with patch("accounts.services.isinstance", lambda obj, cls: isinstance(obj, FakeCheckingAccount) if cls is CheckingAccount else False):
                 # Call the get_balance method
                 balance = self.account_service.get_balance(checking_account.account_id)
 
                 # Assertions
-                self.assertEqual(balance, 950.0)  # (1000 - 100 + 50 = 950)
-                self.transaction_service.get_transaction_history.assert_called_once_with(checking_account.account_id, "all_time")
+                self.assertEqual(balance, 950.0)  # (1000 - 50 = 950)
+                self.transaction_service.get_transaction_history.assert_not_called()
 
-    def test_get_balance_checking_account_no_history(self):
-        # Mock a checking account with opening balance and transaction history
+    def test_get_balance_at(self):
         checking_account = FakeCheckingAccount()
         checking_account.account_id = UUID("123e4567-e89b-12d3-a456-426614174003")
         checking_account.opening_balance = 1000.0
+        timestamp = datetime(2024, 3, 1, tzinfo=timezone.utc)
 
-        # Mock get_account to return the checking account
         self.account_service.get_account = Mock(return_value=checking_account)
+        self.transaction_service.get_ledger_balance_at.return_value = Decimal("-50.25")
 
-        # Mock transaction history with the correct structure
-        self.transaction_service.get_transaction_history = Mock(return_value=[])
-        # Mock isinstance for CheckingAccount
-        with patch("accounts.services.isinstance", lambda obj, cls: isinstance(obj, FakeCheckingAccount) if cls is CheckingAccount else False):
-            # Call the get_balance method
-            balance = self.account_service.get_balance(checking_account.account_id)
+        with patch("accounts.services.isinstance", lambda obj, cls: False):
+            balance = self.account_service.get_balance_at(checking_account.account_id, timestamp)
 
-            # Assertions
-            self.assertEqual(balance, 1000)
-            self.transaction_service.get_transaction_history.assert_called_once_with(checking_account.account_id, "all_time")
+        self.assertEqual(balance, Money.of("949.75"))
+        self.transaction_service.get_ledger_balance_at.assert_called_once_with(checking_account.account_id, timestamp)
 
-    def test_get_balance_checking_account_transaction_not_made_with_this_account(self):
-        # Mock a checking account with opening balance and transaction history
+    def test_get_balance_series_adds_opening_balance(self):
         checking_account = FakeCheckingAccount()
         checking_account.account_id = UUID("123e4567-e89b-12d3-a456-426614174003")
         checking_account.opening_balance = 1000.0
+        day = datetime(2024, 3, 1, tzinfo=timezone.utc)
 
-        # Mock get_account to return the checking account
         self.account_service.get_account = Mock(return_value=checking_account)
+        self.transaction_service.get_balance_series.return_value = [{"date": day, "balance": Decimal("-12.50")}]
+
+        with patch("accounts.services.isinstance", lambda obj, cls: False):
+            series = self.account_service.get_balance_series(checking_account.account_id, "30_days")
 
-        # Mock transaction history with the correct structure
-        self.transaction_service.get_transaction_history = Mock(return_value=[
-            {
-                "transaction_id": "txn-001",
-                "sending_account_id": "another-account-id",
-                "receiving_account_id": "another-account-id",
-                "amount": "100.0",
-                "date": "2025-01-16 12:00:00",
-            },
-            {
-                "transaction_id": "txn-002",
-                "sending_account_id": "another-account-id",
-                "receiving_account_id": "another-account-id",
-                "amount": "50.0",
-                "date": "2025-01-16 12:30:00",
-            },
-        ])
+        self.assertEqual(series, [{"date": day, "balance": Money.of("987.50")}])
+        self.transaction_service.get_balance_series.assert_called_once_with(checking_account.account_id, "30_days", interval="day", max_points=366)
+
+    def test_get_balance_at_account_not_found(self):
+        self.account_service.get_account = Mock(return_value=None)
+
+        with self.assertRaises(ValidationError):
+            self.account_service.get_balance_at(uuid4(), datetime(2024, 3, 1, tzinfo=timezone.utc))
+
+    def test_get_balance_checking_account_no_history(self):
+        # Mock a checking account with opening balance and no posted transactions
+        checking_account = FakeCheckingAccount()
+        checking_account.account_id = UUID("123e4567-e89b-12d3-a456-426614174003")
+        checking_account.opening_balance = 1000.0
+        checking_account.ledger_balance = Decimal("0.00")
+
+        # Mock get_account to return the checking account
+        self.account_service.get_account = Mock(return_value=checking_account)
 
         # Mock isinstance for CheckingAccount
         with patch("accounts.services.isinstance", lambda obj, cls: isinstance(obj, FakeCheckingAccount) if cls is CheckingAccount else False):
-            with self.assertRaises(ValidationError) as context:
-                balance = self.account_service.get_balance(checking_account.account_id)
+            # Call the get_balance method
+            balance = self.account_service.get_balance(checking_account.account_id)
 
-            self.assertEqual(str(context.exception), "Transaction not made with this account")
+            # Assertions
+            self.assertEqual(balance, 1000)
+            self.transaction_service.get_transaction_history.assert_not_called()
 
     def test_get_account_totals(self):
             checking_account = FakeCheckingAccount()
@@ -221,56 +210,26 @@ class TestAccountService(unittest.TestCase):
             # Mock get_account to return the checking account
             self.account_service.get_account = Mock(return_value=checking_account)
 
-            self.transaction_service.get_transaction_history = Mock(return_value=[
-                {
-                    "transaction_id": "txn-001",
-                    "sending_account_id": str(checking_account.account_id),
-                    "receiving_account_id": "another-account-id",
-                    "amount": "100.0",
-                    "date": "2025-01-16 12:00:00",
-                },
-                {
-                    "transaction_id": "txn-002",
-                    "sending_account_id": "another-account-id",
-                    "receiving_account_id": str(checking_account.account_id),
-                    "amount": "50.0",
-                    "date": "2025-01-16 12:30:00",
-                },
-            ])
+            self.transaction_service.aggregate_account_amounts = Mock(return_value={
+                "total_sent": Decimal("100.00"),
+                "total_received": Decimal("50.00"),
+                "net": Decimal("-50.00"),
+            })
 
             result = self.account_service.get_account_totals(checking_account.account_id, "all_time")
 
-            self.assertEqual(result, {"total_sent": 100.0, "total_received": 50.0})
-
-    def test_get_account_totals_rouge_transaction(self):
-        checking_account = FakeCheckingAccount()
-        checking_account.account_id = UUID("123e4567-e89b-12d3-a456-426614174003")
-        checking_account.opening_balance = 1000.0
-
-        # Mock get_account to return the checking account
-        self.account_service.get_account = Mock(return_value=checking_account)
+            self.assertEqual(result, {"total_sent": Decimal("100.00"), "total_received": Decimal("50.00")})
+            self.transaction_service.aggregate_account_amounts.assert_called_once_with(checking_account.account_id, "all_time")
+            self.transaction_service.get_transaction_history.assert_not_called()
 
-        self.transaction_service.get_transaction_history = Mock(return_value=[
-            {
-                "transaction_id": "txn-001",
-                "sending_account_id": "another-account-id",
-                "receiving_account_id": "another-account-id",
-                "amount": "100.0",
-                "date": "2025-01-16 12:00:00",
-            },
-            {
-                "transaction_id": "txn-002",
-                "sending_account_id": "another-account-id",
-                "receiving_account_id": "another-account-id",
-                "amount": "50.0",
-                "date": "2025-01-16 12:30:00",
-            },
-        ])
+    def test_get_account_totals_invalid_timeframe(self):
+        # the real transaction service rejects the timeframe before reading any transactions
+        account_service = AccountService(TransactionService())
 
-        with self.assertRaises(ValidationError) as context:
-            result = self.account_service.get_account_totals(checking_account.account_id, "all_time")
+        with self.assertRaises(ValueError) as context:
+            account_service.get_account_totals(uuid4(), "invalid_timeframe")
 
-        self.assertEqual(str(context.exception), "Rogue transaction.")
+        self.assertEqual(str(context.exception), INVALID_TIMEFRAME_MESSAGE)
 
     def test_validate_accounts_for_transaction_not_sending_account(self):
         checking_account = FakeCheckingAccount()
@@ -618,3 +577,128 @@ class TestAccountService(unittest.TestCase):
         patch.stopall()
 
 
+
+
+class TestAccountServiceBalances(DjangoTestCase):
+    def setUp(self):
+        self.transaction_service = Mock()
+        self.account_service = AccountService(self.transaction_service)
+
+        self.checking_account = CheckingAccount.objects.create(PIN="1234", opening_balance=Decimal("1000.00"), ledger_balance=Decimal("-250.50"))
+        self.savings_account = SavingsAccount.objects.create(reference_account=self.checking_account, opening_balance=Decimal("200.00"), ledger_balance=Decimal("50.25"))
+        self.custody_account = CustodyAccount.objects.create(reference_account=self.checking_account)
+
+    def test_get_balances(self):
+        with self.assertNumQueries(1):
+            balances = self.account_service.get_balances([
+                self.checking_account.account_id,
+                self.savings_account.account_id,
+                self.custody_account.account_id,
+                uuid4(),
+            ])
+
+        self.assertEqual(balances, {
+            self.checking_account.account_id: Decimal("749.50"),
+            self.savings_account.account_id: Decimal("250.25"),
+            self.custody_account.account_id: Decimal("0.00"),
+        })
+
+    def test_get_balances_matches_get_balance(self):
+        balances = self.account_service.get_balances([self.checking_account.account_id, self.savings_account.account_id])
+
+        self.assertEqual(float(balances[self.checking_account.account_id]), self.account_service.get_balance(self.checking_account.account_id))
+        self.assertEqual(float(balances[self.savings_account.account_id]), self.account_service.get_balance(self.savings_account.account_id))
+
+    def test_get_balances_empty(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.account_service.get_balances([]), {})
+
+    def test_create_transactions_batch_uses_running_balances(self):
+        # The checking account can spend 749.50 plus the 1000.00 overdraft
+        transfers = [
+            {"amount": "1000.00", "sending_account_id": self.checking_account.account_id, "receiving_account_id": self.savings_account.account_id},
+            {"amount": "700.00", "sending_account_id": str(self.checking_account.account_id), "receiving_account_id": str(self.savings_account.account_id)},
+            {"amount": "100.00", "sending_account_id": self.checking_account.account_id, "receiving_account_id": self.savings_account.account_id},
+            {"amount": "-5", "sending_account_id": self.checking_account.account_id, "receiving_account_id": self.savings_account.account_id},
+            {"amount": "abc", "sending_account_id": self.checking_account.account_id, "receiving_account_id": self.savings_account.account_id},
+            {"amount": "10.00", "sending_account_id": uuid4(), "receiving_account_id": self.savings_account.account_id},
+            {"amount": "10.00", "sending_account_id": self.savings_account.account_id, "receiving_account_id": "not-an-account"},
+            {"amount": "40.00", "sending_account_id": self.savings_account.account_id, "receiving_account_id": self.checking_account.account_id},
+        ]
+        self.account_service.transaction_service.bulk_create_transactions.return_value = 3
+
+        # one account query, wrapped in a savepoint
+        with self.assertNumQueries(3):
+            result = self.account_service.create_transactions_batch(transfers)
+
+        self.assertEqual(result["created"], 3)
+        self.assertEqual([failure["index"] for failure in result["failures"]], [2, 3, 4, 5, 6])
+        self.assertEqual(result["failures"][0]["error"], "Overdraft limit (1000.0) overreached")
+        self.assertEqual(result["failures"][1]["error"], "Transaction amount must be greater than zero.")
+        self.assertEqual(result["failures"][4]["error"], "Receiving account with ID not-an-account does not exist.")
+
+        posted = self.account_service.transaction_service.bulk_create_transactions.call_args[0][0]
+        self.assertEqual([transfer["amount"] for transfer in posted], [Decimal("1000.00"), Decimal("700.00"), Decimal("40.00")])
+        self.assertEqual(posted[1]["sending_account_id"], self.checking_account.account_id)
+
+    def test_create_transactions_batch_all_or_nothing(self):
+        transfers = [
+            {"amount": "10.00", "sending_account_id": self.checking_account.account_id, "receiving_account_id": self.savings_account.account_id},
+            {"amount": "10.00", "sending_account_id": uuid4(), "receiving_account_id": self.savings_account.account_id},
+        ]
+
+        result = self.account_service.create_transactions_batch(transfers, all_or_nothing=True)
+
+        self.assertEqual(result["created"], 0)
+        self.assertEqual(len(result["failures"]), 1)
+        self.account_service.transaction_service.bulk_create_transactions.assert_not_called()
+
+    def test_validate_account_for_atm_retry_skips_overdraft_limit(self):
+        with self.assertRaises(ValidationError):
+            self.account_service.validate_account_for_atm(2000, self.checking_account.account_id, "1234")
+
+        # a retried withdrawal is already included in the balance, only the account and PIN are checked
+        self.assertTrue(self.account_service.validate_account_for_atm(2000, self.checking_account.account_id, "1234", check_balance=False))
+        with self.assertRaises(ValidationError):
+            self.account_service.validate_account_for_atm(2000, self.checking_account.account_id, "4321", check_balance=False)
+
+    def test_rebuild_balances_reports_and_fixes_drift(self):
+        drifting_account = FakeCheckingAccount()
+        drifting_account.account_id = uuid4()
+        drifting_account.ledger_balance = Decimal("10.00")
+
+        matching_account = FakeCheckingAccount()
+        matching_account.account_id = uuid4()
+        matching_account.ledger_balance = Decimal("-20.00")
+
+        with patch("accounts.services.AccountBase") as mock_account_base:
+            mock_account_base.objects.select_for_update.return_value.only.return_value = [drifting_account, matching_account]
+            self.transaction_service.get_net_amounts.return_value = {
+                drifting_account.account_id: Decimal("15.00"),
+                matching_account.account_id: Decimal("-20.00"),
+            }
+
+            drifts = self.account_service.rebuild_balances()
+
+            self.assertEqual(drifts, [{
+                "account_id": drifting_account.account_id,
+                "stored_balance": Decimal("10.00"),
+                "expected_balance": Decimal("15.00"),
+            }])
+            mock_account_base.objects.filter.assert_called_once_with(account_id=drifting_account.account_id)
+            mock_account_base.objects.filter.return_value.update.assert_called_once_with(ledger_balance=Decimal("15.00"))
+
+    def test_rebuild_balances_verify_only(self):
+        drifting_account = FakeCheckingAccount()
+        drifting_account.account_id = uuid4()
+        drifting_account.ledger_balance = Decimal("10.00")
+
+        with patch("accounts.services.AccountBase") as mock_account_base:
+            mock_account_base.objects.select_for_update.return_value.only.return_value = [drifting_account]
+            self.transaction_service.get_net_amounts.return_value = {}
+
+            drifts = self.account_service.rebuild_balances(fix=False)
+
+            self.assertEqual(len(drifts), 1)
+            self.assertEqual(drifts[0]["expected_balance"], Decimal("0.00"))
+            mock_account_base.objects.filter.assert_not_called()
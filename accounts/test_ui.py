@@ -1,7 +1,12 @@
+import json
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
 from unittest.mock import patch
 from dependency_injector import containers, providers
 from django.urls import reverse
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from uuid import uuid4
 from django.core.exceptions import ValidationError
 
@@ -55,6 +60,8 @@ class AccountViewsTest(TestCase):
 
         # Mock transaction service behavior
         c.transaction_service().get_transaction_history.return_value = []
+        c.transaction_service().is_replay.return_value = False
+        c.transaction_service().get_transaction_history_page.return_value = {"transactions": [], "next_cursor": None}
         c.transaction_service().create_new_transaction.return_value = None
 
         # Mock account totals
@@ -120,6 +127,105 @@ class AccountViewsTest(TestCase):
         self.assertEqual(response.context["total_sent"], 0)
         self.assertEqual(response.context["selected_timeframe"], "all_time")
 
+    def test_account_history_passes_cursor(self):
+        self.container.transaction_service().get_transaction_history_page.return_value = {"transactions": [], "next_cursor": "next-page"}
+
+        response = self.client.get(reverse("accounts:history", args=[self.account_id]), {"timeframe": "30_days", "cursor": "some-page"})
+
+        self.assertEqual(response.status_code, 200)
+        self.container.transaction_service().get_transaction_history_page.assert_called_with(self.account_id, "30_days", cursor="some-page")
+        self.assertEqual(response.context["next_cursor"], "next-page")
+        self.assertFalse(response.context["is_first_page"])
+
+    def test_account_history_invalid_cursor(self):
+        self.container.transaction_service().get_transaction_history_page.side_effect = ValueError("Invalid cursor.")
+
+        response = self.client.get(reverse("accounts:history", args=[self.account_id]), {"cursor": "broken"})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_account_history_custom_date_range(self):
+        response = self.client.get(reverse("accounts:history", args=[self.account_id]), {"start": "2024-01-01", "end": "2024-03-31"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["selected_timeframe"], "custom")
+        self.assertEqual(response.context["range_query"], "start=2024-01-01&end=2024-03-31")
+        date_range = self.container.transaction_service().get_transaction_history_page.call_args[0][1]
+        self.assertEqual(date_range.start.date(), date(2024, 1, 1))
+        self.assertEqual(date_range.end.date(), date(2024, 4, 1))
+        self.container.account_service().get_account_totals.assert_called_with(self.account_id, date_range)
+
+    def test_account_history_balance_chart(self):
+        self.container.account_service().get_balance_series.return_value = [
+            {"date": datetime(2024, 3, 1, tzinfo=timezone.utc), "balance": Decimal("100.00")},
+            {"date": datetime(2024, 3, 2, tzinfo=timezone.utc), "balance": Decimal("87.50")},
+        ]
+
+        response = self.client.get(reverse("accounts:history", args=[self.account_id]), {"timeframe": "30_days"})
+
+        self.assertEqual(response.status_code, 200)
+        self.container.account_service().get_balance_series.assert_called_with(self.account_id, "30_days")
+        self.assertEqual(response.context["balance_chart"], {"labels": ["2024-03-01", "2024-03-02"], "balances": [100.0, 87.5]})
+
+    def test_account_history_all_time_chart_is_capped(self):
+        response = self.client.get(reverse("accounts:history", args=[self.account_id]))
+
+        self.assertEqual(response.status_code, 200)
+        chart_range = self.container.account_service().get_balance_series.call_args[0][1]
+        self.assertAlmostEqual((chart_range.start - (datetime.now(timezone.utc) - timedelta(days=365))).total_seconds(), 0, delta=60)
+        self.assertIsNone(chart_range.end)
+
+    def test_account_history_older_pages_skip_the_chart(self):
+        response = self.client.get(reverse("accounts:history", args=[self.account_id]), {"cursor": "next"})
+
+        self.assertEqual(response.status_code, 200)
+        self.container.account_service().get_balance_series.assert_not_called()
+
+    def test_account_history_invalid_date_range(self):
+        response = self.client.get(reverse("accounts:history", args=[self.account_id]), {"start": "2024-03-01", "end": "2024-01-01"})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_account_statement_streams_csv(self):
+        row = MagicMock(transaction_id=uuid4(), date=datetime(2024, 3, 1, 12, 0, tzinfo=timezone.utc), sending_account_id=self.account_id, receiving_account_id=None, amount=Decimal("12.50"), kind="atm")
+        self.container.transaction_service().iter_transaction_history.return_value = iter([row])
+
+        response = self.client.get(reverse("accounts:statement", args=[self.account_id]), {"start": "2024-01-01", "end": "2024-03-31"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "date,transaction_id,sending_account_id,receiving_account_id,amount,kind")
+        self.assertEqual(lines[1], f"2024-03-01T12:00:00+00:00,{row.transaction_id},{self.account_id},,12.50,atm")
+        _, kwargs = self.container.transaction_service().iter_transaction_history.call_args
+        self.assertEqual(kwargs["start"].date(), date(2024, 1, 1))
+        self.assertEqual(kwargs["end"].date(), date(2024, 4, 1))
+
+    def test_account_statement_streams_jsonl(self):
+        row = MagicMock(transaction_id=uuid4(), date=datetime(2024, 3, 1, 12, 0, tzinfo=timezone.utc), sending_account_id=uuid4(), receiving_account_id=self.account_id, amount=Decimal("7.00"), kind="transfer")
+        self.container.transaction_service().iter_transaction_history.return_value = iter([row])
+
+        response = self.client.get(reverse("accounts:statement", args=[self.account_id]), {"format": "jsonl"})
+
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])["amount"], "7.00")
+        self.assertEqual(json.loads(lines[0])["receiving_account_id"], str(self.account_id))
+
+    def test_account_statement_invalid_parameters(self):
+        response = self.client.get(reverse("accounts:statement", args=[self.account_id]), {"format": "xml"})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(reverse("accounts:statement", args=[self.account_id]), {"start": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_account_statement_unknown_account(self):
+        response = self.client.get(reverse("accounts:statement", args=[uuid4()]))
+
+        self.assertEqual(response.status_code, 404)
+
     def test_new_transaction_get_request(self):
         response = self.client.get(reverse("accounts:new_transaction", args=[self.account_id]))
 
@@ -165,7 +271,19 @@ class AccountViewsTest(TestCase):
             500, self.account_id, self.receiving_account_id
         )
         self.container.transaction_service().create_new_transaction.assert_called_once_with(
-            500, self.account_id, self.receiving_account_id
+            500, self.account_id, self.receiving_account_id, idempotency_key=None
+        )
+
+    def test_new_transaction_passes_idempotency_key(self):
+        response = self.client.get(reverse("accounts:new_transaction", args=[self.account_id]))
+        idempotency_key = response.context["form"].initial["idempotency_key"]
+        self.assertEqual(len(idempotency_key), 32)
+
+        form_data = {"receiving_account_id": self.receiving_account_id, "amount": 500, "idempotency_key": idempotency_key}
+        self.client.post(reverse("accounts:new_transaction", args=[self.account_id]), data=form_data)
+
+        self.container.transaction_service().create_new_transaction.assert_called_once_with(
+            500, self.account_id, self.receiving_account_id, idempotency_key=idempotency_key
         )
 
     def test_new_transaction_post_general_failure(self):
@@ -280,3 +398,91 @@ class AccountViewsTest(TestCase):
         self.assertEqual(response.context["message"], "Transaction of 500.0 EUR successful!")
         self.assertEqual(response.context["account_id"], self.account_id)
 
+
+
+class IdempotentRetryViewsTest(TestCase):
+    # The real services, a retry is answered from the posted transaction instead of being validated again
+
+    def setUp(self):
+        from accounts.models import CheckingAccount
+        from swd_django_demo.containers import Container
+
+        self.sending_account = CheckingAccount.objects.create(PIN="1234", opening_balance=Decimal("0.00"))
+        self.receiving_account = CheckingAccount.objects.create(PIN="1234", opening_balance=Decimal("0.00"))
+        Container().wire(modules=["accounts.views"])
+
+    def test_new_transaction_retry_near_the_overdraft_limit(self):
+        # the first posting leaves 400 of the 1000 overdraft, a second posting of 600 would overreach it
+        form_data = {"receiving_account_id": self.receiving_account.account_id, "amount": 600, "idempotency_key": "retry-1"}
+
+        responses = [self.client.post(reverse("accounts:new_transaction", args=[self.sending_account.account_id]), data=form_data) for _ in range(2)]
+
+        self.assertEqual([response.context["message"] for response in responses], ["Transaction created successfully!"] * 2)
+        self.assertEqual(apps.get_model("transactions", "Transaction").objects.filter(idempotency_key="retry-1").count(), 1)
+
+    def test_new_atm_transaction_retry_near_the_overdraft_limit(self):
+        form_data = {"pin": "1234", "amount": "600.00", "idempotency_key": "atm-1"}
+
+        responses = [self.client.post(reverse("accounts:new_atm_transaction", args=[self.sending_account.account_id]), data=form_data) for _ in range(2)]
+
+        self.assertEqual([response.context["success"] for response in responses], [True, True])
+        self.assertEqual(apps.get_model("transactions", "ATMTransaction").objects.filter(idempotency_key="atm-1").count(), 1)
+
+    def test_new_atm_transaction_retry_still_needs_the_pin(self):
+        url = reverse("accounts:new_atm_transaction", args=[self.sending_account.account_id])
+        self.client.post(url, data={"pin": "1234", "amount": "100.00", "idempotency_key": "atm-2"})
+
+        for pin in ("4321", ""):
+            response = self.client.post(url, data={"pin": pin, "amount": "100.00", "idempotency_key": "atm-2"})
+
+            self.assertFalse(response.context["success"])
+            self.assertEqual(response.context["message"], "Invalid PIN.")
+
+
+class TransactionHistoryQueriesTest(TestCase):
+    # The real services, the cost of the history page must not grow with the history of the account
+
+    def setUp(self):
+        from accounts.models import CheckingAccount
+        from swd_django_demo.containers import Container
+
+        self.account = CheckingAccount.objects.create(PIN="1234", opening_balance=Decimal("100.00"))
+        self.transaction_service = Container().transaction_service()
+        Container().wire(modules=["accounts.views"])
+
+    def post_daily_transactions(self, days):
+        Transaction = apps.get_model("transactions", "Transaction")
+        for day in range(days):
+            for _ in range(3):
+                Transaction.objects.create(sending_account_id=self.account.account_id, amount=Decimal("1.00"), date=datetime.now(timezone.utc) - timedelta(days=day, hours=1))
+        self.transaction_service.rebuild_journal_lines()
+        self.transaction_service.rebuild_monthly_rollups()
+
+    def get_history(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("accounts:history", args=[self.account.account_id]), params)
+        self.assertEqual(response.status_code, 200)
+        return response, queries
+
+    def test_history_page_queries_do_not_grow_with_the_history(self):
+        self.post_daily_transactions(5)
+        response, small = self.get_history()
+        self.assertEqual(response.context["balance_chart"]["balances"][-1], 85.0)
+
+        self.post_daily_transactions(60)
+        response, large = self.get_history()
+
+        self.assertEqual(len(large), len(small))
+        # the journal lines are summed per day by the database, one row per day instead of one per line
+        series_queries = [query["sql"] for query in large if "GROUP BY" in query["sql"] and "journal" in query["sql"]]
+        self.assertTrue(series_queries)
+        self.assertEqual(response.context["balance_chart"]["balances"][-1], -95.0)
+
+    def test_history_chart_only_on_the_first_page(self):
+        self.post_daily_transactions(30)
+        first_page, _ = self.get_history()
+
+        older_page, queries = self.get_history(cursor=first_page.context["next_cursor"])
+
+        self.assertFalse(any("GROUP BY" in query["sql"] and "journal" in query["sql"] for query in queries))
+        self.assertEqual(older_page.context["balance_chart"], {"labels": [], "balances": []})
@@ -1,15 +1,25 @@
+import csv
+import json
 import uuid
+from datetime import timedelta
+from urllib.parse import urlencode
 
 from dependency_injector.wiring import inject, Provide
 from django.db import transaction
 from django.http import Http404
-from django.http import HttpRequest
+from django.http import HttpRequest, HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.timezone import localtime, now
 from django.views.decorators.csrf import csrf_exempt
 from marshmallow import ValidationError
 
 from accounts.forms import TransactionForm, SavingsTransactionForm
+from core.money import Money
 from core.services import ITransactionService, IAccountService
+from core.timeframes import DateRange, parse_timeframe, resolve_timeframe
+
+# The balance chart of a history without a start covers this many days up to its end
+BALANCE_CHART_DAYS = 365
 
 
 @inject
@@ -34,10 +44,13 @@ def new_transaction(request: HttpRequest, account_id, transaction_service: ITran
                 sending_account_id = account_id
                 receiving_account_id = form.cleaned_data["receiving_account_id"]
                 amount = form.cleaned_data["amount"]
-                with transaction.atomic():
-                    account_service.validate_accounts_for_transaction(amount, sending_account_id, receiving_account_id)
-                    # Use the service to create the transaction
-                    transaction_service.create_new_transaction(amount, sending_account_id, receiving_account_id)
+                idempotency_key = form.cleaned_data["idempotency_key"] or None
+                # A retry of a posted transfer succeeds without validating again, the balance already includes it
+                if not transaction_service.is_replay(idempotency_key, amount, sending_account_id, receiving_account_id):
+                    with transaction.atomic():
+                        account_service.validate_accounts_for_transaction(amount, sending_account_id, receiving_account_id)
+                        # Use the service to create the transaction
+                        transaction_service.create_new_transaction(amount, sending_account_id, receiving_account_id, idempotency_key=idempotency_key)
                 success = True
 
             except ValidationError as e:
@@ -54,7 +67,7 @@ def new_transaction(request: HttpRequest, account_id, transaction_service: ITran
             })
 
     else:
-        form = TransactionForm()
+        form = TransactionForm(initial={"idempotency_key": uuid.uuid4().hex})
 
     return render(request, "accounts/new_transaction.html", {"form": form, "account_id": account_id})
 
@@ -74,14 +87,20 @@ def new_atm_transaction(
             # Extract form data
             form_data = request.POST
             pin = form_data.get("pin")
-            amount = float(form_data.get("amount"))
+            amount = Money.of(form_data.get("amount")).to_decimal()
+            # ATMs resend the key of a request that timed out
+            idempotency_key = form_data.get("idempotency_key") or None
+
+            # A retry of a posted withdrawal still needs the PIN, but not the balance check, the balance already includes it
+            replay = transaction_service.is_replay(idempotency_key, amount, account_id, kind="atm")
 
             # Validate the account and PIN
-            account_service.validate_account_for_atm(amount=amount, account_id=account_id, pin=pin)
+            account_service.validate_account_for_atm(amount=amount, account_id=account_id, pin=pin, check_balance=not replay)
 
-            # Perform the ATM transaction
-            atm_id = uuid.uuid4()  # Simulate the ATM ID
-            transaction_service.create_new_atm_transaction(amount=amount, account_id=account_id, atm_id=atm_id)
+            if not replay:
+                # Perform the ATM transaction
+                atm_id = uuid.uuid4()  # Simulate the ATM ID
+                transaction_service.create_new_atm_transaction(amount=amount, account_id=account_id, atm_id=atm_id, idempotency_key=idempotency_key)
 
             # Render the success screen
             return render(
@@ -89,7 +108,7 @@ def new_atm_transaction(
                 "transactions/atm_success_screen.html",
                 {
                     "success": True,
-                    "message": f"Transaction of {amount} EUR successful!",
+                    "message": f"Transaction of {float(amount)} EUR successful!",
                     "account_id": account_id,
                 },
             )
@@ -118,7 +137,7 @@ def new_atm_transaction(
             )
     else:
         # Render the ATM transaction form
-        return render(request, "transactions/atm_transaction_form.html", {"account_id": account_id})
+        return render(request, "transactions/atm_transaction_form.html", {"account_id": account_id, "idempotency_key": uuid.uuid4().hex})
 
 def success_screen(request: HttpRequest, success: bool, message: str, account_id):
     return render(request, 'transactions/success_screen.html', {
@@ -134,31 +153,133 @@ def history(
     account_service: IAccountService = Provide["account_service"],
 ):
     timeframe = request.GET.get("timeframe", "all_time")
+    start_date = request.GET.get("start", "")
+    end_date = request.GET.get("end", "")
+    cursor = request.GET.get("cursor")
 
     # Fetch the account object
     account = account_service.get_account(account_id)
     if not account:
         raise Http404("Account not found.")
 
-    # Fetch transaction history
-    transaction_history = transaction_service.get_transaction_history(account_id, timeframe)
+    # Fetch one page of the transaction history, a custom date range replaces the timeframe option
+    try:
+        if start_date or end_date:
+            timeframe = "custom"
+            date_range = parse_timeframe(start=start_date, end=end_date)
+        else:
+            date_range = timeframe
+        page = transaction_service.get_transaction_history_page(account_id, date_range, cursor=cursor)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    transaction_history = page["transactions"]
     for transaction in transaction_history:
         if transaction["receiving_account_id"] == "None":
             transaction["receiving_account_id"] = "ATM Withdrawal"
 
-    totals = account_service.get_account_totals(account_id, timeframe)
+    totals = account_service.get_account_totals(account_id, date_range)
+
+    # The chart is drawn on the first page only, older pages are plain reads of the history
+    balance_series = []
+    if not cursor:
+        chart_range = date_range
+        resolved_range = resolve_timeframe(date_range)
+        if resolved_range.start is None:
+            # without a start the chart would cover every day since the first transaction
+            chart_range = DateRange(start=(resolved_range.end or now()) - timedelta(days=BALANCE_CHART_DAYS), end=resolved_range.end)
+        balance_series = account_service.get_balance_series(account_id, chart_range)
 
     # Prepare context for rendering
     context = {
         "account": account,
         "transaction_history": transaction_history,
+        "next_cursor": page["next_cursor"],
+        "is_first_page": not cursor,
         "selected_timeframe": timeframe,
+        "start_date": start_date,
+        "end_date": end_date,
+        "range_query": urlencode({"start": start_date, "end": end_date} if timeframe == "custom" else {"timeframe": timeframe}),
         "total_received": totals["total_received"],
         "total_sent": totals["total_sent"],
+        "balance_chart": {
+            "labels": [localtime(point["date"]).strftime("%Y-%m-%d") for point in balance_series],
+            "balances": [float(point["balance"]) for point in balance_series],
+        },
     }
 
     return render(request, "accounts/transaction_history.html", context)
 
+class _Echo:
+    """
+    File-like object whose write() hands the line back, so csv.writer can feed a streaming response.
+    """
+
+    def write(self, value):
+        return value
+
+
+STATEMENT_FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+}
+
+STATEMENT_COLUMNS = ["date", "transaction_id", "sending_account_id", "receiving_account_id", "amount", "kind"]
+
+
+def _statement_values(row):
+    return [
+        row.date.isoformat(),
+        str(row.transaction_id),
+        str(row.sending_account_id) if row.sending_account_id else "",
+        str(row.receiving_account_id) if row.receiving_account_id else "",
+        str(row.amount),
+        row.kind,
+    ]
+
+
+def _csv_statement(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(STATEMENT_COLUMNS)
+    for row in rows:
+        yield writer.writerow(_statement_values(row))
+
+
+def _jsonl_statement(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(STATEMENT_COLUMNS, _statement_values(row)))) + "\n"
+
+
+@inject
+def statement(
+    request: HttpRequest,
+    account_id,
+    transaction_service: ITransactionService = Provide["transaction_service"],
+    account_service: IAccountService = Provide["account_service"],
+):
+    """
+    Stream an account statement as CSV or JSON Lines, limited to a timeframe option or an inclusive
+    start/end date range; the rows are written while they are read from the database.
+    """
+    statement_format = request.GET.get("format", "csv")
+    if statement_format not in STATEMENT_FORMATS:
+        return HttpResponseBadRequest("Invalid format. Valid options are 'csv' or 'jsonl'.")
+
+    try:
+        date_range = parse_timeframe(request.GET.get("timeframe", "all_time"), start=request.GET.get("start"), end=request.GET.get("end"))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    if not account_service.get_account(account_id):
+        raise Http404("Account not found.")
+
+    rows = transaction_service.iter_transaction_history(account_id, start=date_range.start, end=date_range.end)
+    content = _csv_statement(rows) if statement_format == "csv" else _jsonl_statement(rows)
+
+    response = StreamingHttpResponse(content, content_type=STATEMENT_FORMATS[statement_format])
+    response["Content-Disposition"] = f'attachment; filename="statement-{account_id}.{statement_format}"'
+    return response
+
 @inject
 def savings(request: HttpRequest, account_id, transaction_service: ITransactionService = Provide["transaction_service"], account_service: IAccountService = Provide["account_service"]):
     account = account_service.get_account(account_id)
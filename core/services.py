@@ -1,11 +1,15 @@
 from abc import ABC, abstractmethod
-from typing import List
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterator, List, Union
 from uuid import UUID
 
 from django.db import models
 
 from core.models import Account
+from core.money import Money
 from core.models import Product
+from core.timeframes import DateRange
 from swd_django_demo.settings import STOCK_MODEL, STOCK_OWNERSHIP_MODEL
 
 """
@@ -73,11 +77,31 @@ class IAccountService(ABC):
         pass
 
     @abstractmethod
-    def get_balance(self, account_id: UUID) -> float:
+    def get_balance(self, account_id: UUID) -> Money:
         pass
 
     @abstractmethod
-    def get_account_totals(self, account_id: UUID, timeframe:str) -> dict:
+    def get_balance_at(self, account_id: UUID, timestamp: datetime) -> Money:
+        pass
+
+    @abstractmethod
+    def get_balances(self, account_ids: List[UUID]) -> Dict[UUID, Decimal]:
+        pass
+
+    @abstractmethod
+    def get_balance_series(self, account_id: UUID, timeframe: Union[str, DateRange], interval: str = "day", max_points: int = 366) -> List[dict]:
+        pass
+
+    @abstractmethod
+    def get_account_totals(self, account_id: UUID, timeframe: Union[str, DateRange]) -> dict:
+        pass
+
+    @abstractmethod
+    def rebuild_balances(self, fix: bool = True) -> List[dict]:
+        pass
+
+    @abstractmethod
+    def create_transactions_batch(self, transfers: List[dict], all_or_nothing: bool = False) -> dict:
         pass
 
     @abstractmethod
@@ -85,7 +109,7 @@ class IAccountService(ABC):
         pass
 
     @abstractmethod
-    def validate_account_for_atm(self, amount: float, account_id: UUID, pin: str) -> bool:
+    def validate_account_for_atm(self, amount: float, account_id: UUID, pin: str, check_balance: bool = True) -> bool:
         pass
 
     @abstractmethod
@@ -122,23 +146,75 @@ class ICustomerService(ABC):
 class ITransactionService(ABC):
 
     @abstractmethod
-    def create_new_transaction(self, amount: float, sending_account_id: UUID, receiving_account_id: UUID) -> bool:
+    def create_new_transaction(self, amount: float, sending_account_id: UUID, receiving_account_id: UUID, idempotency_key: str = None) -> bool:
+        pass
+
+    @abstractmethod
+    def create_new_stock_transaction(self, amount: float, sending_account_id: UUID, receiving_account_id: UUID, stock_id: UUID, quantity: int, transaction_type: str, idempotency_key: str = None) -> bool:
+        pass
+
+    @abstractmethod
+    def create_new_atm_transaction(self, amount: float, account_id: UUID, atm_id: UUID, idempotency_key: str = None) -> bool:
+        pass
+
+    @abstractmethod
+    def is_replay(self, idempotency_key: str, amount: float, sending_account_id: UUID, receiving_account_id: UUID = None, kind: str = "transfer") -> bool:
+        pass
+
+    @abstractmethod
+    def bulk_create_transactions(self, transfers: List[dict]) -> int:
+        pass
+
+    @abstractmethod
+    def get_transaction_history(self, account_id: UUID, timeframe: Union[str, DateRange]) -> List[dict]:
+        pass
+
+    @abstractmethod
+    def get_transaction_history_page(self, account_id: UUID, timeframe: Union[str, DateRange], cursor: str = None, page_size: int = 50) -> dict:
+        pass
+
+    @abstractmethod
+    def iter_transaction_history(self, account_id: UUID, start: datetime = None, end: datetime = None, chunk_size: int = 2000) -> Iterator[tuple]:
+        pass
+
+    @abstractmethod
+    def get_stock_transaction_history(self, account_id: UUID, timeframe: Union[str, DateRange]) -> List[dict]:
+        pass
+
+    @abstractmethod
+    def aggregate_account_amounts(self, account_id: UUID, timeframe: Union[str, DateRange]) -> Dict[str, Decimal]:
         pass
 
     @abstractmethod
-    def create_new_stock_transaction(self, amount: float, sending_account_id: UUID, receiving_account_id: UUID, stock_id: UUID, quantity: int, transaction_type: str) -> bool:
+    def rebuild_monthly_rollups(self) -> int:
         pass
 
     @abstractmethod
-    def create_new_atm_transaction(self, amount: float, account_id: UUID, atm_id: UUID) -> bool:
+    def rebuild_journal_lines(self) -> int:
         pass
 
     @abstractmethod
-    def get_transaction_history(self, account_id: UUID, timeframe: str) -> List[dict]:
+    def archive_transactions(self, before: datetime = None, batch_size: int = 1000) -> int:
         pass
 
     @abstractmethod
-    def get_stock_transaction_history(self, account_id: UUID, timeframe: str) -> List[dict]:
+    def get_ledger_balance(self, account_id: UUID) -> Decimal:
+        pass
+
+    @abstractmethod
+    def get_ledger_balance_at(self, account_id: UUID, at: datetime) -> Decimal:
+        pass
+
+    @abstractmethod
+    def get_balance_series(self, account_id: UUID, timeframe: Union[str, DateRange], interval: str = "day", max_points: int = 366) -> List[dict]:
+        pass
+
+    @abstractmethod
+    def build_balance_checkpoints(self, cutoff: datetime = None, workers: int = 4, min_transactions: int = 1) -> int:
+        pass
+
+    @abstractmethod
+    def get_net_amounts(self) -> Dict[UUID, Decimal]:
         pass
 
 
@@ -149,6 +225,10 @@ class ITradingService(ABC):
     def get_stock(self, stock_id:UUID) -> STOCK_MODEL:
         pass
 
+    @abstractmethod
+    def get_portfolio(self, account_id: UUID) -> dict:
+        pass
+
     @abstractmethod
     def get_all_user_stocks(self, account_id: UUID) -> List[dict]:
         pass
@@ -158,7 +238,7 @@ class ITradingService(ABC):
         pass
 
     @abstractmethod
-    def get_portfolio_value(self, account_id: UUID) -> float:
+    def get_portfolio_value(self, account_id: UUID) -> Money:
         pass
 
     @abstractmethod
@@ -174,5 +254,28 @@ class ITradingService(ABC):
         pass
 
     @abstractmethod
-    def get_current_stock_price(self, symbol: str) -> float:
+    def get_current_stock_price(self, symbol: str) -> Money:
+        pass
+
+    @abstractmethod
+    def get_current_stock_prices(self, symbols: List[str]) -> Dict[str, Money]:
+        pass
+
+    @abstractmethod
+    def refresh_stock_prices(self, max_age: float = 0, batch_size: int = 100) -> dict:
+        pass
+
+
+class IPriceProvider(ABC):
+
+    @abstractmethod
+    def get_price(self, symbol: str) -> Money:
+        pass
+
+    @abstractmethod
+    def get_prices(self, symbols: List[str]) -> Dict[str, Money]:
+        pass
+
+    @abstractmethod
+    def get_stock_name(self, symbol: str) -> str:
         pass
@@ -1,3 +1,103 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+import numpy as np
 from django.test import TestCase
+from django.utils.timezone import make_aware
+
+from core.money import Money
+from core.timeframes import DateRange, INVALID_TIMEFRAME_MESSAGE, parse_timeframe, resolve_timeframe
+
+
+class TestTimeframes(TestCase):
+
+    def setUp(self) -> None:
+        # Freeze the clock on a fixed point in time
+        self.now = make_aware(datetime(2024, 3, 15, 10, 30))
+        patcher = patch("core.timeframes.now", return_value=self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rolling_timeframes(self):
+        self.assertEqual(parse_timeframe("30_days"), DateRange(start=self.now - timedelta(days=30)))
+        self.assertEqual(parse_timeframe("60_days"), DateRange(start=self.now - timedelta(days=60)))
+        self.assertEqual(parse_timeframe("90_days"), DateRange(start=self.now - timedelta(days=90)))
+
+    def test_all_time_is_unbounded(self):
+        date_range = parse_timeframe("all_time")
+
+        self.assertEqual(date_range, DateRange())
+        self.assertEqual(date_range.filter_kwargs(), {})
+
+    def test_calendar_timeframes(self):
+        self.assertEqual(parse_timeframe("this_month"), DateRange(start=make_aware(datetime(2024, 3, 1))))
+        self.assertEqual(parse_timeframe("last_month"), DateRange(start=make_aware(datetime(2024, 2, 1)), end=make_aware(datetime(2024, 3, 1))))
+        self.assertEqual(parse_timeframe("ytd"), DateRange(start=make_aware(datetime(2024, 1, 1))))
+        self.assertEqual(parse_timeframe("2023-12"), DateRange(start=make_aware(datetime(2023, 12, 1)), end=make_aware(datetime(2024, 1, 1))))
+
+    def test_custom_range_includes_end_date(self):
+        date_range = parse_timeframe("30_days", start="2024-01-10", end=date(2024, 1, 20))
+
+        self.assertEqual(date_range.start, make_aware(datetime(2024, 1, 10)))
+        self.assertEqual(date_range.end, make_aware(datetime(2024, 1, 21)))
+        self.assertEqual(date_range.filter_kwargs("created"), {"created__gte": date_range.start, "created__lt": date_range.end})
+
+    def test_open_ended_custom_range(self):
+        self.assertEqual(parse_timeframe(start="2024-01-10"), DateRange(start=make_aware(datetime(2024, 1, 10))))
+        self.assertEqual(parse_timeframe(end="2024-01-10"), DateRange(end=make_aware(datetime(2024, 1, 11))))
+
+    def test_invalid_timeframes(self):
+        for timeframe in ["invalid_timeframe", "2024-13", "", None]:
+            with self.assertRaises(ValueError) as context:
+                parse_timeframe(timeframe)
+            self.assertEqual(str(context.exception), INVALID_TIMEFRAME_MESSAGE)
+
+    def test_invalid_custom_ranges(self):
+        with self.assertRaises(ValueError):
+            parse_timeframe(start="yesterday")
+        with self.assertRaises(ValueError):
+            parse_timeframe(start="2024-02-01", end="2024-01-01")
+
+    def test_resolve_timeframe_passes_ranges_through(self):
+        date_range = DateRange(start=self.now)
+
+        self.assertIs(resolve_timeframe(date_range), date_range)
+        self.assertEqual(resolve_timeframe("ytd"), parse_timeframe("ytd"))
+
+
+class TestMoney(TestCase):
+
+    def test_amounts_are_rounded_to_whole_cents(self):
+        self.assertEqual(Money.of("10.505").cents, 1051)
+        self.assertEqual(Money.of(0.1).cents, 10)
+        self.assertEqual(Money.of(Decimal("-2.345")).cents, -235)
+        self.assertEqual(Money.of(7).cents, 700)
+        for invalid in ("abc", float("nan"), Decimal("Infinity"), None):
+            with self.assertRaises(ValueError):
+                Money.of(invalid)
+
+    def test_arithmetic_is_exact(self):
+        # ten times 0.10 is 1.00, unlike floats
+        self.assertEqual(Money.sum([0.1] * 10), Money.of(1))
+        self.assertEqual(Money.of("1.10") + Money.of("2.20"), Money.of("3.30"))
+        self.assertEqual(Money.of("5.00") - 7, Money.of("-2.00"))
+        self.assertEqual(Money.of("0.35") * 3, Money.of("1.05"))
+        self.assertEqual(Money.of("10.00") * Decimal("0.125"), Money.of("1.25"))
+        self.assertEqual(Money.of("2.50").to_decimal(), Decimal("2.50"))
+        self.assertEqual(str(Money.of(-3)), "-3.00")
+
+    def test_comparison_with_plain_numbers(self):
+        self.assertEqual(Money.of("950.00"), 950.0)
+        self.assertEqual(Money.of("150.00"), Decimal("150.00"))
+        self.assertNotEqual(Money.of("0.10"), 0.1000001)
+        self.assertLess(Money.of("0.10"), 0.1000001)
+        self.assertGreater(Money.of(1), 0)
+        self.assertEqual(hash(Money.of("950.00")), hash(950))
+        self.assertEqual(float(Money.of("1000.00")), 1000.0)
+
+    def test_vectorized_sum(self):
+        cents = np.full(1_000_000, 1, dtype=np.int64)
 
-# Create your tests here.
+        self.assertEqual(Money.sum_cents(cents), Money.of("10000.00"))
+        self.assertEqual(Money.sum_cents(np.array([], dtype=np.int64)), Money(0))
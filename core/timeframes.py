@@ -0,0 +1,166 @@
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Optional, Union
+
+from django.utils.timezone import is_naive, localtime, make_aware, now
+
+# Rolling timeframes, counted back from the current moment
+ROLLING_TIMEFRAME_DAYS = {
+    "30_days": 30,
+    "60_days": 60,
+    "90_days": 90,
+}
+
+# Calendar months are selected as 'YYYY-MM'
+CALENDAR_MONTH_PATTERN = re.compile(r"^(\d{4})-(\d{2})$")
+
+INVALID_TIMEFRAME_MESSAGE = (
+    "Invalid timeframe. Valid options are '30_days', '60_days', '90_days', 'this_month', "
+    "'last_month', 'ytd', 'all_time' or a calendar month 'YYYY-MM'."
+)
+
+
+@dataclass(frozen=True)
+class DateRange:
+    """
+    Half-open range of points in time [start, end). A missing bound leaves that side open.
+    """
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
+    def filter_kwargs(self, field: str = "date") -> dict:
+        """
+        Translate the range into queryset filter arguments. Both bounds are plain range
+        comparisons, so they can be answered from an index on the date column.
+
+        :param field: Name of the date field to filter on.
+        :return: A dictionary of filter arguments, empty for an unbounded range.
+        """
+        kwargs = {}
+        if self.start is not None:
+            kwargs[f"{field}__gte"] = self.start
+        if self.end is not None:
+            kwargs[f"{field}__lt"] = self.end
+        return kwargs
+
+    def apply(self, query, field: str = "date"):
+        """
+        Restrict a queryset to the range.
+
+        :param query: The queryset to filter.
+        :param field: Name of the date field to filter on.
+        :return: The filtered queryset.
+        """
+        return query.filter(**self.filter_kwargs(field))
+
+
+def _local_midnight(day: date) -> datetime:
+    return make_aware(datetime.combine(day, time.min))
+
+
+def month_of(value: datetime) -> date:
+    """
+    First day of the local calendar month a point in time falls into.
+
+    :param value: The point in time, naive values are taken as local time.
+    :return: The first day of its month.
+    """
+    if is_naive(value):
+        value = make_aware(value)
+    return localtime(value).date().replace(day=1)
+
+
+def next_month(month: date) -> date:
+    """
+    First day of the month after the given month.
+
+    :param month: The first day of a month.
+    :return: The first day of the following month.
+    """
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def month_start(month: date) -> datetime:
+    """
+    Local midnight at which the given month begins.
+
+    :param month: The first day of a month.
+    :return: The aware start of the month.
+    """
+    return _local_midnight(month)
+
+
+def parse_date(value: Union[str, date], name: str = "date") -> date:
+    """
+    Parse an ISO date (YYYY-MM-DD).
+
+    :param value: The date as string or date.
+    :param name: Name of the parameter, used in the error message.
+    :return: The parsed date.
+    :raises ValueError: If the value is not a valid date.
+    """
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name} date. Expected YYYY-MM-DD.")
+
+
+def parse_timeframe(timeframe: Optional[str] = "all_time", start: Union[str, date, None] = None, end: Union[str, date, None] = None) -> DateRange:
+    """
+    Turn a timeframe option or an explicit date range into a DateRange.
+
+    Explicit start and end dates take precedence over the timeframe and are both inclusive.
+    Calendar periods are aligned to local midnight.
+
+    :param timeframe: '30_days', '60_days', '90_days', 'this_month', 'last_month', 'ytd', 'all_time' or 'YYYY-MM'.
+    :param start: First day of a custom range.
+    :param end: Last day of a custom range.
+    :return: The matching DateRange.
+    :raises ValueError: If the timeframe or one of the dates is invalid.
+    """
+    if start or end:
+        start_day = parse_date(start, "start") if start else None
+        end_day = parse_date(end, "end") if end else None
+        if start_day and end_day and start_day > end_day:
+            raise ValueError("Invalid date range. The start date must not be after the end date.")
+        return DateRange(
+            start=_local_midnight(start_day) if start_day else None,
+            end=_local_midnight(end_day + timedelta(days=1)) if end_day else None,
+        )
+
+    current = localtime(now())
+
+    if timeframe in ROLLING_TIMEFRAME_DAYS:
+        return DateRange(start=current - timedelta(days=ROLLING_TIMEFRAME_DAYS[timeframe]))
+    if timeframe == "all_time":
+        return DateRange()
+    if timeframe == "this_month":
+        return DateRange(start=month_start(month_of(current)))
+    if timeframe == "last_month":
+        this_month = month_of(current)
+        previous = month_of(month_start(this_month) - timedelta(days=1))
+        return DateRange(start=month_start(previous), end=month_start(this_month))
+    if timeframe == "ytd":
+        return DateRange(start=month_start(date(current.year, 1, 1)))
+
+    match = CALENDAR_MONTH_PATTERN.match(timeframe or "")
+    if match and 1 <= int(match.group(2)) <= 12:
+        month = date(int(match.group(1)), int(match.group(2)), 1)
+        return DateRange(start=month_start(month), end=month_start(next_month(month)))
+
+    raise ValueError(INVALID_TIMEFRAME_MESSAGE)
+
+
+def resolve_timeframe(timeframe: Union[str, DateRange]) -> DateRange:
+    """
+    Accept either a ready DateRange or a timeframe option, as the services do.
+
+    :param timeframe: A DateRange or a timeframe option understood by parse_timeframe.
+    :return: The DateRange.
+    """
+    if isinstance(timeframe, DateRange):
+        return timeframe
+    return parse_timeframe(timeframe)
@@ -2,7 +2,6 @@ import logging
 import random
 from typing import Optional, Union
 
-import yfinance as yf
 from django.apps import apps
 from django.contrib.auth.base_user import BaseUserManager
 from django.db import transaction
@@ -49,19 +48,24 @@ class CustomerManager(BaseUserManager):
             custody_account = CustodyAccount.objects.create(customer_id=user, reference_account=checking_account, type="custody", unique_identifier="bank_custody_account")
             print(f"Created CustodyAccount: {custody_account}")
 
-            # Fetch stock data and populate CustodyAccount
-            tickers = yf.Tickers(["AAPL", "MSFT", "GOOGL", "AMZN", "TSLA"])
-            for ticker in tickers.tickers.values():
+            # Fetch stock data from the configured price provider and populate CustodyAccount
+            # (imported here, the container imports the services and models of every app)
+            from swd_django_demo.containers import Container
+            price_provider = Container().price_provider()
+            symbols = ["AAPL", "MSFT", "GOOGL", "AMZN", "TSLA"]
+            try:
+                prices = price_provider.get_prices(symbols)
+            except Exception as e:
+                logger.error(f"Error fetching stock prices: {str(e)}")
+                prices = {}
+            for symbol in symbols:
                 try:
-                    historical_prices = ticker.history(period='1d', interval='1m')
-                    if not historical_prices.empty and 'Close' in historical_prices.columns:
-                        stock_price = historical_prices['Close'].iloc[-1]
-                    else:
-                        raise ValueError(f"Missing price data for {ticker.ticker}.")
+                    if symbol not in prices:
+                        raise ValueError(f"Missing price data for {symbol}.")
 
                     stock, _ = Stock.objects.get_or_create(
-                        symbol=ticker.ticker,
-                        defaults={"stock_name": ticker.info.get("shortName", "Unknown"), "current_price": stock_price},
+                        symbol=symbol,
+                        defaults={"stock_name": price_provider.get_stock_name(symbol), "current_price": prices[symbol].to_decimal()},
                     )
                     StockOwnership.objects.get_or_create(
                         account=custody_account,
@@ -70,7 +74,7 @@ class CustomerManager(BaseUserManager):
                     )
                     print(f"Added stock {stock.symbol} to CustodyAccount.")
                 except Exception as e:
-                    logger.error(f"Error adding stock {ticker.ticker}: {str(e)}")
+                    logger.error(f"Error adding stock {symbol}: {str(e)}")
 
             return user
 
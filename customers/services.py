@@ -28,7 +28,14 @@ class CustomerService(ICustomerService):
             return None
 
     def get_customer_accounts(self, customer_id: UUID) -> List[Account]:
-        return self.account_service.get_accounts_by_customer_id(customer_id)
+        accounts = self.account_service.get_accounts_by_customer_id(customer_id)
+
+        # Resolve the balances of all accounts with one batch lookup instead of one per account
+        balances = self.account_service.get_balances([account.account_id for account in accounts])
+        for account in accounts:
+            account.balance = balances.get(account.account_id)
+
+        return accounts
 
     def get_customer_balance(self, customer_id: UUID) -> float:
         pass
\ No newline at end of file
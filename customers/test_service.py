@@ -107,3 +107,15 @@ class TestCustomerService(TestCase):
 
         self.assertEqual(len(result), 2)
 
+    def test_get_customer_accounts_resolves_balances_in_one_batch(self):
+        mock_account_one = Mock(account_id=1)
+        mock_account_two = Mock(account_id=2)
+
+        self.account_service.get_accounts_by_customer_id.return_value = [mock_account_one, mock_account_two]
+        self.account_service.get_balances.return_value = {1: 100, 2: 200}
+
+        result = self.customer_service.get_customer_accounts(1)
+
+        self.account_service.get_balances.assert_called_once_with([1, 2])
+        self.account_service.get_balance.assert_not_called()
+        self.assertEqual([account.balance for account in result], [100, 200])
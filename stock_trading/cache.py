@@ -0,0 +1,66 @@
+import math
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from django.core.cache import caches
+
+from core.money import Money
+from stock_trading.settings import PRICE_CACHE_ALIAS, PRICE_CACHE_TTL
+
+
+class PriceCache:
+    """
+    Two-level TTL cache of stock prices, a process-local dictionary in front of the shared Django cache.
+
+    An entry expires when its price becomes stale, counted from the time the price was fetched and not from the
+    time it was cached, so both levels and the stock table agree on when a refresh is due.
+    """
+
+    def __init__(self, ttl: float = PRICE_CACHE_TTL, alias: str = PRICE_CACHE_ALIAS):
+        self.ttl = ttl
+        self.alias = alias
+        # symbol -> (price in cents, expiry as epoch seconds)
+        self._local: Dict[str, Tuple[int, float]] = {}
+
+    @staticmethod
+    def _key(symbol: str) -> str:
+        return f"stock_price:{symbol}"
+
+    def get(self, symbol: str) -> Optional[Money]:
+        """
+        Look up the cached price of a stock.
+
+        :param symbol: Symbol of the stock.
+        :return: The price, None if no fresh price is cached.
+        """
+        current = time.time()
+        entry = self._local.get(symbol)
+        if entry is None or entry[1] <= current:
+            entry = caches[self.alias].get(self._key(symbol))
+            if entry is None or entry[1] <= current:
+                return None
+            self._local[symbol] = entry
+        return Money(entry[0])
+
+    def set(self, symbol: str, price: Money, fetched_at: datetime) -> None:
+        """
+        Cache the price of a stock until it becomes stale, a price that is already stale is not cached.
+
+        :param symbol: Symbol of the stock.
+        :param price: The price.
+        :param fetched_at: When the price was fetched.
+        """
+        expires_at = fetched_at.timestamp() + self.ttl
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            return
+        entry = (Money.of(price).cents, expires_at)
+        self._local[symbol] = entry
+        caches[self.alias].set(self._key(symbol), entry, timeout=math.ceil(remaining))
+
+    def clear(self) -> None:
+        """
+        Forget the prices of this process, the shared cache expires on its own.
+        """
+        self._local.clear()
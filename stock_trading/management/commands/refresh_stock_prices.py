@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from stock_trading.refresher import PriceRefresher
+from stock_trading.settings import PRICE_REFRESH_INTERVAL
+from swd_django_demo.containers import Container
+
+
+class Command(BaseCommand):
+    help = (
+        "Keep the prices of all stocks fresh in the background, so that requests only read cached prices. "
+        "Runs until stopped unless --once or --runs is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=PRICE_REFRESH_INTERVAL,
+            help="Seconds between two runs.",
+        )
+        parser.add_argument("--runs", type=int, help="Stop after this many runs.")
+        parser.add_argument("--once", action="store_true", help="Refresh the prices once and exit.")
+
+    def handle(self, *args, **options):
+        if options["interval"] <= 0:
+            raise CommandError("The interval must be greater than zero.")
+
+        def report(metrics):
+            if metrics["consecutive_failures"]:
+                self.stderr.write(self.style.WARNING(f"Refresh failed: {metrics['last_error']}"))
+            else:
+                self.stdout.write(f"Refreshed {metrics['last_refreshed']} price(s) in {metrics['last_duration_seconds']:.1f}s.")
+
+        refresher = PriceRefresher(Container().trading_service(), interval=options["interval"])
+        try:
+            refresher.run(runs=1 if options["once"] else options["runs"], on_run=report)
+        except KeyboardInterrupt:
+            refresher.stop()
@@ -0,0 +1,146 @@
+import threading
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import yfinance as yf
+from marshmallow import ValidationError
+
+from core.money import CENT, Money
+from core.services import IPriceProvider
+from stock_trading.settings import SIMULATED_PRICE_SEED, SIMULATED_PRICE_TICK_SECONDS, SIMULATED_PRICE_VOLATILITY
+
+
+class YFinancePriceProvider(IPriceProvider):
+    """
+    Live prices from Yahoo Finance, the last trade of the current day.
+    """
+
+    def get_price(self, symbol: str) -> Money:
+        try:
+            stock = yf.Ticker(symbol)
+            current_price = stock.history(period="1d", interval="1m")["Close"].iloc[-1]
+            return Money.of(current_price)
+        except Exception as e:
+            raise ValidationError(f"Failed to fetch stock price for {symbol}: {str(e)}")
+
+    def get_prices(self, symbols: List[str]) -> Dict[str, Money]:
+        """
+        Fetch the latest prices of many stocks with a single multi-ticker download.
+
+        :param symbols: Symbols of the stocks.
+        :return: The prices by symbol, symbols without any trade data are left out.
+        :raises ValidationError: If the download fails.
+        """
+        try:
+            data = yf.download(list(symbols), period="1d", interval="1m", group_by="column", multi_level_index=True, progress=False)
+            closes = data["Close"]
+            if closes.ndim == 1:
+                # a single ticker without the symbol level
+                closes = closes.to_frame(symbols[0])
+        except Exception as e:
+            raise ValidationError(f"Failed to fetch stock prices for {', '.join(symbols)}: {str(e)}")
+
+        prices = {}
+        for symbol in symbols:
+            if symbol in closes:
+                trades = closes[symbol].dropna()
+                if not trades.empty:
+                    prices[symbol] = Money.of(trades.iloc[-1])
+        return prices
+
+    def get_stock_name(self, symbol: str) -> str:
+        return yf.Ticker(symbol).info.get("shortName", "Unknown")
+
+
+class RandomWalkPriceProvider(IPriceProvider):
+    """
+    Simulated prices for offline load tests, benchmarks and CI, any symbol has a price and no network is needed.
+
+    Every symbol follows its own geometric random walk with one step per tick. The price at a tick depends only on
+    the seed, the symbol and the tick, not on when or how often it is read, so two runs with the same seed replay the
+    same market. The steps are drawn in blocks and the running sums are kept per symbol, reading thousands of symbols
+    at high tick rates costs one cached lookup per symbol and one draw per block of ticks.
+    """
+
+    # Ticks whose steps are drawn at once
+    BLOCK_TICKS = 1024
+
+    def __init__(self, seed: int = SIMULATED_PRICE_SEED, tick_seconds: float = SIMULATED_PRICE_TICK_SECONDS,
+                 volatility: float = SIMULATED_PRICE_VOLATILITY, start: Optional[float] = None,
+                 clock: Callable[[], float] = time.time):
+        """
+        :param seed: Seed of the simulated market.
+        :param tick_seconds: Seconds between two price steps, a tick of 0.001 simulates 1000 price changes a second.
+        :param volatility: Standard deviation of the relative price change per tick.
+        :param start: Time of tick 0 in seconds of the clock, the time the provider is created by default.
+        :param clock: Source of the current time, a fake clock steps through the ticks at any pace.
+        """
+        self.seed = seed
+        self.tick_seconds = tick_seconds
+        self.volatility = volatility
+        self.clock = clock
+        self.start = clock() if start is None else start
+        self._lock = threading.Lock()
+        # symbol -> log price change at the start of every drawn block
+        self._block_starts: Dict[str, List[float]] = {}
+        # symbol -> (block, log price change at every tick of the block)
+        self._last_block: Dict[str, Tuple[int, np.ndarray]] = {}
+
+    def current_tick(self) -> int:
+        """
+        :return: The tick of the clock's current time.
+        """
+        return max(0, int((self.clock() - self.start) / self.tick_seconds))
+
+    def get_price(self, symbol: str) -> Money:
+        return self.get_price_at(symbol, self.current_tick())
+
+    def get_prices(self, symbols: List[str]) -> Dict[str, Money]:
+        tick = self.current_tick()
+        return {symbol: self.get_price_at(symbol, tick) for symbol in symbols}
+
+    def get_stock_name(self, symbol: str) -> str:
+        return f"{symbol} (simulated)"
+
+    def get_price_at(self, symbol: str, tick: int) -> Money:
+        """
+        Read the simulated price of a stock at a tick.
+
+        :param symbol: Symbol of the stock.
+        :param tick: The tick, counted from 0.
+        :return: The price, at least one cent.
+        """
+        block, offset = divmod(tick, self.BLOCK_TICKS)
+        with self._lock:
+            change = self._block_start(symbol, block) + self._block(symbol, block)[offset]
+        return max(Money.of(self._opening_price(symbol) * np.exp(change)), Money.of(CENT))
+
+    def _opening_price(self, symbol: str) -> float:
+        # Between 10.00 and 500.00, fixed by the seed and the symbol
+        return 10 + zlib.crc32(f"{self.seed}:{symbol}".encode()) % 49001 / 100
+
+    def _steps(self, symbol: str, block: int) -> np.ndarray:
+        # The log price changes of the ticks of a block, the same for every run with this seed
+        generator = np.random.default_rng([self.seed, zlib.crc32(symbol.encode()), block])
+        # single precision halves the memory of the cached blocks, thousands of symbols keep one block each
+        steps = generator.standard_normal(self.BLOCK_TICKS, dtype=np.float32) * np.float32(self.volatility)
+        # geometric random walk without drift, the expected price stays the opening price
+        return steps - np.float32(self.volatility ** 2 / 2)
+
+    def _block_start(self, symbol: str, block: int) -> float:
+        block_starts = self._block_starts.setdefault(symbol, [0.0])
+        while len(block_starts) <= block:
+            # the price at the first tick of a block is the price after all steps of the previous blocks
+            block_starts.append(block_starts[-1] + float(self._block(symbol, len(block_starts) - 1)[-1]))
+        return block_starts[block]
+
+    def _block(self, symbol: str, block: int) -> np.ndarray:
+        last_block = self._last_block.get(symbol)
+        if last_block is None or last_block[0] != block:
+            # the first tick of a block starts without a step, so tick 0 is the opening price
+            changes = np.concatenate((np.zeros(1, dtype=np.float32), np.cumsum(self._steps(symbol, block))))
+            last_block = (block, changes)
+            self._last_block[symbol] = last_block
+        return last_block[1]
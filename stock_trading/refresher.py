@@ -0,0 +1,169 @@
+import threading
+import time
+from typing import Callable, Optional
+
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.db.models import Count, Min
+from django.utils.timezone import now
+
+from core.services import ITradingService
+from stock_trading.models import Stock
+from stock_trading.settings import PRICE_CACHE_ALIAS, PRICE_REFRESH_INTERVAL, PRICE_REFRESHER_THREAD
+from swd_django_demo.containers import Container
+
+# The refresher keeps its metrics in the shared cache, so the web processes can report on a refresher running elsewhere
+REFRESHER_METRICS_KEY = "stock_price_refresher:metrics"
+
+
+def read_refresher_metrics(alias: str = PRICE_CACHE_ALIAS) -> dict:
+    """
+    Read the metrics of the background price refresher.
+
+    :param alias: The shared Django cache holding the metrics.
+    :return: The run and failure counters and the times and outcome of the last run, zeros before the first run.
+    """
+    metrics = {
+        "runs": 0,
+        "failures": 0,
+        "consecutive_failures": 0,
+        "last_run_at": None,
+        "last_success_at": None,
+        "last_duration_seconds": None,
+        "last_refreshed": 0,
+        "last_failed_symbols": [],
+        "last_error": None,
+    }
+    metrics.update(caches[alias].get(REFRESHER_METRICS_KEY) or {})
+    return metrics
+
+
+def get_market_data_metrics(alias: str = PRICE_CACHE_ALIAS) -> dict:
+    """
+    Report how fresh the stock prices are, for monitoring the background refresher.
+
+    :param alias: The shared Django cache holding the refresher metrics.
+    :return: The refresher metrics plus the number of 'stocks', the age of the oldest price as 'max_price_age_seconds'
+             and the time since the last successful run as 'refresher_lag_seconds'.
+    """
+    metrics = read_refresher_metrics(alias)
+    current = time.time()
+    stocks = Stock.objects.aggregate(count=Count("pk"), oldest=Min("last_updated"))
+
+    metrics["stocks"] = stocks["count"]
+    metrics["max_price_age_seconds"] = (now() - stocks["oldest"]).total_seconds() if stocks["oldest"] else None
+    metrics["refresher_lag_seconds"] = current - metrics["last_success_at"] if metrics["last_success_at"] else None
+    return metrics
+
+
+class PriceRefresher:
+    """
+    Keeps the prices of all stocks fresh on a fixed cadence, so that requests only ever read cached prices.
+
+    Runs in the refresh_stock_prices management command or in a daemon thread of the web process.
+    """
+
+    def __init__(self, trading_service: ITradingService, interval: float = PRICE_REFRESH_INTERVAL, alias: str = PRICE_CACHE_ALIAS):
+        self.trading_service = trading_service
+        self.interval = interval
+        self.alias = alias
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def refresh_once(self) -> dict:
+        """
+        Refresh the prices of all stocks once and record the outcome in the metrics.
+
+        :return: The updated metrics.
+        """
+        started = time.time()
+        metrics = read_refresher_metrics(self.alias)
+        report, error = None, None
+        try:
+            report = self.trading_service.refresh_stock_prices()
+        except Exception as e:
+            error = str(e)
+
+        metrics["runs"] += 1
+        metrics["last_run_at"] = started
+        metrics["last_duration_seconds"] = time.time() - started
+        metrics["last_refreshed"] = report["refreshed"] if report else 0
+        metrics["last_failed_symbols"] = report["failed"] if report else []
+        if report and not report["failed"]:
+            metrics["consecutive_failures"] = 0
+            metrics["last_success_at"] = started
+            metrics["last_error"] = None
+        else:
+            metrics["failures"] += 1
+            metrics["consecutive_failures"] += 1
+            metrics["last_error"] = error or f"No prices for {', '.join(report['failed'])}."
+
+        caches[self.alias].set(REFRESHER_METRICS_KEY, metrics, timeout=None)
+        return metrics
+
+    def run(self, runs: Optional[int] = None, on_run: Optional[Callable[[dict], None]] = None) -> None:
+        """
+        Refresh the prices every interval until stopped.
+
+        :param runs: Stop after this many runs, runs forever by default.
+        :param on_run: Called with the metrics after every run.
+        """
+        completed = 0
+        while not self._stop.is_set() and (runs is None or completed < runs):
+            started = time.monotonic()
+            metrics = self.refresh_once()
+            if on_run:
+                on_run(metrics)
+            completed += 1
+            if runs is None or completed < runs:
+                # the loop outlives any connection timeout, a broken or expired connection is dropped between runs
+                close_old_connections()
+                self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def start(self) -> threading.Thread:
+        """
+        Run the refresher in a daemon thread.
+
+        :return: The started thread.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name="stock-price-refresher", daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        """
+        Stop the refresher after the current run.
+        """
+        self._stop.set()
+
+
+# The refresher thread of this process, started once by start_refresher_thread
+_refresher: Optional[PriceRefresher] = None
+
+
+def start_refresher_thread() -> PriceRefresher:
+    """
+    Start the background price refresher in a daemon thread of this process, unless it is already running.
+
+    :return: The running refresher.
+    """
+    global _refresher
+    if _refresher is None:
+        _refresher = PriceRefresher(Container().trading_service())
+    _refresher.start()
+    return _refresher
+
+
+def start_configured_refresher_thread() -> Optional[PriceRefresher]:
+    """
+    Start the refresher thread if STOCK_PRICE_REFRESHER_THREAD is set, called by the WSGI and ASGI entry points.
+
+    It is not started from AppConfig.ready, which also runs for migrate, the tests and runserver's reloader process.
+
+    :return: The running refresher, None if the thread is not enabled.
+    """
+    if not PRICE_REFRESHER_THREAD:
+        return None
+    return start_refresher_thread()
@@ -1,32 +1,33 @@
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from uuid import UUID
 
-import yfinance as yf
 from dependency_injector.wiring import Provide, inject
 from django.utils.timezone import now
 from django.db import transaction
 from datetime import timedelta
 from marshmallow import ValidationError
 
-from core.services import ITradingService
+from core.money import Money
+from core.services import IPriceProvider, ITradingService
+from stock_trading.cache import PriceCache
 from stock_trading.models import Stock, StockOwnership
+from stock_trading.providers import YFinancePriceProvider
+from stock_trading.settings import PRICE_REFRESH_IN_REQUESTS
 
-
-def fetch_stock_price(stock_symbol: str) -> float:
-    try:
-        stock = yf.Ticker(stock_symbol)
-        current_price = stock.history(period="1d", interval="1m")["Close"].iloc[-1]
-        return round(current_price,2)
-    except Exception as e:
-        raise ValidationError(f"Failed to fetch stock price for {stock_symbol}: {str(e)}")
+# Number of symbols fetched with one download by the background refresher
+PRICE_REFRESH_BATCH_SIZE = 100
 
 
 class TradingService(ITradingService):
 
     @inject
-    def __init__(self, transaction_service: Provide["transaction_service"], account_service: Provide["account_service"]):
+    def __init__(self, transaction_service: Provide["transaction_service"], account_service: Provide["account_service"], price_provider: Optional[IPriceProvider] = None, price_cache: Optional[PriceCache] = None, refresh_in_requests: bool = PRICE_REFRESH_IN_REQUESTS):
         self.transaction_service = transaction_service
         self.account_service = account_service
+        self.price_provider = price_provider or YFinancePriceProvider()
+        self.price_cache = price_cache or PriceCache()
+        # without it requests serve the stored prices and leave refreshing to the background refresher
+        self.refresh_in_requests = refresh_in_requests
 
     def get_stock(self, stock_id: UUID) -> Stock:
         stock = Stock.objects.get(stockID=stock_id)
@@ -34,26 +35,40 @@ class TradingService(ITradingService):
             raise ValidationError(f"Stock {stock_id} does not exist")
         return stock
 
-    def get_all_user_stocks(self, account_id: UUID) -> List[dict]:
+    def get_portfolio(self, account_id: UUID) -> dict:
+        """
+        Build the portfolio of an account in a single pass.
+
+        The holdings are loaded together with their stocks in one query and all their prices are looked up at once.
+
+        :param account_id: ID of the custody account.
+        :return: The 'holdings' as returned by get_all_user_stocks and their 'total_value'.
+        :raises ValidationError: If the account does not exist or a price can not be fetched.
+        """
         account = self.account_service.get_account(account_id)
         if not account:
             raise ValidationError(f"Account with id {account_id} is not found.")
 
-        ownerships = StockOwnership.objects.filter(account=account)
-        if not ownerships:
-            return []
-        portfolio = [
-            {
+        ownerships = list(StockOwnership.objects.filter(account=account).select_related("stock"))
+        prices = self.get_current_stock_prices([ownership.stock.symbol for ownership in ownerships]) if ownerships else {}
+        holdings = []
+        total_value = Money(0)
+        for ownership in ownerships:
+            current_price = Money.of(prices[ownership.stock.symbol])
+            holding_value = current_price * ownership.quantity
+            holdings.append({
                 "id": str(ownership.stock.stockID),
                 "name": ownership.stock.stock_name,
                 "symbol": ownership.stock.symbol,
                 "quantity": ownership.quantity,
-                "current_price": self.get_current_stock_price(ownership.stock.symbol),
-                "total_value": round(ownership.quantity * self.get_current_stock_price(ownership.stock.symbol),2),
-            }
-            for ownership in ownerships
-        ]
-        return portfolio
+                "current_price": current_price,
+                "total_value": holding_value,
+            })
+            total_value += holding_value
+        return {"holdings": holdings, "total_value": total_value}
+
+    def get_all_user_stocks(self, account_id: UUID) -> List[dict]:
+        return self.get_portfolio(account_id)["holdings"]
 
     def get_user_owned_stock(self, account_id: UUID, stock_id: UUID) -> StockOwnership:
         account = self.account_service.get_account(account_id)
@@ -67,12 +82,8 @@ class TradingService(ITradingService):
 
         return stock_ownership
 
-    def get_portfolio_value(self, account_id: UUID) -> float:
-        user_stocks = self.get_all_user_stocks(account_id)
-        portfolio_value = 0
-        for user_stock in user_stocks:
-            portfolio_value += user_stock["total_value"]
-        return float(round(portfolio_value,2))
+    def get_portfolio_value(self, account_id: UUID) -> Money:
+        return self.get_portfolio(account_id)["total_value"]
 
 
 
@@ -90,9 +101,10 @@ class TradingService(ITradingService):
                 raise ValidationError("Bank custody account not found.")
 
             # Fetch all stocks owned by the custody account
-            stock_ownerships = StockOwnership.objects.filter(account=bank_custody_account)
+            stock_ownerships = StockOwnership.objects.filter(account=bank_custody_account).select_related("stock")
 
-            # Prepare a list of available stocks
+            # Prepare a list of available stocks, all prices are looked up at once
+            prices = self.get_current_stock_prices([ownership.stock.symbol for ownership in stock_ownerships])
             available_stocks = []
             for ownership in stock_ownerships:
                 stock = ownership.stock
@@ -100,7 +112,7 @@ class TradingService(ITradingService):
                     "id": str(stock.stockID),
                     "symbol": stock.symbol,
                     "name": stock.stock_name,
-                    "current_price": self.get_current_stock_price(stock.symbol),
+                    "current_price": prices[stock.symbol],
                     "number_available": ownership.quantity,
                 })
             return available_stocks
@@ -117,8 +129,8 @@ class TradingService(ITradingService):
             with transaction.atomic():
                 # Fetch stock details
                 stock = Stock.objects.get(pk=stock_id)
-                stock_price = self.get_current_stock_price(stock.symbol)
-                total_cost = stock_price * quantity
+                stock_price = Money.of(self.get_current_stock_price(stock.symbol))
+                total_cost = (stock_price * quantity).to_decimal()
 
                 # Fetch user's account
                 custody_account = self.account_service.get_account(account_id)
@@ -169,8 +181,8 @@ class TradingService(ITradingService):
             with transaction.atomic():
                 # Fetch stock details
                 stock = Stock.objects.get(pk=stock_id)
-                stock_price = self.get_current_stock_price(stock.symbol)
-                total_revenue = stock_price * quantity
+                stock_price = Money.of(self.get_current_stock_price(stock.symbol))
+                total_revenue = (stock_price * quantity).to_decimal()
 
                 # Fetch stock ownership
                 ownership = self.get_user_owned_stock(account_id, stock_id)
@@ -216,25 +228,146 @@ class TradingService(ITradingService):
         except Exception as e:
             raise ValidationError(f"Stock sale failed: {str(e)}")
 
-    def get_current_stock_price(self, stock_symbol: str) -> float:
+    def get_current_stock_price(self, stock_symbol: str) -> Money:
+        """
+        Read the current price of a stock.
+
+        Fresh prices come from the price cache or a plain read of the stock row, without any row lock, so concurrent
+        viewers of the market pages never wait on each other. Only a stale price is refreshed, under a row lock.
+
+        :param stock_symbol: Symbol of the stock.
+        :return: The current price.
+        :raises ValidationError: If the stock does not exist or the price can not be fetched.
+        """
+        price = self.price_cache.get(stock_symbol)
+        if price is not None:
+            return price
+
         try:
-            # Fetch the stock object using `select_for_update` to lock the row for updates
-            with transaction.atomic():
-                stock = Stock.objects.select_for_update().filter(symbol=stock_symbol).first()
-                if not stock:
-                    raise ValidationError(f"Stock with symbol {stock_symbol} does not exist.")
-
-                # Check if the `last_updated` is older than 1 minute
-                if not stock.last_updated or (now() - stock.last_updated) > timedelta(minutes=1):
-                    # Fetch the latest stock price
-                    current_stock_price = fetch_stock_price(stock_symbol)
-
-                    # Update the stock's current price and `last_updated` timestamp
-                    stock.current_price = current_stock_price
-                    stock.last_updated = now()
-                    stock.save(update_fields=["current_price", "last_updated"])
-
-                # Return the (possibly updated) current stock price
-                return float(stock.current_price)
+            stock = Stock.objects.filter(symbol=stock_symbol).first()
+            if not stock:
+                raise ValidationError(f"Stock with symbol {stock_symbol} does not exist.")
+            if self.refresh_in_requests and self._is_stale(stock):
+                stock = self._refresh_stock_price(stock_symbol)
+
+            price = Money.of(stock.current_price)
+            self.price_cache.set(stock_symbol, price, stock.last_updated)
+            return price
         except Exception as e:
-            raise ValidationError(f"Failed to fetch and update stock price for {stock_symbol}: {str(e)}")
\ No newline at end of file
+            raise ValidationError(f"Failed to fetch and update stock price for {stock_symbol}: {str(e)}")
+
+    def get_current_stock_prices(self, stock_symbols: List[str]) -> Dict[str, Money]:
+        """
+        Read the current prices of many stocks at once.
+
+        Like get_current_stock_price, but the stock rows are read with one query and all stale prices are
+        refreshed with a single call to the price provider, one multi-ticker download for Yahoo Finance, so a page of
+        50 stocks makes at most one external call.
+
+        :param stock_symbols: Symbols of the stocks.
+        :return: The current prices by symbol.
+        :raises ValidationError: If a stock does not exist or its price can not be fetched.
+        """
+        prices = {}
+        missing = []
+        for stock_symbol in dict.fromkeys(stock_symbols):
+            price = self.price_cache.get(stock_symbol)
+            if price is None:
+                missing.append(stock_symbol)
+            else:
+                prices[stock_symbol] = price
+        if not missing:
+            return prices
+
+        try:
+            stocks = self._stocks_by_symbol(Stock.objects.filter(symbol__in=missing).order_by("symbol", "pk"))
+            unknown = [stock_symbol for stock_symbol in missing if stock_symbol not in stocks]
+            if unknown:
+                raise ValidationError(f"Stock with symbol {', '.join(unknown)} does not exist.")
+
+            stale = [stock_symbol for stock_symbol in missing if self.refresh_in_requests and self._is_stale(stocks[stock_symbol])]
+            if stale:
+                refreshed_stocks, _, unpriced = self._refresh_stock_prices(stale)
+                if unpriced:
+                    raise ValidationError(f"No price data for {', '.join(unpriced)}.")
+                stocks.update(refreshed_stocks)
+
+            for stock_symbol in missing:
+                stock = stocks[stock_symbol]
+                prices[stock_symbol] = Money.of(stock.current_price)
+                self.price_cache.set(stock_symbol, prices[stock_symbol], stock.last_updated)
+            return prices
+        except Exception as e:
+            raise ValidationError(f"Failed to fetch and update stock prices for {', '.join(missing)}: {str(e)}")
+
+    def refresh_stock_prices(self, max_age: float = 0, batch_size: int = PRICE_REFRESH_BATCH_SIZE) -> dict:
+        """
+        Refresh the prices of all stocks and put them into the price cache, for the background refresher.
+
+        The symbols are downloaded in batches, a failing batch does not stop the others.
+
+        :param max_age: Only refresh prices older than this many seconds, 0 refreshes all of them.
+        :param batch_size: Number of symbols per download.
+        :return: A report with the number of 'refreshed' prices and the 'failed' symbols.
+        """
+        stock_symbols = sorted(set(Stock.objects.values_list("symbol", flat=True)))
+        refreshed = 0
+        failed = []
+        for first in range(0, len(stock_symbols), max(1, batch_size)):
+            batch = stock_symbols[first:first + max(1, batch_size)]
+            try:
+                stocks, refreshed_symbols, unpriced = self._refresh_stock_prices(batch, max_age)
+            except Exception:
+                failed.extend(batch)
+                continue
+
+            refreshed += len(refreshed_symbols)
+            failed.extend(unpriced)
+            for stock_symbol, stock in stocks.items():
+                self.price_cache.set(stock_symbol, Money.of(stock.current_price), stock.last_updated)
+
+        return {"refreshed": refreshed, "failed": failed}
+
+    def _is_stale(self, stock: Stock, max_age: Optional[float] = None) -> bool:
+        max_age = self.price_cache.ttl if max_age is None else max_age
+        return not stock.last_updated or (now() - stock.last_updated) > timedelta(seconds=max_age)
+
+    def _refresh_stock_price(self, stock_symbol: str) -> Stock:
+        # Lock the stock row while fetching, a concurrent refresher waits and then finds the price fresh
+        with transaction.atomic():
+            stock = Stock.objects.select_for_update().filter(symbol=stock_symbol).first()
+            if not stock:
+                raise ValidationError(f"Stock with symbol {stock_symbol} does not exist.")
+
+            if self._is_stale(stock):
+                # Fetch the latest stock price and update the stock's current price and `last_updated` timestamp
+                stock.current_price = Money.of(self.price_provider.get_price(stock_symbol)).to_decimal()
+                stock.last_updated = now()
+                stock.save(update_fields=["current_price", "last_updated"])
+        return stock
+
+    def _refresh_stock_prices(self, stock_symbols: List[str], max_age: Optional[float] = None) -> Tuple[Dict[str, Stock], List[str], List[str]]:
+        # Returns the locked stocks, the refreshed symbols and the stale symbols without price data.
+        # The rows are locked in symbol order so that concurrent refreshers of overlapping pages can not deadlock.
+        with transaction.atomic():
+            stocks = self._stocks_by_symbol(Stock.objects.select_for_update().filter(symbol__in=stock_symbols).order_by("symbol", "pk"))
+            stale = [stock_symbol for stock_symbol, stock in stocks.items() if self._is_stale(stock, max_age)]
+            if not stale:
+                return stocks, [], []
+
+            fetched = self.price_provider.get_prices(stale)
+            refreshed = [stock_symbol for stock_symbol in stale if stock_symbol in fetched]
+            fetched_at = now()
+            for stock_symbol in refreshed:
+                stocks[stock_symbol].current_price = fetched[stock_symbol].to_decimal()
+                stocks[stock_symbol].last_updated = fetched_at
+            Stock.objects.bulk_update([stocks[stock_symbol] for stock_symbol in refreshed], ["current_price", "last_updated"])
+        return stocks, refreshed, [stock_symbol for stock_symbol in stale if stock_symbol not in fetched]
+
+    @staticmethod
+    def _stocks_by_symbol(stocks) -> Dict[str, Stock]:
+        # The first stock row of every symbol, like the single price lookup
+        by_symbol = {}
+        for stock in stocks:
+            by_symbol.setdefault(stock.symbol, stock)
+        return by_symbol
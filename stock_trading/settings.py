@@ -1,4 +1,22 @@
 from django.conf import settings
 
 ACCOUNT_MODEL = getattr(settings, 'ACCOUNT_MODEL')
-CUSTODY_ACCOUNT_MODEL = getattr(settings, 'CUSTODY_ACCOUNT_MODEL')
\ No newline at end of file
+CUSTODY_ACCOUNT_MODEL = getattr(settings, 'CUSTODY_ACCOUNT_MODEL')
+# Seconds a fetched stock price stays fresh, reads within this time are served from the price cache
+PRICE_CACHE_TTL = getattr(settings, 'STOCK_PRICE_CACHE_TTL', 60)
+# Django cache shared by all processes, configure a shared backend such as Redis in CACHES for multi-process setups
+PRICE_CACHE_ALIAS = getattr(settings, 'STOCK_PRICE_CACHE_ALIAS', 'default')
+
+# Seconds between two runs of the background price refresher
+PRICE_REFRESH_INTERVAL = getattr(settings, 'STOCK_PRICE_REFRESH_INTERVAL', 30)
+# Let requests refresh stale prices themselves, turn off when the background refresher keeps the prices fresh
+PRICE_REFRESH_IN_REQUESTS = getattr(settings, 'STOCK_PRICE_REFRESH_IN_REQUESTS', True)
+# Run the background refresher in a thread of the web process instead of the refresh_stock_prices command
+PRICE_REFRESHER_THREAD = getattr(settings, 'STOCK_PRICE_REFRESHER_THREAD', False)
+
+# Source of the stock prices, 'yfinance' for live prices or 'random_walk' for the offline simulated market
+PRICE_PROVIDER = getattr(settings, 'STOCK_PRICE_PROVIDER', 'yfinance')
+# The simulated market replays the same prices for the same seed, one price step every tick
+SIMULATED_PRICE_SEED = getattr(settings, 'STOCK_SIMULATED_PRICE_SEED', 0)
+SIMULATED_PRICE_TICK_SECONDS = getattr(settings, 'STOCK_SIMULATED_PRICE_TICK_SECONDS', 1.0)
+SIMULATED_PRICE_VOLATILITY = getattr(settings, 'STOCK_SIMULATED_PRICE_VOLATILITY', 0.001)
@@ -0,0 +1,69 @@
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+from core.money import Money
+from stock_trading.providers import RandomWalkPriceProvider, YFinancePriceProvider
+from swd_django_demo.containers import Container
+
+
+class TestYFinancePriceProvider(unittest.TestCase):
+
+    def test_is_the_default_provider(self):
+        self.assertIsInstance(Container().price_provider(), YFinancePriceProvider)
+
+    @patch("stock_trading.providers.yf.download")
+    def test_get_prices(self, mock_download):
+        columns = pd.MultiIndex.from_product([["Close", "Open"], ["AAPL", "GOOGL", "DEAD"]])
+        mock_download.return_value = pd.DataFrame(
+            [[150.0, 170.0, float("nan"), 149.0, 169.0, float("nan")], [150.125, float("nan"), float("nan"), 150.0, 170.0, float("nan")]],
+            columns=columns,
+        )
+
+        prices = YFinancePriceProvider().get_prices(["AAPL", "GOOGL", "DEAD"])
+
+        self.assertEqual(prices, {"AAPL": Money.of("150.13"), "GOOGL": Money.of("170.00")})
+        mock_download.assert_called_once()
+
+
+class TestRandomWalkPriceProvider(unittest.TestCase):
+
+    def setUp(self):
+        self.time = 0.0
+        self.provider = RandomWalkPriceProvider(seed=7, tick_seconds=0.001, volatility=0.01, start=0.0, clock=lambda: self.time)
+
+    def test_prices_follow_the_clock(self):
+        opening = self.provider.get_prices(["AAPL", "MSFT"])
+        self.time = 5.0
+
+        prices = self.provider.get_prices(["AAPL", "MSFT"])
+
+        self.assertEqual(self.provider.current_tick(), 5000)
+        self.assertEqual(prices, {"AAPL": self.provider.get_price_at("AAPL", 5000), "MSFT": self.provider.get_price_at("MSFT", 5000)})
+        self.assertNotEqual(prices, opening)
+        self.assertTrue(10 <= opening["AAPL"] <= 500)
+        self.assertEqual(self.provider.get_stock_name("AAPL"), "AAPL (simulated)")
+
+    def test_prices_only_depend_on_seed_symbol_and_tick(self):
+        # one provider reads every tick, the other jumps straight to the last one and back
+        ticks = range(0, 3 * RandomWalkPriceProvider.BLOCK_TICKS, 97)
+        walked = [self.provider.get_price_at("AAPL", tick) for tick in ticks]
+        replay = RandomWalkPriceProvider(seed=7, volatility=0.01)
+
+        self.assertEqual(replay.get_price_at("AAPL", ticks[-1]), walked[-1])
+        self.assertEqual([replay.get_price_at("AAPL", tick) for tick in ticks], walked)
+        self.assertNotEqual(RandomWalkPriceProvider(seed=8, volatility=0.01).get_price_at("AAPL", ticks[-1]), walked[-1])
+        # every step moves the price by about the volatility
+        steps = [float(b) / float(a) - 1 for a, b in zip(walked, walked[1:])]
+        self.assertTrue(all(abs(step) < 0.5 for step in steps))
+
+    def test_thousands_of_symbols(self):
+        symbols = [f"SYM{i}" for i in range(5000)]
+        self.time = 10.0
+
+        prices = self.provider.get_prices(symbols)
+
+        self.assertEqual(len(prices), 5000)
+        self.assertTrue(all(price >= Money.of("0.01") for price in prices.values()))
+        self.assertGreater(len(set(prices.values())), 4000)
@@ -0,0 +1,106 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import Mock, patch
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+
+from core.money import Money
+from core.services import IPriceProvider
+from stock_trading.models import Stock
+from stock_trading.providers import YFinancePriceProvider
+from stock_trading.refresher import (
+    PriceRefresher, get_market_data_metrics, read_refresher_metrics, start_configured_refresher_thread
+)
+from stock_trading.services import TradingService
+
+# The tests must not clear or fill the shared cache of an app or refresher running on the same checkout
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestPriceRefresher(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.price_provider = Mock(spec=IPriceProvider)
+        self.trading_service = TradingService(Mock(), Mock(), price_provider=self.price_provider)
+        for symbol, price in (("AAPL", "150.00"), ("GOOGL", "170.00"), ("DEAD", "1.00")):
+            Stock.objects.create(symbol=symbol, stock_name=symbol, current_price=Decimal(price))
+        Stock.objects.update(last_updated=now() - timedelta(minutes=5))
+
+    def test_refresh_stock_prices(self):
+        fetched = {"AAPL": Money.of("151.00"), "GOOGL": Money.of("171.50")}
+        with patch.object(self.price_provider, "get_prices", return_value=fetched) as mock_get_prices:
+            report = self.trading_service.refresh_stock_prices(batch_size=2)
+
+        self.assertEqual(report, {"refreshed": 2, "failed": ["DEAD"]})
+        # one download per batch of symbols
+        self.assertEqual([call.args[0] for call in mock_get_prices.call_args_list], [["AAPL", "DEAD"], ["GOOGL"]])
+        self.assertEqual(Stock.objects.get(symbol="GOOGL").current_price, Decimal("171.50"))
+        self.assertEqual(Stock.objects.get(symbol="DEAD").current_price, Decimal("1.00"))
+
+        # the refreshed prices are cached, so requests do not touch the stock rows
+        with self.assertNumQueries(0):
+            self.assertEqual(self.trading_service.get_current_stock_prices(["AAPL", "GOOGL"]), {"AAPL": Decimal("151.00"), "GOOGL": Decimal("171.50")})
+
+    def test_refresh_once_records_metrics(self):
+        refresher = PriceRefresher(self.trading_service)
+
+        with patch.object(self.price_provider, "get_prices", return_value={"AAPL": Money.of(1), "GOOGL": Money.of(2), "DEAD": Money.of(3)}):
+            refresher.refresh_once()
+        with patch.object(self.price_provider, "get_prices", side_effect=Exception("Yahoo is down")):
+            metrics = refresher.refresh_once()
+
+        self.assertEqual((metrics["runs"], metrics["failures"], metrics["consecutive_failures"]), (2, 1, 1))
+        self.assertEqual(metrics["last_failed_symbols"], ["AAPL", "DEAD", "GOOGL"])
+        self.assertIsNotNone(metrics["last_success_at"])
+        self.assertEqual(read_refresher_metrics(), metrics)
+
+        market_data = get_market_data_metrics()
+        self.assertEqual(market_data["stocks"], 3)
+        self.assertLess(market_data["max_price_age_seconds"], 60)
+        self.assertGreaterEqual(market_data["refresher_lag_seconds"], 0)
+
+    def test_requests_can_leave_refreshing_to_the_refresher(self):
+        trading_service = TradingService(Mock(), Mock(), price_provider=self.price_provider, refresh_in_requests=False)
+
+        with patch.object(self.price_provider, "get_prices") as mock_get_prices, patch.object(self.price_provider, "get_price") as mock_get_price:
+            self.assertEqual(trading_service.get_current_stock_prices(["AAPL", "GOOGL"]), {"AAPL": Decimal("150.00"), "GOOGL": Decimal("170.00")})
+            self.assertEqual(trading_service.get_current_stock_price("DEAD"), Decimal("1.00"))
+
+        mock_get_prices.assert_not_called()
+        mock_get_price.assert_not_called()
+
+    def test_refresh_stock_prices_command(self):
+        out = StringIO()
+
+        # the command uses the container's provider, Yahoo Finance by default
+        with patch.object(YFinancePriceProvider, "get_prices", return_value={"AAPL": Money.of(1), "GOOGL": Money.of(2), "DEAD": Money.of(3)}):
+            call_command("refresh_stock_prices", "--once", stdout=out)
+
+        self.assertIn("Refreshed 3 price(s)", out.getvalue())
+        self.assertEqual(read_refresher_metrics()["runs"], 1)
+
+    def test_market_data_metrics_view(self):
+        response = self.client.get(reverse("stock_trading:market_data_metrics"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["stocks"], 3)
+        self.assertEqual(response.json()["runs"], 0)
+
+    @patch("stock_trading.refresher.PRICE_REFRESHER_THREAD", False)
+    @patch("stock_trading.refresher.start_refresher_thread")
+    def test_entry_point_leaves_the_refresher_thread_off_by_default(self, start_refresher_thread):
+        self.assertIsNone(start_configured_refresher_thread())
+        start_refresher_thread.assert_not_called()
+
+    @patch("stock_trading.refresher.PRICE_REFRESHER_THREAD", True)
+    @patch("stock_trading.refresher.start_refresher_thread")
+    def test_entry_point_starts_the_enabled_refresher_thread(self, start_refresher_thread):
+        self.assertIs(start_configured_refresher_thread(), start_refresher_thread.return_value)
+        start_refresher_thread.assert_called_once_with()
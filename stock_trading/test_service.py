@@ -3,18 +3,31 @@ from unittest.mock import Mock, patch, MagicMock
 from uuid import uuid4
 from decimal import Decimal
 from datetime import timedelta
+from django.core.cache import cache
+from django.test import TestCase as DjangoTestCase, override_settings
 from django.utils.timezone import now
 
-from stock_trading.services import TradingService, fetch_stock_price
+from core.money import Money
+from stock_trading.services import TradingService
 from stock_trading.models import Stock, StockOwnership
 from marshmallow import ValidationError
 from core.models import Account
+from core.services import IPriceProvider
+from accounts.models import CheckingAccount, CustodyAccount
+
+# The tests must not clear or fill the shared cache of an app or refresher running on the same checkout
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
 
 class TestStockTrading(unittest.TestCase):
     def setUp(self):
         self.transaction_service = Mock()
         self.account_service = Mock()
-        self.trading_service = TradingService(self.transaction_service, self.account_service)
+        self.price_provider = Mock(spec=IPriceProvider)
+        self.trading_service = TradingService(self.transaction_service, self.account_service, price_provider=self.price_provider)
+        caches_override = override_settings(CACHES=LOCMEM_CACHES)
+        caches_override.enable()
+        self.addCleanup(caches_override.disable)
+        cache.clear()
 
         # Mock UUIDs
         self.stock_one_uuid = uuid4()
@@ -70,11 +83,11 @@ class TestStockTrading(unittest.TestCase):
         # Mock the custody account
         self.account_service.get_bank_custody_account.return_value = self.account
 
-        # Mock stock ownerships
-        mock_ownership_filter.return_value = [self.mock_ownership]
+        # Mock stock ownerships, loaded together with their stocks
+        mock_ownership_filter.return_value.select_related.return_value = [self.mock_ownership]
 
-        # Mock get_current_stock_price to return the mocked current price
-        self.trading_service.get_current_stock_price = MagicMock(return_value=150)
+        # Mock get_current_stock_prices to return the mocked current price
+        self.trading_service.get_current_stock_prices = MagicMock(return_value={"AAPL": 150})
 
         # Call the method
         result = self.trading_service.get_all_available_stocks()
@@ -90,6 +103,7 @@ class TestStockTrading(unittest.TestCase):
             }
         ]
         self.assertEqual(result, expected_result)
+        self.trading_service.get_current_stock_prices.assert_called_once_with(["AAPL"])
 
     def test_get_all_available_stokc_failed_to_fetch_stocks(self):
             self.trading_service.get_all_available_stocks = MagicMock(side_effect=ValidationError("Failed to fetch stocks"))
@@ -137,11 +151,10 @@ class TestStockTrading(unittest.TestCase):
     @patch("accounts.models.CustodyAccount.objects.filter")
     @patch("accounts.models.CheckingAccount.objects.filter")
     @patch("stock_trading.models.Stock.objects.get")
-    @patch("stock_trading.services.fetch_stock_price")
-    def test_buy_stock_success(self, mock_fetch_stock_price, mock_get_stock, mock_checking_filter,
+    def test_buy_stock_success(self, mock_get_stock, mock_checking_filter,
                                 mock_custody_filter, mock_select_for_update, mock_get_or_create):
         # Mock stock price
-        mock_fetch_stock_price.return_value = Decimal("150.00")
+        self.price_provider.get_price.return_value = Money.of("150.00")
         self.trading_service.get_current_stock_price= MagicMock(return_value=150)
 
         # Mock stock details
@@ -185,10 +198,9 @@ class TestStockTrading(unittest.TestCase):
 
     @patch("stock_trading.models.Stock.objects.get")
     @patch("accounts.models.CheckingAccount.objects.filter")
-    @patch("stock_trading.services.fetch_stock_price")
-    def test_buy_stock_failed(self, mock_fetch_stock_price, mock_account_filter, mock_get_stock):
+    def test_buy_stock_failed(self, mock_account_filter, mock_get_stock):
         # price
-        mock_fetch_stock_price.return_value = Decimal("150.00")
+        self.price_provider.get_price.return_value = Money.of("150.00")
 
         # account
         mock_account_filter.return_value.first.return_value = self.account
@@ -203,17 +215,19 @@ class TestStockTrading(unittest.TestCase):
 
             self.assertIn("Stock purchase failed: ", str(context.exception))
 
+    @patch("stock_trading.models.Stock.objects.filter")
     @patch("stock_trading.models.Stock.objects.select_for_update")
-    def test_get_current_stock_price(self, mocked_stock):
+    def test_get_current_stock_price(self, mocked_stock, mocked_filter):
         # Mock stock instance
         mock_stock = self.mock_stock
         mock_stock.last_updated = now() - timedelta(minutes=2)
 
-
+        # the plain read finds a stale price, the refresher locks the row
+        mocked_filter.return_value.first.return_value = mock_stock
         mocked_stock.return_value.filter.return_value.first.return_value = mock_stock
 
-        # Mock fetch_stock_price function to return a specific price
-        with patch("stock_trading.services.fetch_stock_price", return_value=Decimal("150.00")):
+        # Mock the price provider to return a specific price
+        with patch.object(self.price_provider, "get_price", return_value=Money.of("150.00")):
             result = self.trading_service.get_current_stock_price(mock_stock.symbol)
 
         # Assert the correct price is returned
@@ -224,6 +238,31 @@ class TestStockTrading(unittest.TestCase):
         self.assertTrue(mock_stock.last_updated > now() - timedelta(seconds=10))
         mock_stock.save.assert_called_once_with(update_fields=["current_price", "last_updated"])
 
+    @patch("stock_trading.models.Stock.objects.filter")
+    @patch("stock_trading.models.Stock.objects.select_for_update")
+    def test_get_current_stock_price_fresh_price_takes_no_lock(self, mocked_stock, mocked_filter):
+        self.mock_stock.last_updated = now() - timedelta(seconds=5)
+        mocked_filter.return_value.first.return_value = self.mock_stock
+
+        with patch.object(self.price_provider, "get_price") as mock_get_price:
+            first = self.trading_service.get_current_stock_price(self.mock_stock.symbol)
+            second = self.trading_service.get_current_stock_price(self.mock_stock.symbol)
+
+        self.assertEqual((first, second), (Decimal("150.00"), Decimal("150.00")))
+        # the second read is served from the cache
+        mocked_filter.assert_called_once_with(symbol=self.mock_stock.symbol)
+        mocked_stock.assert_not_called()
+        mock_get_price.assert_not_called()
+
+    @patch("stock_trading.models.Stock.objects.filter")
+    def test_get_current_stock_prices_unknown_symbol(self, mocked_filter):
+        mocked_filter.return_value.order_by.return_value = []
+
+        with self.assertRaises(ValidationError) as context:
+            self.trading_service.get_current_stock_prices(["NOPE"])
+
+        self.assertIn("Stock with symbol NOPE does not exist.", str(context.exception))
+
     def test_get_current_stock_price_failed(self):
         # Create non existing stock
         not_existing_stock = "NOT_EXISTING_STOCK"
@@ -234,4 +273,90 @@ class TestStockTrading(unittest.TestCase):
         with self.assertRaises(ValidationError) as context:
             self.trading_service.get_current_stock_price(not_existing_stock)
 
-        self.assertIn(f"Failed to fetch and update stock price for {stock_symbol}: ", str(context.exception))
\ No newline at end of file
+        self.assertIn(f"Failed to fetch and update stock price for {stock_symbol}: ", str(context.exception))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestStockPriceRefresh(DjangoTestCase):
+    def setUp(self):
+        cache.clear()
+        self.price_provider = Mock(spec=IPriceProvider)
+        self.trading_service = TradingService(Mock(), Mock(), price_provider=self.price_provider)
+
+    @patch("stock_trading.models.Stock.objects.filter")
+    @patch("stock_trading.models.Stock.objects.select_for_update")
+    def test_get_current_stock_price_refreshed_by_another_worker(self, mocked_stock, mocked_filter):
+        stale_stock = MagicMock(symbol="AAPL", current_price=Decimal("150.00"), last_updated=now() - timedelta(minutes=2))
+        refreshed_stock = MagicMock(symbol="AAPL", current_price=Decimal("151.00"), last_updated=now())
+        mocked_filter.return_value.first.return_value = stale_stock
+        mocked_stock.return_value.filter.return_value.first.return_value = refreshed_stock
+
+        with patch.object(self.price_provider, "get_price") as mock_get_price:
+            result = self.trading_service.get_current_stock_price("AAPL")
+
+        # the price was refreshed while waiting for the lock, so it is not fetched again
+        self.assertEqual(result, Decimal("151.00"))
+        mock_get_price.assert_not_called()
+        refreshed_stock.save.assert_not_called()
+
+    @patch("stock_trading.models.Stock.objects.bulk_update")
+    @patch("stock_trading.models.Stock.objects.filter")
+    @patch("stock_trading.models.Stock.objects.select_for_update")
+    def test_get_current_stock_prices_refreshes_stale_prices_at_once(self, mocked_stock, mocked_filter, mock_bulk_update):
+        fresh = MagicMock(symbol="AAPL", current_price=Decimal("150.00"), last_updated=now())
+        stale = [MagicMock(symbol=symbol, current_price=Decimal("1.00"), last_updated=now() - timedelta(minutes=5)) for symbol in ("GOOGL", "MSFT")]
+        mocked_filter.return_value.order_by.return_value = [fresh] + stale
+        mocked_stock.return_value.filter.return_value.order_by.return_value = stale
+
+        with patch.object(self.price_provider, "get_prices", return_value={"GOOGL": Money.of("170.25"), "MSFT": Money.of("410.10")}) as mock_get_prices:
+            prices = self.trading_service.get_current_stock_prices(["AAPL", "GOOGL", "MSFT", "AAPL"])
+
+        self.assertEqual(prices, {"AAPL": Decimal("150.00"), "GOOGL": Decimal("170.25"), "MSFT": Decimal("410.10")})
+        # one download for all stale symbols, fresh prices are not fetched
+        mock_get_prices.assert_called_once_with(["GOOGL", "MSFT"])
+        mock_bulk_update.assert_called_once_with(stale, ["current_price", "last_updated"])
+        self.assertEqual(stale[1].current_price, Decimal("410.10"))
+
+        # the next lookup is served from the cache
+        mocked_filter.reset_mock()
+        self.assertEqual(self.trading_service.get_current_stock_prices(["MSFT", "AAPL"]), {"MSFT": Decimal("410.10"), "AAPL": Decimal("150.00")})
+        mocked_filter.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestPortfolio(DjangoTestCase):
+    def setUp(self):
+        cache.clear()
+        self.account_service = Mock()
+        self.price_provider = Mock(spec=IPriceProvider)
+        self.trading_service = TradingService(Mock(), self.account_service, price_provider=self.price_provider)
+
+        checking_account = CheckingAccount.objects.create(PIN="1234", opening_balance=Decimal("1000.00"))
+        self.custody_account = CustodyAccount.objects.create(reference_account=checking_account)
+        self.account_service.get_account.return_value = self.custody_account
+        for symbol, price, quantity in (("AAPL", "150.00", 3), ("GOOGL", "170.25", 2), ("MSFT", "410.10", 1)):
+            stock = Stock.objects.create(symbol=symbol, stock_name=symbol, current_price=Decimal(price))
+            StockOwnership.objects.create(account=self.custody_account, stock=stock, quantity=quantity)
+
+    def test_get_portfolio(self):
+        # one query for the holdings with their stocks and one for all of their prices
+        with self.assertNumQueries(2):
+            portfolio = self.trading_service.get_portfolio(self.custody_account.account_id)
+
+        self.assertCountEqual([holding["symbol"] for holding in portfolio["holdings"]], ["AAPL", "GOOGL", "MSFT"])
+        self.assertEqual({holding["symbol"]: holding["total_value"] for holding in portfolio["holdings"]}, {"AAPL": Decimal("450.00"), "GOOGL": Decimal("340.50"), "MSFT": Decimal("410.10")})
+        self.assertEqual(portfolio["total_value"], Decimal("1200.60"))
+        self.price_provider.get_prices.assert_not_called()
+
+        # the prices are cached now, only the holdings are read again
+        with self.assertNumQueries(1):
+            self.assertEqual(self.trading_service.get_portfolio_value(self.custody_account.account_id), Decimal("1200.60"))
+
+    def test_get_portfolio_without_holdings(self):
+        StockOwnership.objects.all().delete()
+
+        with self.assertNumQueries(1):
+            portfolio = self.trading_service.get_portfolio(self.custody_account.account_id)
+
+        self.assertEqual(portfolio, {"holdings": [], "total_value": Money(0)})
+        self.assertEqual(self.trading_service.get_all_user_stocks(self.custody_account.account_id), [])
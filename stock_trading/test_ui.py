@@ -134,7 +134,7 @@ class StockTradingViewsTest(TestCase):
                 "number_available": self.mock_ownership.quantity,
             }
         ]
-        self.trading_service.get_all_user_stocks.return_value = None
+        self.trading_service.get_portfolio.return_value = {"holdings": [], "total_value": Decimal("0.00")}
 
         response = self.client.get(reverse("stock_trading:stock_market", args=[self.account_id]))
 
@@ -151,7 +151,7 @@ class StockTradingViewsTest(TestCase):
                 "number_available": self.mock_ownership.quantity,
             }
         ]
-        self.trading_service.get_all_user_stocks.return_value = self.user_portfolio
+        self.trading_service.get_portfolio.return_value = {"holdings": self.user_portfolio, "total_value": Decimal("1500.00")}
         self.account_service.get_balance.return_value = Decimal("1000.00")  # Mock expected value
 
         # Use the Django test client to call the URL
@@ -168,10 +168,10 @@ class StockTradingViewsTest(TestCase):
         self.assertEqual(response.context["account_id"], str(self.account_id))
         self.assertEqual(response.context["available_funds"], Decimal("1000.00"))
         self.assertEqual(response.context["portfolio"], self.user_portfolio)
-        self.assertEqual(
-            response.context["total_portfolio_value"],
-            self.trading_service.get_portfolio_value.return_value
-        )
+        self.assertEqual(response.context["total_portfolio_value"], Decimal("1500.00"))
+        # the holdings and their total come from one portfolio build
+        self.trading_service.get_portfolio.assert_called_once_with(self.account_id)
+        self.trading_service.get_portfolio_value.assert_not_called()
         self.assertEqual(response.context["available_stocks"][0]["name"], self.mock_stock.stock_name)
 
     def test_buy_stock_get_request(self):
@@ -194,7 +194,7 @@ class StockTradingViewsTest(TestCase):
 
     @patch("stock_trading.models.StockOwnership.objects.get_or_create")
     @patch("accounts.models.CheckingAccount.objects.filter")
-    @patch("stock_trading.services.fetch_stock_price")
+    @patch("stock_trading.providers.YFinancePriceProvider.get_price")
     @patch("stock_trading.models.Stock.objects.get")
     @patch("stock_trading.views.BuyStockForm")
     def test_buy_stocks_with_valid_form(self, mock_buy_stock_form, mock_stock_get, mock_fetch_stock_price, mock_account_filter, mock_get_or_create):
@@ -259,7 +259,7 @@ class StockTradingViewsTest(TestCase):
 
     @patch("stock_trading.models.StockOwnership.objects.get")
     @patch("accounts.models.CheckingAccount.objects.filter")
-    @patch("stock_trading.services.fetch_stock_price")
+    @patch("stock_trading.providers.YFinancePriceProvider.get_price")
     @patch("stock_trading.models.Stock.objects.get")
     @patch("stock_trading.views.SellStockForm")
     def test_sell_stock_valid_form(self, mock_sell_stock_form, mock_stock_get, mock_fetch_stock_price, mock_account_filter, mock_get):
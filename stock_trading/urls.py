@@ -9,5 +9,6 @@ urlpatterns = [
     path("<uuid:account_id>/history", views.history, name="history"),
     path("<uuid:account_id>/buy/<uuid:stock_id>/", views.buy_stock, name="buy_stock"),
     path("<uuid:account_id>/sell/<uuid:stock_id>/", views.sell_stock, name="sell_stock"),
+    path("market-data/metrics", views.market_data_metrics, name="market_data_metrics"),
 
 ]
\ No newline at end of file
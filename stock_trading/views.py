@@ -1,12 +1,14 @@
 # Create your views here.
 
 from dependency_injector.wiring import inject, Provide
-from django.http import HttpRequest, Http404
+from django.http import HttpRequest, Http404, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import render
 from marshmallow import ValidationError
 
 from core.services import ITradingService, ITransactionService, IAccountService
+from core.timeframes import parse_timeframe
 from stock_trading.forms import BuyStockForm, SellStockForm
+from stock_trading.refresher import get_market_data_metrics
 
 
 @inject
@@ -27,9 +29,9 @@ def stock_market(
         if not available_stocks:
             raise ValidationError("No available stocks.")
 
-        # Fetch user stocks portfolio
-        portfolio = trading_service.get_all_user_stocks(account_id)
-        message = "No stocks are currently owned. Discover available stocks in the Discover Tab!" if not portfolio else ""
+        # Fetch user stocks portfolio, the holdings and their total value at once
+        portfolio = trading_service.get_portfolio(account_id)
+        message = "No stocks are currently owned. Discover available stocks in the Discover Tab!" if not portfolio["holdings"] else ""
 
         # Render the dashboard
         return render(
@@ -38,8 +40,8 @@ def stock_market(
             {
                 "account_id": str(account_id),
                 "available_funds": account_service.get_balance(account.reference_account_id),
-                "portfolio": portfolio,
-                "total_portfolio_value": trading_service.get_portfolio_value(account_id),
+                "portfolio": portfolio["holdings"],
+                "total_portfolio_value": portfolio["total_value"],
                 "available_stocks": available_stocks,
                 "message": message,
             },
@@ -160,14 +162,24 @@ def history(
     account_service: IAccountService = Provide["account_service"],
 ):
     timeframe = request.GET.get("timeframe", "all_time")
+    start_date = request.GET.get("start", "")
+    end_date = request.GET.get("end", "")
 
     # Fetch the account object
     custody_account = account_service.get_account(account_id)
     if not custody_account:
         raise Http404("Account not found.")
 
-    # Fetch stock transaction history
-    stock_transaction_history = transaction_service.get_stock_transaction_history(custody_account.reference_account_id, timeframe)
+    # Fetch stock transaction history, a custom date range replaces the timeframe option
+    try:
+        if start_date or end_date:
+            timeframe = "custom"
+            date_range = parse_timeframe(start=start_date, end=end_date)
+        else:
+            date_range = timeframe
+        stock_transaction_history = transaction_service.get_stock_transaction_history(custody_account.reference_account_id, date_range)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
 
     for transaction in stock_transaction_history:
         transaction["stock_symbol"] = trading_service.get_stock(transaction["stock_id"]).symbol
@@ -177,6 +189,15 @@ def history(
         "account": custody_account,
         "stock_transaction_history": stock_transaction_history,
         "selected_timeframe": timeframe,
+        "start_date": start_date,
+        "end_date": end_date,
     }
 
     return render(request, "stock_trading/stock_transaction_history.html", context)
+
+
+def market_data_metrics(request: HttpRequest):
+    """
+    Report the price lag and the failures of the background price refresher as JSON, for monitoring.
+    """
+    return JsonResponse(get_market_data_metrics())
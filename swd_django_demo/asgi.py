@@ -16,3 +16,8 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'swd_django_demo.settings')
 
 # get_asgi_application() function returns the ASGI application callable that can be used to run the application.
 application = get_asgi_application()
+
+# Only the processes serving requests run the background price refresher, and only if it is enabled
+from stock_trading.refresher import start_configured_refresher_thread  # noqa: E402
+
+start_configured_refresher_thread()
@@ -12,7 +12,9 @@ from customers.services import CustomerService
 from orders.services import OrderService
 from products.models import Product
 from products.services import ProductService
+from stock_trading.providers import RandomWalkPriceProvider, YFinancePriceProvider
 from stock_trading.services import TradingService
+from stock_trading.settings import PRICE_PROVIDER
 from transactions.services import TransactionService
 from accounts.services import AccountService
 
@@ -46,8 +48,15 @@ class Container(containers.DeclarativeContainer):
         account_service=account_service
     )
 
+    # Selector provider for the source of the stock prices, chosen by STOCK_PRICE_PROVIDER
+    price_provider = providers.Selector(
+        providers.Object(PRICE_PROVIDER),
+        yfinance=providers.Singleton(YFinancePriceProvider),
+        random_walk=providers.Singleton(RandomWalkPriceProvider),
+    )
+
     trading_service = providers.Singleton(
-        TradingService, transaction_service=transaction_service, account_service=account_service
+        TradingService, transaction_service=transaction_service, account_service=account_service, price_provider=price_provider
     )
 
     # Singleton provider for OrderService with product_service as a dependency
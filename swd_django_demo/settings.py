@@ -211,6 +211,33 @@ STOCK_OWNERSHIP_MODEL = "stock_trading.StockOwnership"
 
 TRANSACTION_MODEL = "transactions.TransactionBase"
 
+# Transactions older than this are moved to the archive by 'python manage.py archive_transactions'
+TRANSACTION_ARCHIVE_AFTER_DAYS = 365
+
+# Stock prices are refreshed when older than this many seconds, fresher reads are served from the price cache
+STOCK_PRICE_CACHE_TTL = 60
+
+# The refresh_stock_prices command (or the refresher thread) keeps all prices fresh on this cadence in seconds.
+# With it running, requests can leave the refreshing to it and only ever read cached prices.
+STOCK_PRICE_REFRESH_INTERVAL = 30
+STOCK_PRICE_REFRESH_IN_REQUESTS = True
+STOCK_PRICE_REFRESHER_THREAD = False
+
+# The stock prices and the refresher metrics live in the default cache. It has to be shared by the web processes
+# and the refresh_stock_prices command, a per-process LocMemCache would hide the refreshed prices from the web
+# processes. The file based cache is shared by all processes of one host, use Redis or Memcached across hosts.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'django_cache',
+    }
+}
+
+# 'yfinance' fetches live prices, 'random_walk' simulates a reproducible market for load tests and CI without network
+STOCK_PRICE_PROVIDER = "yfinance"
+STOCK_SIMULATED_PRICE_SEED = 0
+STOCK_SIMULATED_PRICE_TICK_SECONDS = 1.0
+
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
 ]
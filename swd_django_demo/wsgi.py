@@ -26,3 +26,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'swd_django_demo.settings')
 
 application = get_wsgi_application()
+
+# Only the processes serving requests run the background price refresher, and only if it is enabled
+from stock_trading.refresher import start_configured_refresher_thread  # noqa: E402
+
+start_configured_refresher_thread()
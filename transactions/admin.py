@@ -1,7 +1,8 @@
 from django.contrib import admin
 
-from transactions.models import Transaction, StockTransaction, ATMTransaction
+from transactions.models import Transaction, StockTransaction, ATMTransaction, ArchivedTransaction
 
 admin.site.register(Transaction)
 admin.site.register(StockTransaction)
-admin.site.register(ATMTransaction)
\ No newline at end of file
+admin.site.register(ATMTransaction)
+admin.site.register(ArchivedTransaction)
\ No newline at end of file
@@ -0,0 +1,124 @@
+import csv
+import json
+import time
+from typing import Iterator, Optional, Tuple
+
+from marshmallow import ValidationError
+
+from core.services import IAccountService
+
+# Number of payments validated and committed together
+INGESTION_CHUNK_SIZE = 5000
+
+PAYMENT_FIELDS = ["sending_account_id", "receiving_account_id", "amount"]
+
+# Short column names accepted in payment files
+PAYMENT_FIELD_ALIASES = {
+    "sender": "sending_account_id",
+    "receiver": "receiving_account_id",
+}
+
+REJECT_FIELDS = ["line"] + PAYMENT_FIELDS + ["error"]
+
+
+def _normalize_payment(record: dict) -> dict:
+    payment = {PAYMENT_FIELD_ALIASES.get(key.strip(), key.strip()): value for key, value in record.items() if key}
+    missing = [field for field in PAYMENT_FIELDS if payment.get(field) in (None, "")]
+    if missing:
+        raise ValueError(f"Missing field(s): {', '.join(missing)}.")
+    return {field: payment[field] for field in PAYMENT_FIELDS}
+
+
+def read_payments(file, file_format: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Stream-parse a payment file line by line.
+
+    :param file: An open text file.
+    :param file_format: 'csv' (with a header row) or 'jsonl'.
+    :return: An iterator of (line number, payment, error) tuples, the payment is None when the line could not be parsed.
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(file)
+        for record in reader:
+            try:
+                yield reader.line_num, _normalize_payment(record), None
+            except ValueError as e:
+                yield reader.line_num, None, str(e)
+    elif file_format == "jsonl":
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("Expected a JSON object.")
+                yield line_number, _normalize_payment(record), None
+            except ValueError as e:
+                yield line_number, None, str(e)
+    else:
+        raise ValueError("Invalid format. Valid options are 'csv' or 'jsonl'.")
+
+
+class PaymentFileIngestor:
+    """
+    Posts the payments of a file in chunks through the batch transfer API and writes rejected lines to a rejects file.
+    """
+
+    def __init__(self, account_service: IAccountService, chunk_size: int = INGESTION_CHUNK_SIZE):
+        self.account_service = account_service
+        self.chunk_size = max(1, chunk_size)
+
+    def ingest(self, file, file_format: str, rejects_file, progress=None) -> dict:
+        """
+        Ingest a payment file.
+
+        :param file: An open text file with the payments.
+        :param file_format: 'csv' or 'jsonl'.
+        :param rejects_file: An open text file the rejected lines are written to as CSV.
+        :param progress: Optional callback called with the running report after every chunk.
+        :return: A report with the number of 'rows', 'posted' and 'rejected' payments, the 'seconds' taken and the 'rows_per_second'.
+        """
+        rejects = csv.DictWriter(rejects_file, fieldnames=REJECT_FIELDS)
+        rejects.writeheader()
+
+        report = {"rows": 0, "posted": 0, "rejected": 0, "seconds": 0.0, "rows_per_second": 0.0}
+        started = time.perf_counter()
+        chunk = []
+
+        def reject(line_number, payment, error):
+            rejects.writerow({"line": line_number, **(payment or {}), "error": error})
+            report["rejected"] += 1
+
+        def flush():
+            try:
+                result = self.account_service.create_transactions_batch([payment for _, payment in chunk])
+            except ValidationError as e:
+                # the chunk was rolled back as a whole
+                result = {"created": 0, "failures": [{"index": index, "error": str(e)} for index in range(len(chunk))]}
+            for failure in result["failures"]:
+                line_number, payment = chunk[failure["index"]]
+                reject(line_number, payment, failure["error"])
+            report["posted"] += result["created"]
+            chunk.clear()
+            self._update_throughput(report, started)
+            if progress:
+                progress(report)
+
+        for line_number, payment, error in read_payments(file, file_format):
+            report["rows"] += 1
+            if error:
+                reject(line_number, None, error)
+                continue
+            chunk.append((line_number, payment))
+            if len(chunk) >= self.chunk_size:
+                flush()
+
+        if chunk:
+            flush()
+
+        self._update_throughput(report, started)
+        return report
+
+    def _update_throughput(self, report: dict, started: float) -> None:
+        report["seconds"] = time.perf_counter() - started
+        report["rows_per_second"] = report["rows"] / report["seconds"] if report["seconds"] else 0.0
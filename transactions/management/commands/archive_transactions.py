@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+
+from swd_django_demo.containers import Container
+from transactions.settings import ARCHIVE_AFTER_DAYS
+
+
+class Command(BaseCommand):
+    help = "Move transactions older than the archive age from the hot tables to the archive tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=ARCHIVE_AFTER_DAYS,
+            help=f"Archive transactions older than this many days, at least {ARCHIVE_AFTER_DAYS}.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000, help="Transactions moved per database transaction.")
+
+    def handle(self, *args, **options):
+        if options["days"] < ARCHIVE_AFTER_DAYS:
+            raise CommandError(f"Only transactions older than {ARCHIVE_AFTER_DAYS} days can be archived.")
+
+        transaction_service = Container().transaction_service()
+        archived = transaction_service.archive_transactions(
+            before=now() - timedelta(days=options["days"]),
+            batch_size=max(1, options["batch_size"]),
+        )
+
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} transaction(s)."))
@@ -0,0 +1,159 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.timezone import now
+
+from transactions.models import ArchivedTransaction, JournalLine, MonthlyAccountRollup, Transaction
+from transactions.services import TransactionService
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed synthetic ledger rows and report query plans and latencies of the history, totals and balance queries. "
+        "Runs against a throwaway test database created from the default one, unless --in-place is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000, help="Number of synthetic transactions to insert.")
+        parser.add_argument("--accounts", type=int, default=10_000, help="Number of synthetic accounts.")
+        parser.add_argument("--samples", type=int, default=20, help="Number of accounts every query is timed for.")
+        parser.add_argument("--batch-size", type=int, default=10_000, help="Rows per bulk insert.")
+        parser.add_argument(
+            "--compare",
+            action="store_true",
+            help="Also measure without the account/date indexes by dropping and re-creating them.",
+        )
+        parser.add_argument(
+            "--in-place",
+            action="store_true",
+            help=(
+                "Run against the configured database itself instead of a throwaway copy. It must not hold any "
+                "transactions, the journal and the rollups are rebuilt and --compare drops the ledger indexes."
+            ),
+        )
+        parser.add_argument("--keep", action="store_true", help="Keep the synthetic rows after an --in-place benchmark.")
+
+    def handle(self, *args, **options):
+        if options["in_place"]:
+            # the rebuilds are global, real transactions would have their journal and rollups rewritten
+            if Transaction.objects.exists() or ArchivedTransaction.objects.exists():
+                raise CommandError(
+                    f"The database {connection.settings_dict['NAME']} already holds transactions, refusing to benchmark "
+                    "in place. Run without --in-place to use a throwaway test database."
+                )
+            self._benchmark(options)
+            return
+
+        # the test database settings decide where the copy lives, e.g. an in-memory database for SQLite
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        self.stdout.write(f"Benchmarking on the throwaway database {connection.settings_dict['NAME']}.")
+        try:
+            self._benchmark(dict(options, keep=True))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _benchmark(self, options):
+        account_ids = [uuid4() for _ in range(options["accounts"])]
+
+        started = time.perf_counter()
+        self._seed(account_ids, options["rows"], options["batch_size"])
+        self.stdout.write(f"Inserted {options['rows']} rows in {time.perf_counter() - started:.1f}s ({connection.vendor}).")
+
+        # bulk inserts bypass the posting hook, so the journal and the rollups have to be rebuilt
+        started = time.perf_counter()
+        TransactionService().rebuild_journal_lines()
+        self.stdout.write(f"Rebuilt journal lines in {time.perf_counter() - started:.1f}s.")
+
+        started = time.perf_counter()
+        TransactionService().rebuild_monthly_rollups()
+        self.stdout.write(f"Rebuilt monthly rollups in {time.perf_counter() - started:.1f}s.")
+
+        sample_ids = random.sample(account_ids, min(options["samples"], len(account_ids)))
+        try:
+            self._report("with account/date indexes", sample_ids)
+
+            if options["compare"]:
+                indexes = [(model, index) for model in (Transaction, JournalLine) for index in model._meta.indexes]
+                with connection.schema_editor() as schema_editor:
+                    for model, index in indexes:
+                        schema_editor.remove_index(model, index)
+                try:
+                    self._report("without account/date indexes", sample_ids)
+                finally:
+                    with connection.schema_editor() as schema_editor:
+                        for model, index in indexes:
+                            schema_editor.add_index(model, index)
+        finally:
+            if not options["keep"]:
+                self._cleanup(account_ids)
+
+    def _seed(self, account_ids, rows, batch_size):
+        end = now()
+        span_seconds = int(timedelta(days=3 * 365).total_seconds())
+
+        for offset in range(0, rows, batch_size):
+            Transaction.objects.bulk_create([
+                Transaction(
+                    sending_account_id=random.choice(account_ids),
+                    receiving_account_id=random.choice(account_ids),
+                    amount=Decimal(random.randint(1, 100_000)) / 100,
+                    date=end - timedelta(seconds=random.randint(0, span_seconds)),
+                )
+                for _ in range(min(batch_size, rows - offset))
+            ], batch_size=batch_size)
+
+    def _report(self, label, sample_ids):
+        transaction_service = TransactionService()
+        account_id = sample_ids[0]
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n== {label} =="))
+
+        plans = {
+            "history": JournalLine.objects.filter(account_id=account_id).select_related("transaction").order_by("-date", "-transaction_id"),
+            "totals (30 days)": JournalLine.objects.filter(account_id=account_id, date__gte=now() - timedelta(days=30)),
+        }
+        for name, query in plans.items():
+            self.stdout.write(f"-- plan: {name}")
+            self.stdout.write(query.explain())
+
+        timings = {
+            "get_transaction_history(30_days)": lambda a: transaction_service.get_transaction_history(a, "30_days"),
+            "get_transaction_history(all_time)": lambda a: transaction_service.get_transaction_history(a, "all_time"),
+            "aggregate_account_amounts(30_days)": lambda a: transaction_service.aggregate_account_amounts(a, "30_days"),
+            "aggregate_account_amounts(all_time)": lambda a: transaction_service.aggregate_account_amounts(a, "all_time"),
+            "get_ledger_balance": transaction_service.get_ledger_balance,
+        }
+        for name, query in timings.items():
+            durations = []
+            for sample_id in sample_ids:
+                started = time.perf_counter()
+                query(sample_id)
+                durations.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(
+                f"{name:<40} median {statistics.median(durations):8.2f} ms   max {max(durations):8.2f} ms"
+            )
+
+    def _cleanup(self, account_ids):
+        # The journal lines reference the transactions, so they go first
+        for offset in range(0, len(account_ids), 500):
+            JournalLine.objects.filter(account_id__in=account_ids[offset:offset + 500]).delete()
+
+        # Raw deletes avoid collecting millions of model instances for the multi-table inheritance cascade
+        table = connection.ops.quote_name(Transaction._meta.db_table)
+        column = connection.ops.quote_name("sending_account_id")
+        field = Transaction._meta.get_field("sending_account_id")
+        with connection.cursor() as cursor:
+            for offset in range(0, len(account_ids), 500):
+                chunk = [field.get_db_prep_value(a, connection) for a in account_ids[offset:offset + 500]]
+                placeholders = ", ".join(["%s"] * len(chunk))
+                cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({placeholders})", chunk)
+
+        for offset in range(0, len(account_ids), 500):
+            MonthlyAccountRollup.objects.filter(account_id__in=account_ids[offset:offset + 500]).delete()
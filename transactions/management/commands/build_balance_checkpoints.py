@@ -0,0 +1,50 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import is_naive, make_aware
+
+from swd_django_demo.containers import Container
+
+
+class Command(BaseCommand):
+    help = "Write balance checkpoints for all accounts with new transactions since their last checkpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--cutoff",
+            help="ISO date or datetime covered by the checkpoints, defaults to the start of the current day.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of account ranges computed in parallel.",
+        )
+        parser.add_argument(
+            "--min-transactions",
+            type=int,
+            default=1,
+            help="Only checkpoint accounts with at least this many new transactions.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = None
+        if options["cutoff"]:
+            try:
+                cutoff = datetime.fromisoformat(options["cutoff"])
+            except ValueError:
+                raise CommandError(f"Invalid cutoff '{options['cutoff']}', expected an ISO date or datetime.")
+            if is_naive(cutoff):
+                cutoff = make_aware(cutoff)
+
+        transaction_service = Container().transaction_service()
+        try:
+            written = transaction_service.build_balance_checkpoints(
+                cutoff=cutoff,
+                workers=options["workers"],
+                min_transactions=options["min_transactions"],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} balance checkpoint(s)."))
@@ -0,0 +1,59 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from swd_django_demo.containers import Container
+from transactions.ingestion import INGESTION_CHUNK_SIZE, PaymentFileIngestor
+
+
+class Command(BaseCommand):
+    help = (
+        "Post the payments of a CSV or JSON Lines file (sender, receiver, amount) in validated chunks "
+        "and write rejected lines to a rejects file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Payment file to ingest.")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="File format, derived from the file extension by default.",
+        )
+        parser.add_argument(
+            "--rejects",
+            help="Path of the rejects file, defaults to the payment file path with a .rejects.csv suffix.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=INGESTION_CHUNK_SIZE,
+            help="Number of payments validated and committed together.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or os.path.splitext(path)[1].lstrip(".").lower()
+        if file_format not in ("csv", "jsonl"):
+            raise CommandError("Cannot derive the file format from the extension, use --format csv or --format jsonl.")
+        rejects_path = options["rejects"] or f"{os.path.splitext(path)[0]}.rejects.csv"
+
+        ingestor = PaymentFileIngestor(Container().account_service(), chunk_size=options["chunk_size"])
+
+        def progress(report):
+            if options["verbosity"] > 1:
+                self.stdout.write(f"{report['rows']} rows, {report['rows_per_second']:.0f} rows/sec")
+
+        try:
+            with open(path, newline="", encoding="utf-8") as file, open(rejects_path, "w", newline="", encoding="utf-8") as rejects_file:
+                report = ingestor.ingest(file, file_format, rejects_file, progress=progress)
+        except OSError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            f"Read {report['rows']} rows in {report['seconds']:.1f}s ({report['rows_per_second']:.0f} rows/sec): "
+            f"{report['posted']} posted, {report['rejected']} rejected."
+        )
+        if report["rejected"]:
+            self.stdout.write(self.style.WARNING(f"Rejected rows were written to {rejects_path}."))
+        else:
+            self.stdout.write(self.style.SUCCESS("All payments were posted."))
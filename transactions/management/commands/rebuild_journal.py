@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from swd_django_demo.containers import Container
+
+
+class Command(BaseCommand):
+    help = "Recompute the double-entry journal lines from the transaction table."
+
+    def handle(self, *args, **options):
+        transaction_service = Container().transaction_service()
+        written = transaction_service.rebuild_journal_lines()
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} journal line(s)."))
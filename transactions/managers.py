@@ -0,0 +1,27 @@
+from collections import defaultdict
+from typing import Iterable, List
+
+from django.db.models import Manager
+
+
+class TransactionManager(Manager):
+
+    def load_polymorphic(self, transactions: Iterable) -> List:
+        # Replace base rows by their child rows, fetched with one bulk query per kind instead of a join per row
+        transactions = list(transactions)
+        child_models = {
+            relation.related_model.KIND: relation.related_model
+            for relation in self.model._meta.related_objects
+            if relation.parent_link
+        }
+
+        ids_by_kind = defaultdict(list)
+        for transaction in transactions:
+            if transaction.kind in child_models:
+                ids_by_kind[transaction.kind].append(transaction.pk)
+
+        children = {}
+        for kind, transaction_ids in ids_by_kind.items():
+            children.update(child_models[kind].objects.in_bulk(transaction_ids))
+
+        return [children.get(transaction.pk, transaction) for transaction in transactions]
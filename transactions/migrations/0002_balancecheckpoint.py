@@ -0,0 +1,56 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:59
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("transactions", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="atmtransaction",
+            name="atmId",
+            field=models.UUIDField(default=uuid.uuid4, editable=False),
+        ),
+        migrations.CreateModel(
+            name="BalanceCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "account_id",
+                    models.UUIDField(help_text="UUID of the checkpointed account"),
+                ),
+                (
+                    "checkpoint_date",
+                    models.DateTimeField(
+                        help_text="The checkpoint covers all transactions before this point in time"
+                    ),
+                ),
+                (
+                    "balance",
+                    models.DecimalField(
+                        decimal_places=2,
+                        help_text="Net ledger amount up to the checkpoint date",
+                        max_digits=14,
+                    ),
+                ),
+                ("transaction_count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "db_table": "transaction_balance_checkpoint",
+                "unique_together": {("account_id", "checkpoint_date")},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("transactions", "0002_balancecheckpoint"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["sending_account_id", "date"],
+                name="transaction_sending_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["receiving_account_id", "date"],
+                name="transaction_receiving_date_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,106 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:10
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, DateField, F, Q, Sum
+from django.db.models.functions import TruncMonth
+
+
+def backfill_monthly_rollups(apps, schema_editor):
+    # Roll up the transactions that were posted before the table existed
+    Transaction = apps.get_model("transactions", "Transaction")
+    MonthlyAccountRollup = apps.get_model("transactions", "MonthlyAccountRollup")
+
+    month = TruncMonth("date", output_field=DateField())
+    rollups = {}
+
+    sent = (
+        Transaction.objects.filter(sending_account_id__isnull=False)
+        .annotate(month=month)
+        .values("sending_account_id", "month")
+        .annotate(total=Sum("amount"), count=Count("transaction_id"))
+    )
+    for row in sent:
+        rollup = rollups.setdefault((row["sending_account_id"], row["month"]), [Decimal("0.00"), Decimal("0.00"), 0])
+        rollup[0] += row["total"]
+        rollup[2] += row["count"]
+
+    # self transfers were already counted on the sending side
+    received = (
+        Transaction.objects.filter(receiving_account_id__isnull=False)
+        .annotate(month=month)
+        .values("receiving_account_id", "month")
+        .annotate(
+            total=Sum("amount"),
+            count=Count(
+                "transaction_id",
+                filter=Q(sending_account_id__isnull=True)
+                | ~Q(sending_account_id=F("receiving_account_id")),
+            ),
+        )
+    )
+    for row in received:
+        rollup = rollups.setdefault((row["receiving_account_id"], row["month"]), [Decimal("0.00"), Decimal("0.00"), 0])
+        rollup[1] += row["total"]
+        rollup[2] += row["count"]
+
+    MonthlyAccountRollup.objects.bulk_create(
+        [
+            MonthlyAccountRollup(
+                account_id=account_id,
+                month=month,
+                total_sent=total_sent,
+                total_received=total_received,
+                transaction_count=count,
+            )
+            for (account_id, month), (total_sent, total_received, count) in rollups.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("transactions", "0003_transaction_account_date_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MonthlyAccountRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "account_id",
+                    models.UUIDField(help_text="UUID of the rolled up account"),
+                ),
+                (
+                    "month",
+                    models.DateField(help_text="First day of the local calendar month"),
+                ),
+                (
+                    "total_sent",
+                    models.DecimalField(decimal_places=2, default=0.0, max_digits=14),
+                ),
+                (
+                    "total_received",
+                    models.DecimalField(decimal_places=2, default=0.0, max_digits=14),
+                ),
+                ("transaction_count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "db_table": "transaction_monthly_rollup",
+                "unique_together": {("account_id", "month")},
+            },
+        ),
+        migrations.RunPython(backfill_monthly_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("transactions", "0004_monthlyaccountrollup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="transaction",
+            name="idempotency_key",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                help_text="Client supplied key that makes retries of the same transaction safe",
+                max_length=64,
+                null=True,
+                unique=True,
+            ),
+        ),
+    ]
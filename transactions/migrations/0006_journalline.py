@@ -0,0 +1,91 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_journal_lines(apps, schema_editor):
+    # Book the transactions that were posted before the journal existed, one page of transactions at a time
+    Transaction = apps.get_model("transactions", "Transaction")
+    JournalLine = apps.get_model("transactions", "JournalLine")
+
+    last_transaction_id = None
+    while True:
+        page = Transaction.objects.order_by("transaction_id")
+        if last_transaction_id is not None:
+            page = page.filter(transaction_id__gt=last_transaction_id)
+        rows = list(
+            page.values_list(
+                "transaction_id",
+                "date",
+                "amount",
+                "sending_account_id",
+                "receiving_account_id",
+            )[:1000]
+        )
+        if not rows:
+            break
+
+        lines = []
+        for transaction_id, date, amount, sending_account_id, receiving_account_id in rows:
+            if sending_account_id:
+                lines.append(JournalLine(transaction_id=transaction_id, account_id=sending_account_id, date=date, amount=-amount))
+            if receiving_account_id:
+                lines.append(JournalLine(transaction_id=transaction_id, account_id=receiving_account_id, date=date, amount=amount))
+        JournalLine.objects.bulk_create(lines)
+        last_transaction_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("transactions", "0005_transaction_idempotency_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="JournalLine",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "account_id",
+                    models.UUIDField(help_text="UUID of the booked account"),
+                ),
+                ("date", models.DateTimeField(help_text="Date of the transaction")),
+                (
+                    "amount",
+                    models.DecimalField(
+                        decimal_places=2,
+                        help_text="Signed amount, negative on the sending side",
+                        max_digits=12,
+                    ),
+                ),
+                (
+                    "transaction",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="journal_lines",
+                        to="transactions.transaction",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "transaction_journal_line",
+                "indexes": [
+                    models.Index(
+                        fields=["account_id", "date", "transaction"],
+                        name="journal_account_date_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_journal_lines, migrations.RunPython.noop),
+    ]
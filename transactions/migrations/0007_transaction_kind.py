@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:20
+
+from django.db import migrations, models
+
+
+def backfill_kind(apps, schema_editor):
+    # Existing rows default to transfers, trades and ATM withdrawals are told apart by their child rows
+    Transaction = apps.get_model("transactions", "Transaction")
+    StockTransaction = apps.get_model("transactions", "StockTransaction")
+    ATMTransaction = apps.get_model("transactions", "ATMTransaction")
+
+    Transaction.objects.filter(transaction_id__in=StockTransaction.objects.values("transaction_ptr_id")).update(kind="stock")
+    Transaction.objects.filter(transaction_id__in=ATMTransaction.objects.values("transaction_ptr_id")).update(kind="atm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("transactions", "0006_journalline"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="transaction",
+            name="kind",
+            field=models.CharField(
+                choices=[("transfer", "Transfer"), ("stock", "Stock"), ("atm", "ATM")],
+                default="transfer",
+                editable=False,
+                max_length=8,
+            ),
+        ),
+        migrations.RunPython(backfill_kind, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,143 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:23
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+def compress_archive_tables(apps, schema_editor):
+    # The archive is append-only and rarely read, so on MariaDB its pages are stored compressed
+    if schema_editor.connection.vendor != "mysql":
+        return
+    for table in ("transaction_archive", "transaction_archive_journal_line"):
+        schema_editor.execute(f"ALTER TABLE {schema_editor.quote_name(table)} ROW_FORMAT=COMPRESSED")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("transactions", "0007_transaction_kind"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedTransaction",
+            fields=[
+                (
+                    "transaction_id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                        unique=True,
+                    ),
+                ),
+                ("amount", models.DecimalField(decimal_places=2, max_digits=10)),
+                (
+                    "date",
+                    models.DateTimeField(blank=True, default=datetime.datetime.now),
+                ),
+                (
+                    "sending_account_id",
+                    models.UUIDField(
+                        blank=True, help_text="UUID of the sending account", null=True
+                    ),
+                ),
+                (
+                    "receiving_account_id",
+                    models.UUIDField(
+                        blank=True, help_text="UUID of the receiving account", null=True
+                    ),
+                ),
+                (
+                    "idempotency_key",
+                    models.CharField(
+                        blank=True,
+                        editable=False,
+                        help_text="Client supplied key that makes retries of the same transaction safe",
+                        max_length=64,
+                        null=True,
+                        unique=True,
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("transfer", "Transfer"),
+                            ("stock", "Stock"),
+                            ("atm", "ATM"),
+                        ],
+                        default="transfer",
+                        editable=False,
+                        max_length=8,
+                    ),
+                ),
+                (
+                    "stockId",
+                    models.UUIDField(blank=True, help_text="Stock Id", null=True),
+                ),
+                ("quantity", models.IntegerField(blank=True, null=True)),
+                (
+                    "transaction_type",
+                    models.CharField(
+                        blank=True,
+                        choices=[("buy", "Buy"), ("sell", "Sell")],
+                        max_length=4,
+                        null=True,
+                    ),
+                ),
+                ("atmId", models.UUIDField(blank=True, null=True)),
+            ],
+            options={
+                "db_table": "transaction_archive",
+            },
+        ),
+        migrations.CreateModel(
+            name="ArchivedJournalLine",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "account_id",
+                    models.UUIDField(help_text="UUID of the booked account"),
+                ),
+                ("date", models.DateTimeField(help_text="Date of the transaction")),
+                (
+                    "amount",
+                    models.DecimalField(
+                        decimal_places=2,
+                        help_text="Signed amount, negative on the sending side",
+                        max_digits=12,
+                    ),
+                ),
+                (
+                    "transaction",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="journal_lines",
+                        to="transactions.archivedtransaction",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "transaction_archive_journal_line",
+                "indexes": [
+                    models.Index(
+                        fields=["account_id", "date", "transaction"],
+                        name="archive_account_date_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(compress_archive_tables, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 import uuid
 from django.db import models
 from core.models import Transaction
+from transactions.managers import TransactionManager
 from transactions.settings import STOCK_MODEL
 
 
@@ -15,6 +16,22 @@ class TransactionBase(Transaction):
         blank=True,
         help_text="UUID of the receiving account"
     )
+    # the unique index turns the duplicate check of a retried request into a single index probe
+    idempotency_key = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        unique=True,
+        editable=False,
+        help_text="Client supplied key that makes retries of the same transaction safe"
+    )
+    # tells a transfer from a trade or an ATM withdrawal without joining the child tables
+    kind = models.CharField(
+        max_length=8,
+        default='transfer',
+        editable=False,
+        choices=[('transfer', 'Transfer'), ('stock', 'Stock'), ('atm', 'ATM')]
+    )
 
     class Meta:
         abstract = True
@@ -25,11 +42,22 @@ class TransactionBase(Transaction):
 
 
 class Transaction(TransactionBase):
+    KIND = 'transfer'
+
+    objects = TransactionManager()
+
     class Meta:
         db_table = "transaction"
+        # every history, balance and totals query filters on one side of the transfer and orders by date
+        indexes = [
+            models.Index(fields=["sending_account_id", "date"], name="transaction_sending_date_idx"),
+            models.Index(fields=["receiving_account_id", "date"], name="transaction_receiving_date_idx"),
+        ]
 
 
 class StockTransaction(Transaction):
+    KIND = 'stock'
+
     stockId = models.UUIDField(
         null=True,
         blank=True,
@@ -44,8 +72,14 @@ class StockTransaction(Transaction):
     class Meta:
         db_table = "transaction_stock"
 
+    def save(self, *args, **kwargs):
+        self.kind = self.KIND  # Enforce the kind value
+        super().save(*args, **kwargs)
+
 
 class ATMTransaction(Transaction):
+    KIND = 'atm'
+
     atmId = models.UUIDField(
         default=uuid.uuid4,
         editable=False,
@@ -54,3 +88,90 @@ class ATMTransaction(Transaction):
 
     class Meta:
         db_table = "transaction_atm"
+
+    def save(self, *args, **kwargs):
+        self.kind = self.KIND  # Enforce the kind value
+        super().save(*args, **kwargs)
+
+
+class BalanceCheckpoint(models.Model):
+    account_id = models.UUIDField(help_text="UUID of the checkpointed account")
+    checkpoint_date = models.DateTimeField(help_text="The checkpoint covers all transactions before this point in time")
+    balance = models.DecimalField(max_digits=14, decimal_places=2, help_text="Net ledger amount up to the checkpoint date")
+    transaction_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = "transaction_balance_checkpoint"
+        unique_together = ('account_id', 'checkpoint_date')
+
+    def __str__(self):
+        return f"Checkpoint of account {self.account_id} at {self.checkpoint_date}: {self.balance}"
+
+
+class JournalLine(models.Model):
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name="journal_lines")
+    account_id = models.UUIDField(help_text="UUID of the booked account")
+    date = models.DateTimeField(help_text="Date of the transaction")
+    amount = models.DecimalField(max_digits=12, decimal_places=2, help_text="Signed amount, negative on the sending side")
+
+    class Meta:
+        db_table = "transaction_journal_line"
+        # account histories, balances and totals are one ordered range scan per account
+        indexes = [
+            models.Index(fields=["account_id", "date", "transaction"], name="journal_account_date_idx"),
+        ]
+
+    def __str__(self):
+        return f"Journal line of transaction {self.transaction_id} on account {self.account_id}: {self.amount}"
+
+
+class MonthlyAccountRollup(models.Model):
+    account_id = models.UUIDField(help_text="UUID of the rolled up account")
+    month = models.DateField(help_text="First day of the local calendar month")
+    total_sent = models.DecimalField(max_digits=14, decimal_places=2, default=0.00)
+    total_received = models.DecimalField(max_digits=14, decimal_places=2, default=0.00)
+    transaction_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = "transaction_monthly_rollup"
+        unique_together = ('account_id', 'month')
+
+    def __str__(self):
+        return f"Rollup of account {self.account_id} for {self.month:%Y-%m}"
+
+
+class ArchivedTransaction(TransactionBase):
+    # Cold copy of a transaction older than the archive age, the stock and ATM columns are folded into the one table
+    stockId = models.UUIDField(
+        null=True,
+        blank=True,
+        help_text="Stock Id"
+    )
+    quantity = models.IntegerField(null=True, blank=True)
+    transaction_type = models.CharField(
+        max_length=4,
+        null=True,
+        blank=True,
+        choices=[('buy', 'Buy'), ('sell', 'Sell')]
+    )
+    atmId = models.UUIDField(null=True, blank=True)
+
+    class Meta:
+        db_table = "transaction_archive"
+
+
+class ArchivedJournalLine(models.Model):
+    transaction = models.ForeignKey(ArchivedTransaction, on_delete=models.CASCADE, related_name="journal_lines")
+    account_id = models.UUIDField(help_text="UUID of the booked account")
+    date = models.DateTimeField(help_text="Date of the transaction")
+    amount = models.DecimalField(max_digits=12, decimal_places=2, help_text="Signed amount, negative on the sending side")
+
+    class Meta:
+        db_table = "transaction_archive_journal_line"
+        # the per-account index into the archive, reads of one account never scan other accounts' history
+        indexes = [
+            models.Index(fields=["account_id", "date", "transaction"], name="archive_account_date_idx"),
+        ]
+
+    def __str__(self):
+        return f"Archived journal line of transaction {self.transaction_id} on account {self.account_id}: {self.amount}"
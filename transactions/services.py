@@ -1,34 +1,179 @@
-from datetime import datetime, timedelta
-from typing import List
+import base64
+import heapq
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
 from uuid import UUID
 
-from django.db import transaction
+import numpy as np
+from django.apps import apps
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, DateField, F, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDay, TruncHour, TruncMonth
+from django.utils.timezone import is_naive, localtime, make_aware, now
 from marshmallow import ValidationError
 
+from core.money import Money, to_cents
 from core.services import ITransactionService
-from transactions.models import Transaction, StockTransaction, ATMTransaction
+from core.timeframes import DateRange, month_of, month_start, next_month, resolve_timeframe
+from transactions.models import Transaction, StockTransaction, ATMTransaction, ArchivedJournalLine, ArchivedTransaction, BalanceCheckpoint, JournalLine, MonthlyAccountRollup
+from transactions.settings import ACCOUNT_MODEL, ARCHIVE_AFTER_DAYS
+
+# Default and maximum number of transactions on one page of the transaction history
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 500
+
+# Number of rows fetched from the database at once when streaming a transaction history
+HISTORY_CHUNK_SIZE = 2000
+
+# Number of rows per INSERT statement when posting transfers in bulk
+BULK_INSERT_BATCH_SIZE = 1000
+
+# Default cap on the points of a balance series, about a year of days
+BALANCE_SERIES_MAX_POINTS = 366
+
+
+class LedgerRow(NamedTuple):
+    transaction_id: UUID
+    date: datetime
+    sending_account_id: Optional[UUID]
+    receiving_account_id: Optional[UUID]
+    amount: Decimal
+    kind: str
 
 
 class TransactionService(ITransactionService):
 
-    def create_new_transaction(self, amount: float, sending_account_id: UUID, receiving_account_id: UUID) -> bool:
+    def _post_ledger_entries(self, record: Transaction) -> None:
+        # Book a new transaction into the journal, the account balances and the monthly rollups,
+        # must run inside the posting transaction
+        JournalLine.objects.bulk_create(self._journal_lines(record.transaction_id, record.date, record.amount, record.sending_account_id, record.receiving_account_id))
+        self._apply_balance_changes(record.amount, record.sending_account_id, record.receiving_account_id)
+        self._apply_rollup_changes(record.amount, record.sending_account_id, record.receiving_account_id, record.date)
+
+    def _journal_lines(self, transaction_id: UUID, posted_at: datetime, amount, sending_account_id: Optional[UUID], receiving_account_id: Optional[UUID]) -> List[JournalLine]:
+        # One signed line per booked side, a self transfer gets a debit and a credit line on the same account
+        amount = Decimal(str(amount))
+        lines = []
+        if sending_account_id:
+            lines.append(JournalLine(transaction_id=transaction_id, account_id=sending_account_id, date=posted_at, amount=-amount))
+        if receiving_account_id:
+            lines.append(JournalLine(transaction_id=transaction_id, account_id=receiving_account_id, date=posted_at, amount=amount))
+        return lines
+
+    def _apply_balance_changes(self, amount, sending_account_id: Optional[UUID], receiving_account_id: Optional[UUID]) -> None:
+        # Keep the materialized account balances in step with the ledger, must run inside the posting transaction
+        account_model = apps.get_model(ACCOUNT_MODEL)
+        amount = Decimal(str(amount))
+        if sending_account_id:
+            account_model.objects.filter(account_id=sending_account_id).update(ledger_balance=F("ledger_balance") - amount)
+        if receiving_account_id:
+            account_model.objects.filter(account_id=receiving_account_id).update(ledger_balance=F("ledger_balance") + amount)
+
+    def _apply_rollup_changes(self, amount, sending_account_id: Optional[UUID], receiving_account_id: Optional[UUID], posted_at: datetime) -> None:
+        # Add a posting to the monthly rollups of both accounts, must run inside the posting transaction
+        month = month_of(posted_at)
+        amount = Decimal(str(amount))
+        if sending_account_id:
+            self._add_to_rollup(sending_account_id, month, total_sent=amount, transaction_count=1)
+        if receiving_account_id:
+            # a self transfer is counted once
+            self._add_to_rollup(receiving_account_id, month, total_received=amount, transaction_count=0 if receiving_account_id == sending_account_id else 1)
+
+    def _add_to_rollup(self, account_id: UUID, month: date, total_sent: Decimal = Decimal("0.00"), total_received: Decimal = Decimal("0.00"), transaction_count: int = 0) -> None:
+        changes = {
+            "total_sent": F("total_sent") + total_sent,
+            "total_received": F("total_received") + total_received,
+            "transaction_count": F("transaction_count") + transaction_count,
+        }
+        rollups = MonthlyAccountRollup.objects.filter(account_id=account_id, month=month)
+        if not rollups.update(**changes):
+            # first posting of the month, get_or_create tolerates a concurrent insert of the same row
+            MonthlyAccountRollup.objects.get_or_create(account_id=account_id, month=month)
+            rollups.update(**changes)
+
+    def is_replay(self, idempotency_key: Optional[str], amount: float, sending_account_id: Optional[UUID], receiving_account_id: Optional[UUID] = None, kind: str = Transaction.KIND) -> bool:
+        """
+        Check whether a request is the retry of a transaction that was already posted.
+
+        Callers answer a replay before validating the request, the balances already include the posted transaction.
+
+        :param idempotency_key: Key sent with the request, None never replays.
+        :param amount: Amount of the transaction.
+        :param sending_account_id: UUID of the sending account, the account of an ATM withdrawal.
+        :param receiving_account_id: UUID of the receiving account, None for an ATM withdrawal.
+        :param kind: 'transfer', 'stock' or 'atm'.
+        :return: True if a transaction with this key was posted.
+        :raises ValidationError: If the key was used for a different transaction.
+        """
+        return self._is_replay(idempotency_key, kind, amount, sending_account_id, receiving_account_id)
+
+    def _is_replay(self, idempotency_key: Optional[str], kind: str, amount, sending_account_id: Optional[UUID], receiving_account_id: Optional[UUID], locking: bool = False) -> bool:
+        # Look the key up with a single probe of its unique index, a retry of a recent transaction costs one query.
+        # The key is unique only within each store, a miss in the hot table is probed in the archive too, so that a
+        # late retry of an archived transaction is not posted a second time.
+        # After a duplicate key error the probe is a locking read: under REPEATABLE READ (the MariaDB/MySQL default)
+        # a plain read inside the caller's transaction is served from the snapshot of its first read and can not see
+        # the concurrent commit, a locking read sees the latest committed row. Other plain reads of the caller's
+        # transaction still see the old snapshot.
+        if not idempotency_key:
+            return False
+        columns = ("kind", "amount", "sending_account_id", "receiving_account_id")
+        posted = Transaction.objects.filter(idempotency_key=idempotency_key)
+        if locking:
+            with transaction.atomic():
+                posted = posted.select_for_update().values_list(*columns).first()
+        else:
+            posted = posted.values_list(*columns).first()
+        if posted is None:
+            posted = ArchivedTransaction.objects.filter(idempotency_key=idempotency_key).values_list(*columns).first()
+        if posted is None:
+            return False
+
+        def as_key(value):
+            return str(value) if value else None
+
+        posted_kind, posted_amount, posted_sending_account_id, posted_receiving_account_id = posted
+        if (
+            posted_kind != kind
+            or posted_amount != Decimal(str(amount)).quantize(Decimal("0.01"))
+            or as_key(posted_sending_account_id) != as_key(sending_account_id)
+            or as_key(posted_receiving_account_id) != as_key(receiving_account_id)
+        ):
+            raise ValidationError("Idempotency key was already used for a different transaction.")
+        return True
+
+    def create_new_transaction(self, amount: float, sending_account_id: UUID, receiving_account_id: UUID, idempotency_key: Optional[str] = None) -> bool:
         # Wrap the operation in a transaction for safety
         try:
+            if self._is_replay(idempotency_key, Transaction.KIND, amount, sending_account_id, receiving_account_id):
+                return True
             with transaction.atomic():
                 # Create the transaction record
                 transaction_record = Transaction.objects.create(
                     sending_account_id=sending_account_id,
                     receiving_account_id=receiving_account_id,
                     amount=amount,
-                    date=datetime.now()
+                    date=datetime.now(),
+                    idempotency_key=idempotency_key
                 )
+                self._post_ledger_entries(transaction_record)
             return True
+        except IntegrityError as e:
+            # a concurrent retry with the same key was committed first
+            if self._is_replay(idempotency_key, Transaction.KIND, amount, sending_account_id, receiving_account_id, locking=True):
+                return True
+            raise ValidationError(f"Transaction failed: {str(e)}")
         except Exception as e:
             raise ValidationError(f"Transaction failed: {str(e)}")
 
-    def create_new_stock_transaction(self, amount: float, sending_account_id: UUID, receiving_account_id: UUID, stock_id: UUID, quantity: int, transaction_type: str) -> bool:
+    def create_new_stock_transaction(self, amount: float, sending_account_id: UUID, receiving_account_id: UUID, stock_id: UUID, quantity: int, transaction_type: str, idempotency_key: Optional[str] = None) -> bool:
         # Wrap the operation in a transaction for safety
         try:
+            if self._is_replay(idempotency_key, StockTransaction.KIND, amount, sending_account_id, receiving_account_id):
+                return True
             with transaction.atomic():
                 # Create the transaction record
                 stock_transaction_record = StockTransaction.objects.create(
@@ -38,15 +183,24 @@ class TransactionService(ITransactionService):
                     date=datetime.now(),
                     stockId=stock_id,
                     quantity=quantity,
-                    transaction_type=transaction_type
+                    transaction_type=transaction_type,
+                    idempotency_key=idempotency_key
                 )
+                self._post_ledger_entries(stock_transaction_record)
             return True
+        except IntegrityError as e:
+            # a concurrent retry with the same key was committed first
+            if self._is_replay(idempotency_key, StockTransaction.KIND, amount, sending_account_id, receiving_account_id, locking=True):
+                return True
+            raise ValidationError(f"Transaction failed: {str(e)}")
         except Exception as e:
             raise ValidationError(f"Transaction failed: {str(e)}")
 
-    def create_new_atm_transaction(self, amount: float, account_id: UUID, atm_id: UUID) -> bool:
+    def create_new_atm_transaction(self, amount: float, account_id: UUID, atm_id: UUID, idempotency_key: Optional[str] = None) -> bool:
         # Wrap the operation in a transaction for safety
         try:
+            if self._is_replay(idempotency_key, ATMTransaction.KIND, amount, account_id, None):
+                return True
             with transaction.atomic():
                 # Create the transaction record
                 atm_transaction_record = ATMTransaction.objects.create(
@@ -54,89 +208,525 @@ class TransactionService(ITransactionService):
                     receiving_account_id=None,
                     amount=amount,
                     date=datetime.now(),
-                    atmId=atm_id
+                    atmId=atm_id,
+                    idempotency_key=idempotency_key
                 )
+                self._post_ledger_entries(atm_transaction_record)
             return True
+        except IntegrityError as e:
+            # a concurrent retry with the same key was committed first
+            if self._is_replay(idempotency_key, ATMTransaction.KIND, amount, account_id, None, locking=True):
+                return True
+            raise ValidationError(f"Atm transaction failed: {str(e)}")
         except Exception as e:
             raise ValidationError(f"Atm transaction failed: {str(e)}")
 
+    def bulk_create_transactions(self, transfers: List[dict]) -> int:
+        """
+        Post many already validated transfers in one database transaction.
 
+        The rows are written with bulk inserts and the balances and monthly rollups receive one
+        aggregated update per account instead of one per transfer.
 
-    def get_transaction_history(self, account_id: UUID, timeframe: str) -> List[dict]:
+        :param transfers: Dictionaries with the 'amount', 'sending_account_id' and 'receiving_account_id' of each transfer.
+        :return: The number of transactions created.
         """
-        Fetch transactions based on account_id and timeframe.
+        posted_at = datetime.now()
+        records = []
+        balance_changes = defaultdict(Decimal)
+        rollup_changes = defaultdict(lambda: [Decimal("0.00"), Decimal("0.00"), 0])
 
-        :param account_id: UUID of the account whose transactions are to be fetched.
-        :param timeframe: Filter transactions by timeframe ('30_days', '60_days', or 'all_time').
-        :return: A list of dictionaries containing transaction details.
+        for transfer in transfers:
+            amount = Decimal(str(transfer["amount"]))
+            sending_account_id = transfer["sending_account_id"]
+            receiving_account_id = transfer["receiving_account_id"]
+            records.append(Transaction(
+                sending_account_id=sending_account_id,
+                receiving_account_id=receiving_account_id,
+                amount=amount,
+                date=posted_at,
+            ))
+
+            if sending_account_id:
+                balance_changes[sending_account_id] -= amount
+                rollup_changes[sending_account_id][0] += amount
+                rollup_changes[sending_account_id][2] += 1
+            if receiving_account_id:
+                balance_changes[receiving_account_id] += amount
+                rollup_changes[receiving_account_id][1] += amount
+                # a self transfer is counted once
+                if receiving_account_id != sending_account_id:
+                    rollup_changes[receiving_account_id][2] += 1
+
+        try:
+            with transaction.atomic():
+                Transaction.objects.bulk_create(records, batch_size=BULK_INSERT_BATCH_SIZE)
+                JournalLine.objects.bulk_create(
+                    [line for record in records for line in self._journal_lines(record.transaction_id, record.date, record.amount, record.sending_account_id, record.receiving_account_id)],
+                    batch_size=BULK_INSERT_BATCH_SIZE,
+                )
+
+                account_model = apps.get_model(ACCOUNT_MODEL)
+                for account_id, change in balance_changes.items():
+                    if change:
+                        account_model.objects.filter(account_id=account_id).update(ledger_balance=F("ledger_balance") + change)
+
+                # Make sure every rollup row of the month exists, then add to all of them
+                month = month_of(posted_at)
+                MonthlyAccountRollup.objects.bulk_create(
+                    [MonthlyAccountRollup(account_id=account_id, month=month) for account_id in rollup_changes],
+                    ignore_conflicts=True,
+                )
+                for account_id, (total_sent, total_received, transaction_count) in rollup_changes.items():
+                    MonthlyAccountRollup.objects.filter(account_id=account_id, month=month).update(
+                        total_sent=F("total_sent") + total_sent,
+                        total_received=F("total_received") + total_received,
+                        transaction_count=F("transaction_count") + transaction_count,
+                    )
+        except Exception as e:
+            raise ValidationError(f"Transaction failed: {str(e)}")
+
+        return len(records)
+
+    def aggregate_account_amounts(self, account_id: UUID, timeframe: Union[str, DateRange]) -> Dict[str, Decimal]:
         """
+        Sum the amounts sent and received by an account within a timeframe.
+
+        Calendar months that lie completely inside the timeframe are read from the monthly rollups,
+        only the partial months at its edges are summed from the transactions themselves.
+
+        :param account_id: UUID of the account whose transactions are aggregated.
+        :param timeframe: A timeframe option such as '30_days', 'ytd' or 'YYYY-MM', or a DateRange.
+        :return: A dictionary with the exact 'total_sent', 'total_received' and 'net' amounts.
+        """
+        date_range = resolve_timeframe(timeframe)
+
+        # First month starting inside the range and first month reaching past its end
+        first_month = month_of(date_range.start) if date_range.start else None
+        if first_month and month_start(first_month) != date_range.start:
+            first_month = next_month(first_month)
+        end_month = month_of(date_range.end) if date_range.end else None
 
-        # Determine the start date based on the timeframe
-        if timeframe == "30_days":
-            start_date = datetime.now() - timedelta(days=30)
-        elif timeframe == "60_days":
-            start_date = datetime.now() - timedelta(days=60)
-        elif timeframe == "all_time":
-            start_date = None
+        if first_month and end_month and first_month >= end_month:
+            # the range does not cover a whole month
+            total_sent, total_received = self._sum_journal_amounts(account_id, Q(**date_range.filter_kwargs()), date_range.start)
         else:
-            raise ValueError("Invalid timeframe. Valid options are '30_days', '60_days', or 'all_time'.")
+            rollups = MonthlyAccountRollup.objects.filter(account_id=account_id)
+            if first_month:
+                rollups = rollups.filter(month__gte=first_month)
+            if end_month:
+                rollups = rollups.filter(month__lt=end_month)
+            totals = rollups.aggregate(
+                total_sent=Coalesce(Sum("total_sent"), Value(Decimal("0.00"))),
+                total_received=Coalesce(Sum("total_received"), Value(Decimal("0.00"))),
+            )
+            total_sent, total_received = totals["total_sent"], totals["total_received"]
+
+            edges = Q()
+            if first_month and month_start(first_month) != date_range.start:
+                edges |= Q(**DateRange(date_range.start, month_start(first_month)).filter_kwargs())
+            if end_month and month_start(end_month) != date_range.end:
+                edges |= Q(**DateRange(month_start(end_month), date_range.end).filter_kwargs())
+            if edges:
+                edge_sent, edge_received = self._sum_journal_amounts(account_id, edges, date_range.start)
+                total_sent += edge_sent
+                total_received += edge_received
+
+        total_sent = Decimal(total_sent).quantize(Decimal("0.01"))
+        total_received = Decimal(total_received).quantize(Decimal("0.01"))
+
+        return {"total_sent": total_sent, "total_received": total_received, "net": total_received - total_sent}
+
+    def rebuild_monthly_rollups(self) -> int:
+        """
+        Recompute all monthly rollups from the journal, e.g. after transactions were
+        imported without going through the service.
 
-        # Query transactions sent or received by the account within the specified timeframe
-        if start_date:
-            sent_transactions = Transaction.objects.filter(
-                sending_account_id=account_id, date__gte=start_date
+        :return: The number of rollup rows written.
+        """
+        zero = Value(Decimal("0.00"))
+        totals = defaultdict(lambda: [Decimal("0.00"), Decimal("0.00"), 0])
+        # hot and archived transactions are disjoint, so their totals simply add up
+        for model in self._journal_models(None):
+            rows = (
+                model.objects.annotate(month=TruncMonth("date", output_field=DateField()))
+                .values_list("account_id", "month")
+                .annotate(
+                    total_sent=Coalesce(Sum("amount", filter=Q(amount__lt=0)), zero),
+                    total_received=Coalesce(Sum("amount", filter=Q(amount__gt=0)), zero),
+                    # a self transfer has two lines but is counted once
+                    transaction_count=Count("transaction", distinct=True),
+                )
             )
-            received_transactions = Transaction.objects.filter(
-                receiving_account_id=account_id, date__gte=start_date
+            for account_id, month, total_sent, total_received, transaction_count in rows:
+                total = totals[(account_id, month)]
+                total[0] -= total_sent
+                total[1] += total_received
+                total[2] += transaction_count
+
+        rollups = [
+            MonthlyAccountRollup(account_id=account_id, month=month, total_sent=total_sent, total_received=total_received, transaction_count=transaction_count)
+            for (account_id, month), (total_sent, total_received, transaction_count) in totals.items()
+        ]
+
+        with transaction.atomic():
+            MonthlyAccountRollup.objects.all().delete()
+            MonthlyAccountRollup.objects.bulk_create(rollups, batch_size=BULK_INSERT_BATCH_SIZE)
+
+        return len(rollups)
+
+    def rebuild_journal_lines(self) -> int:
+        """
+        Recompute the journal from the transaction table, e.g. after transactions were
+        imported without going through the service. The journal of archived transactions
+        is written once when they are archived and is left untouched.
+
+        :return: The number of journal lines written.
+        """
+        written = 0
+        with transaction.atomic():
+            JournalLine.objects.all().delete()
+
+            # Transactions are read in pages of their primary key, so the journal is never held in memory as a whole
+            last_transaction_id = None
+            while True:
+                page = Transaction.objects.order_by("transaction_id")
+                if last_transaction_id is not None:
+                    page = page.filter(transaction_id__gt=last_transaction_id)
+                rows = list(page.values_list("transaction_id", "date", "amount", "sending_account_id", "receiving_account_id")[:BULK_INSERT_BATCH_SIZE])
+                if not rows:
+                    break
+
+                lines = [line for row in rows for line in self._journal_lines(*row)]
+                JournalLine.objects.bulk_create(lines, batch_size=BULK_INSERT_BATCH_SIZE)
+                written += len(lines)
+                last_transaction_id = rows[-1][0]
+
+        return written
+
+    def archive_transactions(self, before: Optional[datetime] = None, batch_size: int = BULK_INSERT_BATCH_SIZE) -> int:
+        """
+        Move transactions older than the archive age, with their journal lines, from the hot tables to the archive tables.
+
+        Every batch is copied and deleted in its own database transaction, so an interrupted run can simply be repeated.
+
+        :param before: Archive transactions before this point in time, defaults to ARCHIVE_AFTER_DAYS days ago.
+        :param batch_size: Number of transactions moved per batch.
+        :return: The number of archived transactions.
+        :raises ValueError: If the point in time is younger than the archive age.
+        """
+        horizon = self._archive_horizon()
+        if before is None:
+            before = horizon
+        elif self._as_aware(before) > horizon:
+            raise ValueError(f"Only transactions older than {ARCHIVE_AFTER_DAYS} days can be archived.")
+
+        archived = 0
+        last_transaction_id = None
+        while True:
+            with transaction.atomic():
+                # Transactions are read in pages of their primary key, so every row is visited once
+                page = Transaction.objects.filter(date__lt=before).order_by("transaction_id")
+                if last_transaction_id is not None:
+                    page = page.filter(transaction_id__gt=last_transaction_id)
+                rows = Transaction.objects.load_polymorphic(page[:batch_size])
+                if not rows:
+                    break
+
+                transaction_ids = [row.transaction_id for row in rows]
+                ArchivedTransaction.objects.bulk_create([self._archived_transaction(row) for row in rows], batch_size=batch_size)
+                ArchivedJournalLine.objects.bulk_create([
+                    ArchivedJournalLine(transaction_id=transaction_id, account_id=account_id, date=posted_at, amount=amount)
+                    for transaction_id, account_id, posted_at, amount in JournalLine.objects.filter(transaction_id__in=transaction_ids).values_list("transaction_id", "account_id", "date", "amount")
+                ], batch_size=batch_size)
+                # deleting the base rows takes their stock, ATM and journal rows with them
+                Transaction.objects.filter(transaction_id__in=transaction_ids).delete()
+
+            archived += len(rows)
+            last_transaction_id = transaction_ids[-1]
+
+        return archived
+
+    def get_ledger_balance(self, account_id: UUID) -> Decimal:
+        """
+        Compute the net ledger amount of an account from its latest balance checkpoint and the journal lines after it.
+
+        :param account_id: UUID of the account.
+        :return: The exact net amount (received minus sent) of all transactions of the account.
+        """
+        checkpoint = BalanceCheckpoint.objects.filter(account_id=account_id).order_by("-checkpoint_date").first()
+
+        balance = Decimal("0.00")
+        since = None
+        if checkpoint:
+            balance = checkpoint.balance
+            since = checkpoint.checkpoint_date
+
+        # the archive is only read when the replayed history reaches back into it
+        for model in self._journal_models(since):
+            query = model.objects.filter(account_id=account_id)
+            if since is not None:
+                query = query.filter(date__gte=since)
+            delta = query.aggregate(delta=Coalesce(Sum("amount"), Value(Decimal("0.00"))))["delta"]
+            balance += Decimal(delta).quantize(Decimal("0.01"))
+
+        return balance
+
+    def get_ledger_balance_at(self, account_id: UUID, at: datetime) -> Decimal:
+        """
+        Compute the net ledger amount of an account at a point in time.
+
+        The replay starts from the latest balance checkpoint in the month of the point in time, or else from the
+        monthly rollups of the months before it, so at most one month of journal lines is scanned.
+
+        :param account_id: UUID of the account.
+        :param at: The point in time, transactions at or after it are not included.
+        :return: The exact net amount (received minus sent) of the transactions before the point in time.
+        """
+        at = self._as_aware(at)
+        month = month_of(at)
+        since = month_start(month)
+
+        checkpoint = (
+            BalanceCheckpoint.objects.filter(account_id=account_id, checkpoint_date__gte=since, checkpoint_date__lte=at)
+            .order_by("-checkpoint_date")
+            .first()
+        )
+        if checkpoint:
+            balance = checkpoint.balance
+            since = checkpoint.checkpoint_date
+        else:
+            zero = Value(Decimal("0.00"))
+            totals = MonthlyAccountRollup.objects.filter(account_id=account_id, month__lt=month).aggregate(
+                total_sent=Coalesce(Sum("total_sent"), zero),
+                total_received=Coalesce(Sum("total_received"), zero),
             )
+            balance = Decimal(totals["total_received"] - totals["total_sent"]).quantize(Decimal("0.01"))
+
+        for model in self._journal_models(since):
+            delta = model.objects.filter(account_id=account_id, date__gte=since, date__lt=at).aggregate(
+                delta=Coalesce(Sum("amount"), Value(Decimal("0.00")))
+            )["delta"]
+            balance += Decimal(delta).quantize(Decimal("0.01"))
+
+        return balance
+
+    def get_balance_series(self, account_id: UUID, timeframe: Union[str, DateRange], interval: str = "day", max_points: int = BALANCE_SERIES_MAX_POINTS) -> List[dict]:
+        """
+        Compute the closing ledger balance of an account for every day or hour of a timeframe.
+
+        The balance at the start comes from get_ledger_balance_at. The journal lines of the range are summed per
+        bucket by the database on the (account_id, date) index, so only one row per bucket is read, and the bucket
+        sums are turned into balances with a cumulative sum. Longer series are thinned out to max_points by keeping
+        the closing balance of every n-th bucket, the last bucket is always kept.
+
+        :param account_id: UUID of the account.
+        :param timeframe: A DateRange or a timeframe option, an open start begins at the first transaction of the account.
+        :param interval: 'day' or 'hour'.
+        :param max_points: Maximum number of points returned.
+        :return: A list of dictionaries with the 'date' each bucket starts at and the 'balance' at its end, in time order.
+        :raises ValueError: If the timeframe, the interval or the point count is invalid.
+        """
+        if interval not in ("day", "hour"):
+            raise ValueError("Invalid interval. Valid options are 'day' or 'hour'.")
+        if max_points < 1:
+            raise ValueError("The number of points must be at least 1.")
+
+        date_range = resolve_timeframe(timeframe)
+        start = date_range.start or self._first_journal_date(account_id)
+        end = date_range.end or now()
+        if start is None or self._as_aware(start) >= self._as_aware(end):
+            return []
+        start, end = self._as_aware(start), self._as_aware(end)
+
+        bucket_starts = self._bucket_starts(start, end, interval)
+        opening = to_cents(self.get_ledger_balance_at(account_id, start))
+
+        # Days are truncated in the current time zone, like the local midnights of the buckets
+        trunc = TruncDay("date") if interval == "day" else TruncHour("date", tzinfo=timezone.utc)
+        starts = np.asarray([bucket_start.timestamp() for bucket_start in bucket_starts])
+        bucket_cents = np.zeros(len(bucket_starts), dtype=np.int64)
+        for model in self._journal_models(start):
+            sums = model.objects.filter(account_id=account_id, date__gte=start, date__lt=end).annotate(bucket=trunc).values("bucket").annotate(total=Sum("amount")).order_by()
+            for bucket, total in sums.values_list("bucket", "total"):
+                bucket_cents[np.searchsorted(starts, self._as_aware(bucket).timestamp(), side="right") - 1] += to_cents(total)
+        closing = opening + np.cumsum(bucket_cents)
+
+        keep = np.arange(len(bucket_starts))
+        if len(keep) > max_points:
+            group = -(-len(keep) // max_points)
+            keep = keep[len(keep) - 1::-group][::-1]
+
+        return [{"date": bucket_starts[index], "balance": Money(int(closing[index])).to_decimal()} for index in keep]
+
+    def build_balance_checkpoints(self, cutoff: Optional[datetime] = None, workers: int = 4, min_transactions: int = 1) -> int:
+        """
+        Write a balance checkpoint at the cutoff for every account with new transactions since its last checkpoint.
+
+        The accounts are split into contiguous id ranges which are computed in parallel, the checkpoints
+        are then written in bulk. Running the build again for the same cutoff does not create duplicates.
+
+        :param cutoff: Point in time covered by the new checkpoints, defaults to the start of the current day.
+        :param workers: Number of account ranges computed in parallel.
+        :param min_transactions: Minimum number of new transactions an account needs to get a new checkpoint.
+        :return: The number of checkpoints written.
+        :raises ValueError: If the cutoff is later than the start of the current day.
+        """
+        start_of_today = localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+        if cutoff is None:
+            cutoff = start_of_today
+        elif self._as_aware(cutoff) > start_of_today:
+            # Balances only replay the journal lines from the checkpoint on, a transaction posted later
+            # but dated before the cutoff would be missed
+            raise ValueError("Balance checkpoints can only be built up to the start of the current day.")
+
+        account_ids = sorted(self._get_ledger_account_ids(cutoff))
+        if not account_ids:
+            return 0
+
+        workers = max(1, workers)
+        range_size = -(-len(account_ids) // workers)
+        account_ranges = [account_ids[i:i + range_size] for i in range(0, len(account_ids), range_size)]
+
+        if len(account_ranges) == 1:
+            checkpoints = self._compute_balance_checkpoints(account_ranges[0], cutoff, min_transactions)
         else:
-            sent_transactions = Transaction.objects.filter(sending_account_id=account_id)
-            received_transactions = Transaction.objects.filter(receiving_account_id=account_id)
+            def compute_range(account_range: List[UUID]) -> List[BalanceCheckpoint]:
+                # Every worker thread uses its own database connection which has to be closed afterwards
+                try:
+                    return self._compute_balance_checkpoints(account_range, cutoff, min_transactions)
+                finally:
+                    connection.close()
 
-        # Combine sent and received transactions
-        transactions = sent_transactions.union(received_transactions).order_by('-date')
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                checkpoints = [checkpoint for result in executor.map(compute_range, account_ranges) for checkpoint in result]
 
-        # Format the transaction history as a list of dictionaries
-        transaction_history = [
-            {
-                "transaction_id": str(transaction.transaction_id),
-                "sending_account_id": str(transaction.sending_account_id),
-                "receiving_account_id": str(transaction.receiving_account_id),
-                "amount": str(transaction.amount),
-                "date": transaction.date.strftime("%Y-%m-%d %H:%M:%S"),
-            }
-            for transaction in transactions
+        BalanceCheckpoint.objects.bulk_create(checkpoints, batch_size=1000, ignore_conflicts=True)
+        return len(checkpoints)
+
+    def get_net_amounts(self) -> Dict[UUID, Decimal]:
+        """
+        Compute the net ledger amount (received minus sent) of every account from the journal.
+
+        :return: A dictionary mapping account ids to their net amount.
+        """
+        return {
+            account_id: net_amount
+            for account_id, (net_amount, count) in self._group_net_amounts().items()
+        }
+
+
+
+    def get_transaction_history(self, account_id: UUID, timeframe: Union[str, DateRange]) -> List[dict]:
+        """
+        Fetch transactions based on account_id and timeframe.
+
+        :param account_id: UUID of the account whose transactions are to be fetched.
+        :param timeframe: A timeframe option such as '30_days', 'ytd' or 'YYYY-MM', or a DateRange.
+        :return: A list of dictionaries containing transaction details.
+        """
+        date_range = resolve_timeframe(timeframe)
+
+        # Query the account's journal lines within the specified timeframe, one range scan on the (account, date) index per store
+        histories = [
+            self._distinct_transactions(
+                date_range.apply(model.objects.filter(account_id=account_id)).select_related("transaction").order_by("-date", "-transaction_id")
+            )
+            for model in self._journal_models(date_range.start)
         ]
+        transactions = heapq.merge(*histories, key=lambda t: (t.date, t.transaction_id), reverse=True)
+
+        # Format the transaction history as a list of dictionaries
+        transaction_history = [self._format_transaction(transaction) for transaction in transactions]
 
         return transaction_history
 
-    def get_stock_transaction_history(self, account_id: UUID, timeframe: str) -> List[dict]:
+    def get_transaction_history_page(self, account_id: UUID, timeframe: Union[str, DateRange], cursor: Optional[str] = None, page_size: int = HISTORY_PAGE_SIZE) -> dict:
+        """
+        Fetch one page of an account's transaction history, newest first, using keyset pagination.
+
+        Every page is read with a single bounded range scan on the journal's (account, date) index,
+        so a page deep in the history costs the same as the first one.
+
+        :param account_id: UUID of the account whose transactions are to be fetched.
+        :param timeframe: A timeframe option such as '30_days', 'ytd' or 'YYYY-MM', or a DateRange.
+        :param cursor: Opaque cursor of the page to fetch, as returned by the previous page. None for the first page.
+        :param page_size: Number of transactions per page, at most MAX_HISTORY_PAGE_SIZE.
+        :return: A dictionary with the formatted 'transactions' and the 'next_cursor' (None on the last page).
+        """
+        date_range = resolve_timeframe(timeframe)
+        page_size = max(1, min(page_size, MAX_HISTORY_PAGE_SIZE))
+        keyset = Q()
+        if cursor:
+            cursor_date, cursor_transaction_id = self._decode_cursor(cursor)
+            keyset = Q(date__lt=cursor_date) | Q(date=cursor_date, transaction_id__lt=cursor_transaction_id)
+
+        pages = []
+        for model in self._journal_models(date_range.start):
+            lines = date_range.apply(model.objects.filter(keyset, account_id=account_id))
+            # a self transfer has two lines, so twice the page is enough to fill it
+            lines = lines.select_related("transaction").order_by("-date", "-transaction_id")[:2 * (page_size + 1)]
+            pages.append(self._distinct_transactions(lines))
+
+        transactions = list(heapq.merge(*pages, key=lambda t: (t.date, t.transaction_id), reverse=True))
+
+        next_cursor = None
+        if len(transactions) > page_size:
+            transactions = transactions[:page_size]
+            next_cursor = self._encode_cursor(transactions[-1])
+
+        return {
+            "transactions": [self._format_transaction(transaction) for transaction in transactions],
+            "next_cursor": next_cursor,
+        }
+
+    def iter_transaction_history(self, account_id: UUID, start: Optional[datetime] = None, end: Optional[datetime] = None, chunk_size: int = HISTORY_CHUNK_SIZE) -> Iterator[LedgerRow]:
+        """
+        Stream an account's transactions, oldest first, in constant memory.
+
+        :param account_id: UUID of the account whose transactions are to be streamed.
+        :param start: Only include transactions at or after this point in time.
+        :param end: Only include transactions before this point in time.
+        :param chunk_size: Number of rows fetched from the database at once.
+        :return: An iterator of LedgerRow tuples.
+        """
+        def store_rows(model):
+            lines = model.objects.filter(account_id=account_id)
+            if start:
+                lines = lines.filter(date__gte=start)
+            if end:
+                lines = lines.filter(date__lt=end)
+            rows = lines.order_by("date", "transaction_id").values_list(
+                "transaction_id", "date", "transaction__sending_account_id", "transaction__receiving_account_id", "transaction__amount", "transaction__kind"
+            ).iterator(chunk_size=chunk_size)
+            return (LedgerRow(*row) for row in rows)
+
+        # Every store is read in index order and the streams are merged, so the history never has to be sorted
+        previous_transaction_id = None
+        for row in heapq.merge(*[store_rows(model) for model in self._journal_models(start)], key=lambda r: (r.date, r.transaction_id)):
+            # self transfers have a line on both sides
+            if row.transaction_id != previous_transaction_id:
+                previous_transaction_id = row.transaction_id
+                yield row
+
+    def get_stock_transaction_history(self, account_id: UUID, timeframe: Union[str, DateRange]) -> List[dict]:
         """
         Fetch stock-specific transaction history for a given account.
 
         :param account_id: UUID of the custody account.
-        :param timeframe: Filter transactions by timeframe ('30_days', '60_days', or 'all_time').
+        :param timeframe: A timeframe option such as '30_days', 'ytd' or 'YYYY-MM', or a DateRange.
         :return: A list of dictionaries containing stock transaction details.
         """
-        # Determine the start date based on the timeframe
-        if timeframe == "30_days":
-            start_date = datetime.now() - timedelta(days=30)
-        elif timeframe == "60_days":
-            start_date = datetime.now() - timedelta(days=60)
-        elif timeframe == "all_time":
-            start_date = None
-        else:
-            raise ValueError("Invalid timeframe. Valid options are '30_days', '60_days', or 'all_time'.")
-
-        # Query stock transactions for the given account within the timeframe
-        query = StockTransaction.objects.filter(
-            receiving_account_id=account_id
-        ) | StockTransaction.objects.filter(
-            sending_account_id=account_id
-        )
+        date_range = resolve_timeframe(timeframe)
 
-        if start_date:
-            query = query.filter(date__gte=start_date)
+        # Find the account's trades within the timeframe in the journal, then load their stock rows with one bulk query
+        histories = []
+        for model in self._journal_models(date_range.start):
+            lines = date_range.apply(model.objects.filter(account_id=account_id, transaction__kind=StockTransaction.KIND))
+            trades = self._distinct_transactions(lines.select_related("transaction").order_by("-date", "-transaction_id"))
+            # archived trades already carry their stock columns
+            histories.append(Transaction.objects.load_polymorphic(trades) if model is JournalLine else trades)
+        query = heapq.merge(*histories, key=lambda t: (t.date, t.transaction_id), reverse=True)
 
         # Format the stock transaction history as a list of dictionaries
         stock_transaction_history = [
@@ -152,4 +742,174 @@ class TransactionService(ITransactionService):
             for transaction in query
         ]
 
-        return stock_transaction_history
\ No newline at end of file
+        return stock_transaction_history
+
+    def _sum_journal_amounts(self, account_id: UUID, condition: Q, start: Optional[datetime]) -> Tuple[Decimal, Decimal]:
+        # Sum the sent and received amounts of an account's journal lines with one conditional aggregation per store
+        zero = Value(Decimal("0.00"))
+        total_sent = total_received = Decimal("0.00")
+        for model in self._journal_models(start):
+            totals = model.objects.filter(condition, account_id=account_id).aggregate(
+                total_sent=Coalesce(Sum("amount", filter=Q(amount__lt=0)), zero),
+                total_received=Coalesce(Sum("amount", filter=Q(amount__gt=0)), zero),
+            )
+            total_sent -= Decimal(totals["total_sent"]).quantize(Decimal("0.01"))
+            total_received += Decimal(totals["total_received"]).quantize(Decimal("0.01"))
+
+        return total_sent, total_received
+
+    def _group_net_amounts(self, start: Optional[datetime] = None, end: Optional[datetime] = None, first_account_id: Optional[UUID] = None, last_account_id: Optional[UUID] = None) -> Dict[UUID, Tuple[Decimal, int]]:
+        # Net amount and transaction count per account of the journal lines in [start, end), in one grouped query per store
+        amounts = {}
+        for model in self._journal_models(start):
+            query = model.objects.all()
+            if start is not None:
+                query = query.filter(date__gte=start)
+            if end is not None:
+                query = query.filter(date__lt=end)
+            if first_account_id is not None:
+                query = query.filter(account_id__gte=first_account_id)
+            if last_account_id is not None:
+                query = query.filter(account_id__lte=last_account_id)
+
+            rows = query.values_list("account_id").annotate(total=Sum("amount"), count=Count("transaction", distinct=True))
+            for account_id, total, count in rows:
+                previous_total, previous_count = amounts.get(account_id, (Decimal("0.00"), 0))
+                # SQLite sums the amounts as floats, round them to cents like the stored balances
+                amounts[account_id] = (previous_total + Decimal(total).quantize(Decimal("0.01")), previous_count + count)
+
+        return amounts
+
+    def _get_ledger_account_ids(self, before: datetime) -> set:
+        # All accounts which took part in a transaction before the given point in time
+        account_ids = set()
+        for model in self._journal_models(None):
+            account_ids.update(model.objects.filter(date__lt=before).values_list("account_id", flat=True).distinct())
+        return account_ids
+
+    def _journal_models(self, start: Optional[datetime]) -> list:
+        # Journals a read starting at the given point in time has to cover, the archive only holds rows older than the archive age
+        if start is not None and self._as_aware(start) >= self._archive_horizon():
+            return [JournalLine]
+        return [JournalLine, ArchivedJournalLine]
+
+    def _first_journal_date(self, account_id: UUID) -> Optional[datetime]:
+        # The archive holds the oldest lines, the hot journal is only asked when the archive has none
+        for model in (ArchivedJournalLine, JournalLine):
+            first_date = model.objects.filter(account_id=account_id).order_by("date").values_list("date", flat=True).first()
+            if first_date is not None:
+                return first_date
+        return None
+
+    def _bucket_starts(self, start: datetime, end: datetime, interval: str) -> List[datetime]:
+        # Days begin at local midnight, hours are counted in absolute time so DST changes do not skip or repeat one
+        if interval == "day":
+            day = localtime(start).date()
+            bucket_start = make_aware(datetime.combine(day, time.min))
+        else:
+            bucket_start = start.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+        bucket_starts = []
+        while bucket_start < end:
+            bucket_starts.append(bucket_start)
+            if interval == "day":
+                day += timedelta(days=1)
+                bucket_start = make_aware(datetime.combine(day, time.min))
+            else:
+                bucket_start += timedelta(hours=1)
+        return bucket_starts
+
+    def _archive_horizon(self) -> datetime:
+        return now() - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+    def _as_aware(self, value: datetime) -> datetime:
+        return make_aware(value) if is_naive(value) else value
+
+    def _archived_transaction(self, row: Transaction) -> ArchivedTransaction:
+        return ArchivedTransaction(
+            transaction_id=row.transaction_id,
+            amount=row.amount,
+            date=row.date,
+            sending_account_id=row.sending_account_id,
+            receiving_account_id=row.receiving_account_id,
+            idempotency_key=row.idempotency_key,
+            kind=row.kind,
+            stockId=getattr(row, "stockId", None),
+            quantity=getattr(row, "quantity", None),
+            transaction_type=getattr(row, "transaction_type", None),
+            atmId=getattr(row, "atmId", None),
+        )
+
+    def _compute_balance_checkpoints(self, account_ids: List[UUID], cutoff: datetime, min_transactions: int) -> List[BalanceCheckpoint]:
+        # Checkpoints for one contiguous range of account ids, continuing from each account's latest checkpoint
+        first_account_id, last_account_id = account_ids[0], account_ids[-1]
+
+        latest_dates = dict(
+            BalanceCheckpoint.objects.filter(account_id__gte=first_account_id, account_id__lte=last_account_id)
+            .values("account_id")
+            .annotate(latest=Max("checkpoint_date"))
+            .values_list("account_id", "latest")
+        )
+
+        # Accounts sharing the same previous checkpoint date are replayed with the same grouped queries
+        accounts_by_start = defaultdict(list)
+        for account_id in account_ids:
+            start = latest_dates.get(account_id)
+            if start is None or start < cutoff:
+                accounts_by_start[start].append(account_id)
+
+        checkpoints = []
+        for start, start_account_ids in accounts_by_start.items():
+            previous = {}
+            if start is not None:
+                previous = {
+                    checkpoint.account_id: checkpoint
+                    for checkpoint in BalanceCheckpoint.objects.filter(account_id__in=start_account_ids, checkpoint_date=start)
+                }
+
+            deltas = self._group_net_amounts(start, cutoff, start_account_ids[0], start_account_ids[-1])
+
+            for account_id in start_account_ids:
+                net_amount, count = deltas.get(account_id, (Decimal("0.00"), 0))
+                if count == 0 or count < min_transactions:
+                    continue
+
+                previous_checkpoint = previous.get(account_id)
+                checkpoints.append(BalanceCheckpoint(
+                    account_id=account_id,
+                    checkpoint_date=cutoff,
+                    balance=(previous_checkpoint.balance if previous_checkpoint else Decimal("0.00")) + net_amount,
+                    transaction_count=(previous_checkpoint.transaction_count if previous_checkpoint else 0) + count,
+                ))
+
+        return checkpoints
+
+    def _distinct_transactions(self, lines) -> Iterator[Transaction]:
+        # Journal lines ordered by (date, transaction) yield the two lines of a self transfer next to each other
+        previous_transaction_id = None
+        for line in lines:
+            if line.transaction_id != previous_transaction_id:
+                previous_transaction_id = line.transaction_id
+                yield line.transaction
+
+    def _format_transaction(self, transaction: Transaction) -> dict:
+        return {
+            "transaction_id": str(transaction.transaction_id),
+            "sending_account_id": str(transaction.sending_account_id),
+            "receiving_account_id": str(transaction.receiving_account_id),
+            "amount": str(transaction.amount),
+            "date": transaction.date.strftime("%Y-%m-%d %H:%M:%S"),
+            "kind": transaction.kind,
+        }
+
+    def _encode_cursor(self, transaction: Transaction) -> str:
+        # The cursor is the (date, transaction_id) key of the last transaction on a page
+        key = f"{transaction.date.isoformat()}|{transaction.transaction_id}"
+        return base64.urlsafe_b64encode(key.encode()).decode()
+
+    def _decode_cursor(self, cursor: str) -> Tuple[datetime, UUID]:
+        try:
+            cursor_date, cursor_transaction_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            return datetime.fromisoformat(cursor_date), UUID(cursor_transaction_id)
+        except (ValueError, UnicodeError):
+            raise ValueError("Invalid cursor.")
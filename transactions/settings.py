@@ -1,4 +1,6 @@
 from django.conf import settings
 
 ACCOUNT_MODEL = getattr(settings, 'ACCOUNT_MODEL')
-STOCK_MODEL = getattr(settings, 'STOCK_MODEL')
\ No newline at end of file
+STOCK_MODEL = getattr(settings, 'STOCK_MODEL')
+# Transactions older than this many days may be moved to the archive tables
+ARCHIVE_AFTER_DAYS = getattr(settings, 'TRANSACTION_ARCHIVE_AFTER_DAYS', 365)
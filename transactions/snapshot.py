@@ -0,0 +1,311 @@
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+import numpy as np
+from django.utils.timezone import is_naive, make_aware
+
+from core.money import Money, to_cents
+from core.timeframes import DateRange
+from transactions.models import ArchivedTransaction, Transaction
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+# Number of ledger rows read from the database and appended to the column files at once
+SNAPSHOT_CHUNK_SIZE = 50_000
+
+# One fixed-width file per column, so every column can be memory-mapped on its own
+SNAPSHOT_COLUMNS = {
+    "amount_cents": np.int64,
+    # seconds since the epoch (UTC)
+    "timestamp": np.int64,
+    # indexes into the account dictionary, NO_ACCOUNT for a missing side
+    "sender": np.int32,
+    "receiver": np.int32,
+    # index into SNAPSHOT_KINDS
+    "kind": np.int8,
+}
+
+SNAPSHOT_KINDS = ["transfer", "stock", "atm"]
+
+NO_ACCOUNT = -1
+
+BUCKET_UNITS = {"hour": "h", "day": "D", "month": "M", "year": "Y"}
+
+
+def _epoch(value: datetime) -> int:
+    if is_naive(value):
+        value = make_aware(value)
+    return int(value.timestamp())
+
+
+def _cents_to_decimal(cents) -> Decimal:
+    return Money(int(cents)).to_decimal()
+
+
+def _read_ledger(chunk_size: int) -> Iterator[list]:
+    # The hot and the archived transactions, in chunks of plain tuples
+    for model in (Transaction, ArchivedTransaction):
+        rows = model.objects.values_list("amount", "date", "sending_account_id", "receiving_account_id", "kind").iterator(chunk_size=chunk_size)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+
+def _is_snapshot(path: str) -> bool:
+    # A directory written by write_snapshot, with the meta file of the current format
+    try:
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as file:
+            return json.load(file).get("version") == SNAPSHOT_FORMAT_VERSION
+    except (OSError, ValueError, AttributeError):
+        return False
+
+
+def write_snapshot(path: str, chunk_size: int = SNAPSHOT_CHUNK_SIZE) -> dict:
+    """
+    Export the whole ledger into a columnar snapshot directory.
+
+    The rows are streamed from the database and appended to the column files chunk by chunk, so the
+    export runs in constant memory apart from the account dictionary. The snapshot is written next to
+    the target and renamed into place at the end, readers never see a half written snapshot. An existing
+    snapshot is renamed aside first and only deleted once the new one is in place, so it is never lost,
+    though for the instant between the two renames the path does not exist.
+
+    :param path: Directory of the snapshot, an existing snapshot is replaced.
+    :param chunk_size: Number of rows read and written at once.
+    :return: A report with the number of 'rows' and 'accounts' and the 'seconds' taken.
+    :raises ValueError: If the path exists but does not hold a snapshot, it is never replaced.
+    """
+    path = os.path.abspath(path.rstrip(os.sep))
+    if os.path.lexists(path) and not _is_snapshot(path):
+        raise ValueError(f"{path} exists and is not a ledger snapshot, refusing to replace it.")
+
+    started = time.perf_counter()
+    kind_indexes = {kind: index for index, kind in enumerate(SNAPSHOT_KINDS)}
+    account_indexes: Dict[UUID, int] = {}
+
+    def account_index(account_id: Optional[UUID]) -> int:
+        if account_id is None:
+            return NO_ACCOUNT
+        return account_indexes.setdefault(account_id, len(account_indexes))
+
+    # siblings of the target, on the same file system so that the renames are atomic
+    staging_path = f"{path}.tmp"
+    old_path = f"{path}.old"
+    shutil.rmtree(staging_path, ignore_errors=True)
+    os.makedirs(staging_path)
+
+    rows = 0
+    files = {name: open(os.path.join(staging_path, f"{name}.bin"), "wb") for name in SNAPSHOT_COLUMNS}
+    try:
+        for chunk in _read_ledger(max(1, chunk_size)):
+            columns = {
+                "amount_cents": [to_cents(amount) for amount, _, _, _, _ in chunk],
+                "timestamp": [_epoch(date) for _, date, _, _, _ in chunk],
+                "sender": [account_index(sending_account_id) for _, _, sending_account_id, _, _ in chunk],
+                "receiver": [account_index(receiving_account_id) for _, _, _, receiving_account_id, _ in chunk],
+                "kind": [kind_indexes[kind] for _, _, _, _, kind in chunk],
+            }
+            for name, dtype in SNAPSHOT_COLUMNS.items():
+                np.asarray(columns[name], dtype=dtype).tofile(files[name])
+            rows += len(chunk)
+    finally:
+        for file in files.values():
+            file.close()
+
+    # The account dictionary holds the 16 raw bytes of every UUID, in index order
+    with open(os.path.join(staging_path, "accounts.bin"), "wb") as file:
+        file.write(b"".join(account_id.bytes for account_id in account_indexes))
+
+    with open(os.path.join(staging_path, "meta.json"), "w", encoding="utf-8") as file:
+        json.dump({
+            "version": SNAPSHOT_FORMAT_VERSION,
+            "rows": rows,
+            "accounts": len(account_indexes),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }, file)
+
+    if os.path.lexists(path):
+        shutil.rmtree(old_path, ignore_errors=True)
+        os.replace(path, old_path)
+        os.replace(staging_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+    else:
+        os.replace(staging_path, path)
+
+    return {"rows": rows, "accounts": len(account_indexes), "seconds": time.perf_counter() - started}
+
+
+class LedgerSnapshot:
+    """
+    Read-only, memory-mapped view of a snapshot written by write_snapshot, with vectorized analytics queries.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as file:
+            meta = json.load(file)
+        if meta.get("version") != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {meta.get('version')}.")
+
+        self.rows = meta["rows"]
+        self.created_at = datetime.fromisoformat(meta["created_at"])
+        columns = {name: self._map(path, name, dtype, (self.rows,)) for name, dtype in SNAPSHOT_COLUMNS.items()}
+        self.amount_cents = columns["amount_cents"]
+        self.timestamp = columns["timestamp"]
+        self.sender = columns["sender"]
+        self.receiver = columns["receiver"]
+        self.kind = columns["kind"]
+        self.accounts = self._map(path, "accounts", np.uint8, (meta["accounts"], 16))
+        self._account_indexes = None
+
+    @staticmethod
+    def _map(path: str, name: str, dtype, shape: tuple) -> np.ndarray:
+        # an empty file can not be memory-mapped
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(path, f"{name}.bin"), dtype=dtype, mode="r", shape=shape)
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def account_index(self, account_id: UUID) -> Optional[int]:
+        """
+        Look up the dictionary index of an account.
+
+        :param account_id: UUID of the account.
+        :return: The index, None if the account has no transactions in the snapshot.
+        """
+        if self._account_indexes is None:
+            self._account_indexes = {UUID(bytes=row.tobytes()): index for index, row in enumerate(self.accounts)}
+        return self._account_indexes.get(UUID(str(account_id)))
+
+    def account_id(self, index: int) -> UUID:
+        """
+        Look up the account of a dictionary index.
+
+        :param index: The dictionary index.
+        :return: UUID of the account.
+        """
+        return UUID(bytes=self.accounts[index].tobytes())
+
+    def _range_mask(self, date_range: DateRange) -> Optional[np.ndarray]:
+        mask = None
+        if date_range.start is not None:
+            mask = self.timestamp >= _epoch(date_range.start)
+        if date_range.end is not None:
+            before_end = self.timestamp < _epoch(date_range.end)
+            mask = before_end if mask is None else mask & before_end
+        return mask
+
+    def account_sums(self, date_range: DateRange = DateRange()) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Sum the sent and received cents of every account in one pass over the columns.
+
+        :param date_range: Only include transactions within this range.
+        :return: Two arrays of sent and received cents, indexed by the account dictionary index.
+        """
+        sender, receiver, amount_cents = self.sender, self.receiver, self.amount_cents
+        mask = self._range_mask(date_range)
+        if mask is not None:
+            sender, receiver, amount_cents = sender[mask], receiver[mask], amount_cents[mask]
+
+        def sum_by_account(indexes: np.ndarray) -> np.ndarray:
+            # bincount sums in float64, which is exact for totals below 2**53 cents
+            known = indexes != NO_ACCOUNT
+            totals = np.bincount(indexes[known], weights=amount_cents[known], minlength=len(self.accounts))
+            return np.rint(totals).astype(np.int64)
+
+        return sum_by_account(sender), sum_by_account(receiver)
+
+    def account_totals(self, account_id: UUID, date_range: DateRange = DateRange()) -> Dict[str, Decimal]:
+        """
+        Sum the amounts sent and received by one account, like TransactionService.aggregate_account_amounts.
+
+        :param account_id: UUID of the account.
+        :param date_range: Only include transactions within this range.
+        :return: A dictionary with the exact 'total_sent', 'total_received' and 'net' amounts.
+        """
+        total_sent = total_received = Money(0)
+        index = self.account_index(account_id)
+        if index is not None:
+            mask = self._range_mask(date_range)
+            sent = self.sender == index
+            received = self.receiver == index
+            if mask is not None:
+                sent &= mask
+                received &= mask
+            total_sent = Money.sum_cents(self.amount_cents[sent])
+            total_received = Money.sum_cents(self.amount_cents[received])
+
+        return {
+            "total_sent": total_sent.to_decimal(),
+            "total_received": total_received.to_decimal(),
+            "net": (total_received - total_sent).to_decimal(),
+        }
+
+    def bucket_totals(self, bucket: str = "day", date_range: DateRange = DateRange(), account_id: Optional[UUID] = None) -> List[Tuple[datetime, int, Decimal]]:
+        """
+        Count the transactions and sum their volume per UTC time bucket.
+
+        :param bucket: 'hour', 'day', 'month' or 'year'.
+        :param date_range: Only include transactions within this range.
+        :param account_id: Only include transactions of this account.
+        :return: A list of (bucket start, transaction count, volume) tuples in time order, empty buckets are left out.
+        :raises ValueError: If the bucket is invalid.
+        """
+        if bucket not in BUCKET_UNITS:
+            raise ValueError("Invalid bucket. Valid options are 'hour', 'day', 'month' or 'year'.")
+
+        mask = self._range_mask(date_range)
+        if account_id is not None:
+            index = self.account_index(account_id)
+            if index is None:
+                return []
+            of_account = (self.sender == index) | (self.receiver == index)
+            mask = of_account if mask is None else mask & of_account
+
+        timestamp, amount_cents = self.timestamp, self.amount_cents
+        if mask is not None:
+            timestamp, amount_cents = timestamp[mask], amount_cents[mask]
+
+        buckets = timestamp.astype("datetime64[s]").astype(f"datetime64[{BUCKET_UNITS[bucket]}]")
+        keys, inverse = np.unique(buckets, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(keys))
+        volumes = np.rint(np.bincount(inverse, weights=amount_cents, minlength=len(keys))).astype(np.int64)
+
+        return [
+            (key.astype("datetime64[s]").item().replace(tzinfo=timezone.utc), int(count), _cents_to_decimal(volume))
+            for key, count, volume in zip(keys, counts, volumes)
+        ]
+
+    def top_accounts(self, n: int = 10, by: str = "volume", date_range: DateRange = DateRange()) -> List[Tuple[UUID, Decimal]]:
+        """
+        Find the accounts with the highest sent, received or total volume.
+
+        :param n: Number of accounts to return.
+        :param by: 'sent', 'received' or 'volume' (sent plus received).
+        :param date_range: Only include transactions within this range.
+        :return: A list of (account id, amount) tuples, highest first.
+        :raises ValueError: If the ranking is invalid.
+        """
+        if by not in ("sent", "received", "volume"):
+            raise ValueError("Invalid ranking. Valid options are 'sent', 'received' or 'volume'.")
+
+        sent, received = self.account_sums(date_range)
+        values = {"sent": sent, "received": received, "volume": sent + received}[by]
+        n = min(n, len(values))
+        if n <= 0:
+            return []
+
+        # partition first, only the n winners are sorted
+        top = np.argpartition(-values, n - 1)[:n]
+        top = top[np.argsort(-values[top], kind="stable")]
+        return [(self.account_id(index), _cents_to_decimal(values[index])) for index in top if values[index] > 0]
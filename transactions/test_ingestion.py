@@ -0,0 +1,112 @@
+import csv
+import io
+import json
+import unittest
+from decimal import Decimal
+from unittest.mock import Mock
+from uuid import uuid4
+
+from django.test import TestCase
+from marshmallow import ValidationError
+
+from accounts.models import CheckingAccount
+from accounts.services import AccountService
+from transactions.ingestion import PaymentFileIngestor, read_payments
+from transactions.models import Transaction
+from transactions.services import TransactionService
+
+
+class TestPaymentFileIngestor(unittest.TestCase):
+    def setUp(self):
+        self.account_service = Mock()
+        self.account_service.create_transactions_batch.side_effect = lambda payments: {"created": len(payments), "failures": []}
+        self.sender = str(uuid4())
+        self.receiver = str(uuid4())
+
+    def rejected_rows(self, rejects_file):
+        return list(csv.DictReader(io.StringIO(rejects_file.getvalue())))
+
+    def test_read_csv_payments(self):
+        file = io.StringIO(f"sender,receiver,amount\n{self.sender},{self.receiver},10.50\n{self.sender},,3\n")
+
+        rows = list(read_payments(file, "csv"))
+
+        self.assertEqual(rows[0], (2, {"sending_account_id": self.sender, "receiving_account_id": self.receiver, "amount": "10.50"}, None))
+        self.assertEqual(rows[1], (3, None, "Missing field(s): receiving_account_id."))
+
+    def test_read_jsonl_payments(self):
+        file = io.StringIO(
+            json.dumps({"sending_account_id": self.sender, "receiving_account_id": self.receiver, "amount": 5}) + "\n"
+            "\n"
+            "{broken\n"
+            "[1, 2]\n"
+        )
+
+        rows = list(read_payments(file, "jsonl"))
+
+        self.assertEqual(rows[0], (1, {"sending_account_id": self.sender, "receiving_account_id": self.receiver, "amount": 5}, None))
+        self.assertEqual([row[0] for row in rows[1:]], [3, 4])
+        self.assertTrue(all(payment is None for _, payment, _ in rows[1:]))
+
+    def test_read_payments_invalid_format(self):
+        with self.assertRaises(ValueError):
+            list(read_payments(io.StringIO(""), "xml"))
+
+    def test_ingest_posts_in_chunks(self):
+        file = io.StringIO("sender,receiver,amount\n" + f"{self.sender},{self.receiver},1.00\n" * 5)
+        reports = []
+
+        report = PaymentFileIngestor(self.account_service, chunk_size=2).ingest(file, "csv", io.StringIO(), progress=lambda r: reports.append(dict(r)))
+
+        self.assertEqual([len(call[0][0]) for call in self.account_service.create_transactions_batch.call_args_list], [2, 2, 1])
+        self.assertEqual([r["rows"] for r in reports], [2, 4, 5])
+        self.assertEqual((report["rows"], report["posted"], report["rejected"]), (5, 5, 0))
+        self.assertGreater(report["rows_per_second"], 0)
+
+    def test_ingest_writes_rejects(self):
+        self.account_service.create_transactions_batch.side_effect = lambda payments: {
+            "created": len(payments) - 1,
+            "failures": [{"index": 1, "error": "Overdraft limit (1000.0) overreached"}],
+        }
+        file = io.StringIO(
+            "sender,receiver,amount\n"
+            f"{self.sender},{self.receiver},1.00\n"
+            f"{self.sender},,2.00\n"
+            f"{self.sender},{self.receiver},3.00\n"
+        )
+        rejects_file = io.StringIO()
+
+        report = PaymentFileIngestor(self.account_service).ingest(file, "csv", rejects_file)
+
+        self.assertEqual((report["rows"], report["posted"], report["rejected"]), (3, 1, 2))
+        rejected = self.rejected_rows(rejects_file)
+        self.assertEqual([row["line"] for row in rejected], ["3", "4"])
+        self.assertEqual(rejected[1]["amount"], "3.00")
+        self.assertEqual(rejected[1]["error"], "Overdraft limit (1000.0) overreached")
+
+    def test_ingest_rejects_failed_chunk(self):
+        self.account_service.create_transactions_batch.side_effect = ValidationError("Transaction failed: database is locked")
+        file = io.StringIO("sender,receiver,amount\n" + f"{self.sender},{self.receiver},1.00\n" * 2)
+        rejects_file = io.StringIO()
+
+        report = PaymentFileIngestor(self.account_service).ingest(file, "csv", rejects_file)
+
+        self.assertEqual((report["posted"], report["rejected"]), (0, 2))
+        self.assertEqual(len(self.rejected_rows(rejects_file)), 2)
+
+
+class TestPaymentFileIngestion(TestCase):
+    def test_ingest_payment_file(self):
+        sender = CheckingAccount.objects.create(PIN="1234", opening_balance=Decimal("100.00"))
+        receiver = CheckingAccount.objects.create(PIN="4321")
+        file = io.StringIO("\n".join(
+            json.dumps({"sender": str(sender.account_id), "receiver": str(receiver.account_id), "amount": amount})
+            for amount in ["600.00", "400.00", "200.00"]
+        ))
+
+        report = PaymentFileIngestor(AccountService(TransactionService()), chunk_size=2).ingest(file, "jsonl", io.StringIO())
+
+        self.assertEqual((report["rows"], report["posted"], report["rejected"]), (3, 2, 1))
+        self.assertEqual(Transaction.objects.count(), 2)
+        sender.refresh_from_db()
+        self.assertEqual(sender.ledger_balance, Decimal("-1000.00"))
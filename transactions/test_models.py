@@ -84,3 +84,29 @@ class TestTransactions(TestCase):
         self.assertEqual(atm_transaction.amount, amount)
         self.assertEqual(str(atm_transaction), f"Transaction {atm_transaction.transaction_id} of amount {atm_transaction.amount}")
 
+
+    def test_kind_is_stored_on_the_base_row(self) -> None:
+        transfer = Transaction.objects.create(sending_account_id=uuid4(), receiving_account_id=uuid4(), amount=10)
+        stock_transaction = StockTransaction.objects.create(sending_account_id=uuid4(), receiving_account_id=uuid4(), amount=20, stockId=self.stock.stockID, quantity=1, transaction_type='buy')
+        atm_transaction = ATMTransaction.objects.create(sending_account_id=uuid4(), amount=30)
+
+        kinds = dict(Transaction.objects.values_list("transaction_id", "kind"))
+
+        self.assertEqual(kinds[transfer.transaction_id], "transfer")
+        self.assertEqual(kinds[stock_transaction.transaction_id], "stock")
+        self.assertEqual(kinds[atm_transaction.transaction_id], "atm")
+
+    def test_load_polymorphic(self) -> None:
+        transfer = Transaction.objects.create(sending_account_id=uuid4(), receiving_account_id=uuid4(), amount=10)
+        for quantity in (1, 2):
+            StockTransaction.objects.create(sending_account_id=uuid4(), receiving_account_id=uuid4(), amount=20, stockId=self.stock.stockID, quantity=quantity, transaction_type='buy')
+        ATMTransaction.objects.create(sending_account_id=uuid4(), amount=30)
+        base_rows = list(Transaction.objects.order_by("amount", "transaction_id"))
+
+        # one bulk query per child kind, none for plain transfers
+        with self.assertNumQueries(2):
+            transactions = Transaction.objects.load_polymorphic(base_rows)
+
+        self.assertEqual([type(transaction) for transaction in transactions], [Transaction, StockTransaction, StockTransaction, ATMTransaction])
+        self.assertEqual(transactions[0], transfer)
+        self.assertEqual(sorted(transaction.quantity for transaction in transactions[1:3]), [1, 2])
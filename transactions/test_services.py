@@ -1,10 +1,19 @@
 import unittest
+import marshmallow
 from unittest.mock import patch, Mock
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 from uuid import uuid4
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils.timezone import make_aware
+from accounts.models import CheckingAccount
+from accounts.services import AccountService
+from core.timeframes import DateRange, INVALID_TIMEFRAME_MESSAGE, month_of, month_start
 from transactions.services import TransactionService
-from transactions.models import Transaction, StockTransaction, ATMTransaction
+from transactions.models import Transaction, StockTransaction, ATMTransaction, ArchivedJournalLine, ArchivedTransaction, BalanceCheckpoint, JournalLine, MonthlyAccountRollup
 
 class TestTransactionService(unittest.TestCase):
     def setUp(self):
@@ -33,70 +42,6 @@ class TestTransactionService(unittest.TestCase):
 
         self.mock_stock_transaction_model.objects.create.return_value = self.mock_transaction
 
-        # Create transactions within the last 30 and 60 days
-        self.transaction_30_days = Transaction.objects.create(
-            transaction_id=uuid4(),
-            sending_account_id=self.account_id,
-            receiving_account_id=uuid4(),
-            amount=100.50,
-            date=datetime.now() - timedelta(days=15),
-        )
-        self.transaction_60_days = Transaction.objects.create(
-            transaction_id=uuid4(),
-            sending_account_id=self.account_id,
-            receiving_account_id=uuid4(),
-            amount=200.75,
-            date=datetime.now() - timedelta(days=45),
-        )
-
-        # Create transactions older than 60 days
-        self.transaction_old = Transaction.objects.create(
-            transaction_id=uuid4(),
-            sending_account_id=self.account_id,
-            receiving_account_id=uuid4(),
-            amount=300.25,
-            date=datetime.now() - timedelta(days=90),
-        )
-
-        self.transaction_1_uuid = uuid4()
-        self.transaction_2_uuid = uuid4()
-        self.transaction_3_uuid = uuid4()
-
-        # Create stock transactions within the last 30 and 60 days
-        self.stock_transaction_30_days = StockTransaction.objects.create(
-            transaction_id=self.transaction_1_uuid,
-            stockId=uuid4(),
-            transaction_type="Buy",
-            quantity=10,
-            amount=1500.50,
-            date=datetime.now() - timedelta(days=15),
-            sending_account_id=self.second_account_id,
-            receiving_account_id=self.stock_receiving_account_id,
-        )
-
-        self.stock_transaction_60_days = StockTransaction.objects.create(
-            transaction_id=self.transaction_2_uuid,
-            stockId=uuid4(),
-            transaction_type="Sell",
-            quantity=5,
-            amount=2500.75,
-            date=datetime.now() - timedelta(days=45),
-            sending_account_id=self.second_account_id,
-            receiving_account_id=self.stock_receiving_account_id,
-        )
-
-        # Create stock transactions older than 60 days
-        self.stock_transaction_old = StockTransaction.objects.create(
-            transaction_id=self.transaction_3_uuid,
-            stockId=uuid4(),
-            transaction_type="Buy",
-            quantity=20,
-            amount=3000.25,
-            date=datetime.now() - timedelta(days=90),
-            sending_account_id=self.second_account_id,
-            receiving_account_id=self.stock_receiving_account_id,
-        )
-
         # Account for the transaction
         self.mock_atm_sending_account_id = uuid4()
 
@@ -108,7 +53,6 @@ class TestTransactionService(unittest.TestCase):
         self.mock_atm_transaction_model.objects.create.return_value = self.mock_atm_transaction
 
 
-
     def test_create_new_transaction_success(self):
         self.mock_transaction_model.objects.create.return_value = self.mock_transaction
 
@@ -184,7 +128,7 @@ class TestTransactionService(unittest.TestCase):
         with self.assertRaises(ValueError) as context:
             self.transaction_service.get_transaction_history(self.sending_account_id, "invalid_timeframe")
 
-        self.assertEqual(str(context.exception), "Invalid timeframe. Valid options are '30_days', '60_days', or 'all_time'.")
+        self.assertEqual(str(context.exception), INVALID_TIMEFRAME_MESSAGE)
 
     def test_get_transaction_history_empty_list(self):
         self.mock_transaction_model.objects.filter.return_value = []
@@ -194,13 +138,548 @@ class TestTransactionService(unittest.TestCase):
         self.assertEqual(result, [])
 
 
+    def test_get_stock_transaction_history_invalid_timeframe(self):
+        with self.assertRaises(ValueError):
+            self.transaction_service.get_stock_transaction_history(account_id=self.second_account_id, timeframe="invalid_timeframe")
+
+
+    def test_new_atm_transaction_success(self):
+
+        result = self.transaction_service.create_new_atm_transaction(
+            amount=100.0,
+            account_id=self.mock_atm_transaction.sending_account_id,
+            atm_id=uuid4())
+
+        self.assertTrue(result)
+        self.assertEqual(self.mock_atm_transaction.amount, 100.0)
+        self.assertEqual(self.mock_atm_transaction.sending_account_id, self.mock_atm_transaction.sending_account_id)
+
+    def test_new_atm_transaction_failure(self):
+        self.transaction_service.create_new_atm_transaction = Mock(side_effect=ValidationError("Atm transaction failed"))
+
+        with self.assertRaises(ValidationError) as context:
+            self.transaction_service.create_new_atm_transaction(
+                amount=100.0,
+                account_id=self.mock_atm_transaction.sending_account_id,
+                atm_id=uuid4()
+            )
+
+        self.assertEqual(str(context.exception), "['Atm transaction failed']")
+
+    def tearDown(self):
+        patch.stopall()
+
+class TestTransactionServiceBalances(TestCase):
+    def setUp(self):
+        self.transaction_service = TransactionService()
+
+        self.sending_account = CheckingAccount.objects.create(PIN="1234", opening_balance=Decimal("1000.00"))
+        self.receiving_account = CheckingAccount.objects.create(PIN="4321", opening_balance=Decimal("500.00"))
+
+    def test_create_new_transaction_updates_ledger_balances(self):
+        self.transaction_service.create_new_transaction(Decimal("100.25"), self.sending_account.account_id, self.receiving_account.account_id)
+
+        self.sending_account.refresh_from_db()
+        self.receiving_account.refresh_from_db()
+        self.assertEqual(self.sending_account.ledger_balance, Decimal("-100.25"))
+        self.assertEqual(self.receiving_account.ledger_balance, Decimal("100.25"))
+
+    def test_create_new_atm_transaction_updates_ledger_balance(self):
+        self.transaction_service.create_new_atm_transaction(Decimal("40.00"), self.sending_account.account_id, uuid4())
+
+        self.sending_account.refresh_from_db()
+        self.assertEqual(self.sending_account.ledger_balance, Decimal("-40.00"))
+
+    def test_create_new_stock_transaction_updates_ledger_balances(self):
+        self.transaction_service.create_new_stock_transaction(Decimal("300.00"), self.sending_account.account_id, self.receiving_account.account_id, uuid4(), 2, "buy")
+
+        self.sending_account.refresh_from_db()
+        self.receiving_account.refresh_from_db()
+        self.assertEqual(self.sending_account.ledger_balance, Decimal("-300.00"))
+        self.assertEqual(self.receiving_account.ledger_balance, Decimal("300.00"))
+
+    def test_bulk_create_transactions(self):
+        third_account = CheckingAccount.objects.create(PIN="1111")
+        transfers = [
+            {"amount": Decimal("10.00"), "sending_account_id": self.sending_account.account_id, "receiving_account_id": self.receiving_account.account_id},
+            {"amount": Decimal("2.50"), "sending_account_id": self.sending_account.account_id, "receiving_account_id": third_account.account_id},
+            {"amount": Decimal("1.00"), "sending_account_id": self.receiving_account.account_id, "receiving_account_id": self.sending_account.account_id},
+        ]
+
+        # savepoint, one insert each for transactions and journal lines, an update per account for balances and rollups, one rollup insert
+        with self.assertNumQueries(11):
+            created = self.transaction_service.bulk_create_transactions(transfers)
+
+        self.assertEqual(created, 3)
+        self.assertEqual(Transaction.objects.count(), 3)
+        self.sending_account.refresh_from_db()
+        self.receiving_account.refresh_from_db()
+        third_account.refresh_from_db()
+        self.assertEqual(self.sending_account.ledger_balance, Decimal("-11.50"))
+        self.assertEqual(self.receiving_account.ledger_balance, Decimal("9.00"))
+        self.assertEqual(third_account.ledger_balance, Decimal("2.50"))
+
+        rollup = MonthlyAccountRollup.objects.get(account_id=self.sending_account.account_id)
+        self.assertEqual((rollup.total_sent, rollup.total_received, rollup.transaction_count), (Decimal("12.50"), Decimal("1.00"), 3))
+
+    def test_create_new_transaction_with_idempotency_key_posts_once(self):
+        for _ in range(2):
+            self.assertTrue(self.transaction_service.create_new_transaction(Decimal("25.00"), self.sending_account.account_id, self.receiving_account.account_id, idempotency_key="retry-1"))
+        self.assertTrue(self.transaction_service.create_new_atm_transaction(Decimal("5.00"), self.sending_account.account_id, uuid4(), idempotency_key="atm-1"))
+        self.assertTrue(self.transaction_service.create_new_atm_transaction(5.0, self.sending_account.account_id, uuid4(), idempotency_key="atm-1"))
+
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.sending_account.refresh_from_db()
+        self.assertEqual(self.sending_account.ledger_balance, Decimal("-30.00"))
+
+    def test_idempotency_key_replay_is_a_single_query(self):
+        self.transaction_service.create_new_transaction(Decimal("25.00"), self.sending_account.account_id, self.receiving_account.account_id, idempotency_key="retry-1")
+
+        with self.assertNumQueries(1):
+            self.transaction_service.create_new_transaction(Decimal("25.00"), self.sending_account.account_id, self.receiving_account.account_id, idempotency_key="retry-1")
+
+    def test_idempotency_key_replay_of_an_archived_transaction(self):
+        Transaction.objects.create(sending_account_id=self.sending_account.account_id, receiving_account_id=self.receiving_account.account_id, amount=Decimal("25.00"), date=make_aware(datetime.now() - timedelta(days=400)), idempotency_key="retry-1")
+        self.assertEqual(self.transaction_service.archive_transactions(), 1)
+
+        # the hot table misses, the archive still knows the key
+        with self.assertNumQueries(2):
+            self.assertTrue(self.transaction_service.create_new_transaction(Decimal("25.00"), self.sending_account.account_id, self.receiving_account.account_id, idempotency_key="retry-1"))
+        with self.assertRaises(marshmallow.ValidationError):
+            self.transaction_service.create_new_transaction(Decimal("26.00"), self.sending_account.account_id, self.receiving_account.account_id, idempotency_key="retry-1")
+
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_idempotency_key_reused_for_different_transaction(self):
+        self.transaction_service.create_new_transaction(Decimal("25.00"), self.sending_account.account_id, self.receiving_account.account_id, idempotency_key="retry-1")
+
+        with self.assertRaises(marshmallow.ValidationError):
+            self.transaction_service.create_new_transaction(Decimal("26.00"), self.sending_account.account_id, self.receiving_account.account_id, idempotency_key="retry-1")
+        with self.assertRaises(marshmallow.ValidationError):
+            self.transaction_service.create_new_atm_transaction(Decimal("25.00"), self.sending_account.account_id, uuid4(), idempotency_key="retry-1")
+        with self.assertRaises(marshmallow.ValidationError):
+            self.transaction_service.create_new_stock_transaction(Decimal("25.00"), self.sending_account.account_id, self.receiving_account.account_id, uuid4(), 1, "buy", idempotency_key="retry-1")
+
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_idempotency_key_concurrent_insert(self):
+        # The first probe misses, the insert then collides with the row committed by a concurrent retry
+        Transaction.objects.create(sending_account_id=self.sending_account.account_id, receiving_account_id=self.receiving_account.account_id, amount=Decimal("25.00"), idempotency_key="retry-1")
+
+        with patch.object(TransactionService, "_is_replay", side_effect=[False, True]) as mock_is_replay:
+            self.assertTrue(self.transaction_service.create_new_transaction(Decimal("25.00"), self.sending_account.account_id, self.receiving_account.account_id, idempotency_key="retry-1"))
+
+        # the second probe is a locking read, it sees the concurrent commit outside the caller's snapshot
+        self.assertEqual(mock_is_replay.call_args_list[1].kwargs, {"locking": True})
+        self.assertTrue(self.transaction_service._is_replay("retry-1", Transaction.KIND, Decimal("25.00"), self.sending_account.account_id, self.receiving_account.account_id, locking=True))
+
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.sending_account.refresh_from_db()
+        self.assertEqual(self.sending_account.ledger_balance, Decimal("0.00"))
+
+    def test_get_net_amounts_matches_ledger_balances(self):
+        self.transaction_service.create_new_transaction(Decimal("100.00"), self.sending_account.account_id, self.receiving_account.account_id)
+        self.transaction_service.create_new_transaction(Decimal("30.00"), self.receiving_account.account_id, self.sending_account.account_id)
+
+        net_amounts = self.transaction_service.get_net_amounts()
+
+        self.assertEqual(net_amounts[self.sending_account.account_id], Decimal("-70.00"))
+        self.assertEqual(net_amounts[self.receiving_account.account_id], Decimal("70.00"))
+
+    def test_get_net_amounts_rounds_fractional_sums(self):
+        self.transaction_service.create_new_transaction(Decimal("7227.06"), self.receiving_account.account_id, self.sending_account.account_id)
+        self.transaction_service.create_new_transaction(Decimal("2275.70"), self.sending_account.account_id, self.receiving_account.account_id)
+        self.transaction_service.create_new_transaction(Decimal("4221.79"), self.sending_account.account_id, self.receiving_account.account_id)
+
+        net_amounts = self.transaction_service.get_net_amounts()
+
+        # SQLite sums the amounts as floats, unrounded this comes back as 729.570000000001
+        self.assertEqual(net_amounts[self.sending_account.account_id], Decimal("729.57"))
+        self.assertEqual(net_amounts[self.receiving_account.account_id], Decimal("-729.57"))
+        # the stored balances are not reported as drifting
+        self.assertEqual(AccountService(self.transaction_service).rebuild_balances(fix=False), [])
+
+    def test_aggregate_account_amounts(self):
+        self.transaction_service.create_new_transaction(Decimal("100.10"), self.sending_account.account_id, self.receiving_account.account_id)
+        self.transaction_service.create_new_transaction(Decimal("0.20"), self.receiving_account.account_id, self.sending_account.account_id)
+        self.transaction_service.create_new_atm_transaction(Decimal("10.00"), self.sending_account.account_id, uuid4())
+
+        totals = self.transaction_service.aggregate_account_amounts(self.sending_account.account_id, "all_time")
+
+        self.assertEqual(totals, {
+            "total_sent": Decimal("110.10"),
+            "total_received": Decimal("0.20"),
+            "net": Decimal("-109.90"),
+        })
+
+    def test_aggregate_account_amounts_respects_timeframe(self):
+        Transaction.objects.create(
+            sending_account_id=self.sending_account.account_id,
+            receiving_account_id=self.receiving_account.account_id,
+            amount=Decimal("70.00"),
+            date=datetime.now() - timedelta(days=45),
+        )
+        # rows inserted around the service need a fresh journal and rollups
+        self.transaction_service.rebuild_journal_lines()
+        self.transaction_service.rebuild_monthly_rollups()
+
+        self.assertEqual(self.transaction_service.aggregate_account_amounts(self.sending_account.account_id, "30_days")["total_sent"], Decimal("0.00"))
+        self.assertEqual(self.transaction_service.aggregate_account_amounts(self.sending_account.account_id, "60_days")["total_sent"], Decimal("70.00"))
+
+    def test_aggregate_account_amounts_with_date_range(self):
+        for day, amount in ((1, Decimal("10.00")), (15, Decimal("20.00")), (28, Decimal("40.00"))):
+            Transaction.objects.create(
+                sending_account_id=self.sending_account.account_id,
+                receiving_account_id=self.receiving_account.account_id,
+                amount=amount,
+                date=make_aware(datetime(2023, 2, day, 12)),
+            )
+        self.transaction_service.rebuild_journal_lines()
+        self.transaction_service.rebuild_monthly_rollups()
+
+        date_range = DateRange(start=make_aware(datetime(2023, 2, 10)), end=make_aware(datetime(2023, 2, 28)))
+        totals = self.transaction_service.aggregate_account_amounts(self.sending_account.account_id, date_range)
+        history = self.transaction_service.get_transaction_history(self.sending_account.account_id, "2023-02")
+
+        self.assertEqual(totals["total_sent"], Decimal("20.00"))
+        self.assertEqual(len(history), 3)
+
+    def test_postings_update_monthly_rollups(self):
+        self.transaction_service.create_new_transaction(Decimal("10.00"), self.sending_account.account_id, self.receiving_account.account_id)
+        self.transaction_service.create_new_transaction(Decimal("2.50"), self.receiving_account.account_id, self.sending_account.account_id)
+        self.transaction_service.create_new_transaction(Decimal("1.00"), self.sending_account.account_id, self.sending_account.account_id)
+        self.transaction_service.create_new_atm_transaction(Decimal("5.00"), self.sending_account.account_id, uuid4())
+
+        rollup = MonthlyAccountRollup.objects.get(account_id=self.sending_account.account_id)
+        self.assertEqual(rollup.month, month_of(datetime.now()))
+        self.assertEqual(rollup.total_sent, Decimal("16.00"))
+        self.assertEqual(rollup.total_received, Decimal("3.50"))
+        self.assertEqual(rollup.transaction_count, 4)
+
+        expected = {
+            (r.account_id, r.month): (r.total_sent, r.total_received, r.transaction_count)
+            for r in MonthlyAccountRollup.objects.all()
+        }
+        self.assertEqual(self.transaction_service.rebuild_monthly_rollups(), 2)
+        rebuilt = {
+            (r.account_id, r.month): (r.total_sent, r.total_received, r.transaction_count)
+            for r in MonthlyAccountRollup.objects.all()
+        }
+        self.assertEqual(rebuilt, expected)
+
+    def test_aggregate_account_amounts_combines_rollups_and_partial_months(self):
+        # February is covered by its rollup, January 20th and March 20th lie outside the range
+        MonthlyAccountRollup.objects.create(account_id=self.sending_account.account_id, month=date(2023, 2, 1), total_sent=Decimal("100.00"), total_received=Decimal("1.00"), transaction_count=3)
+        Transaction.objects.create(sending_account_id=self.sending_account.account_id, receiving_account_id=uuid4(), amount=Decimal("7.00"), date=make_aware(datetime(2023, 1, 20)))
+        Transaction.objects.create(sending_account_id=self.sending_account.account_id, receiving_account_id=uuid4(), amount=Decimal("9.00"), date=make_aware(datetime(2023, 1, 25)))
+        Transaction.objects.create(sending_account_id=uuid4(), receiving_account_id=self.sending_account.account_id, amount=Decimal("4.00"), date=make_aware(datetime(2023, 3, 3)))
+        Transaction.objects.create(sending_account_id=uuid4(), receiving_account_id=self.sending_account.account_id, amount=Decimal("8.00"), date=make_aware(datetime(2023, 3, 20)))
+        self.transaction_service.rebuild_journal_lines()
+
+        date_range = DateRange(start=make_aware(datetime(2023, 1, 22)), end=make_aware(datetime(2023, 3, 10)))
+        # the rollups, and the edge months from the hot and the archived journal
+        with self.assertNumQueries(3):
+            totals = self.transaction_service.aggregate_account_amounts(self.sending_account.account_id, date_range)
+
+        self.assertEqual(totals, {"total_sent": Decimal("109.00"), "total_received": Decimal("5.00"), "net": Decimal("-104.00")})
+
+    def test_build_balance_checkpoints_and_get_ledger_balance(self):
+        old_date = datetime.now() - timedelta(days=3)
+        for amount in (Decimal("10.00"), Decimal("20.00")):
+            Transaction.objects.create(
+                sending_account_id=self.sending_account.account_id,
+                receiving_account_id=self.receiving_account.account_id,
+                amount=amount,
+                date=old_date,
+            )
+        self.transaction_service.rebuild_journal_lines()
+
+        written = self.transaction_service.build_balance_checkpoints(workers=1)
+
+        self.assertEqual(written, 2)
+        checkpoint = BalanceCheckpoint.objects.get(account_id=self.receiving_account.account_id)
+        self.assertEqual(checkpoint.balance, Decimal("30.00"))
+        self.assertEqual(checkpoint.transaction_count, 2)
+
+        # transactions after the checkpoint are replayed on top of it
+        self.transaction_service.create_new_transaction(Decimal("5.00"), self.receiving_account.account_id, self.sending_account.account_id)
+
+        self.assertEqual(self.transaction_service.get_ledger_balance(self.receiving_account.account_id), Decimal("25.00"))
+        self.assertEqual(self.transaction_service.get_ledger_balance(self.sending_account.account_id), Decimal("-25.00"))
+
+    def test_build_balance_checkpoints_is_incremental(self):
+        Transaction.objects.create(
+            sending_account_id=self.sending_account.account_id,
+            receiving_account_id=self.receiving_account.account_id,
+            amount=Decimal("10.00"),
+            date=datetime.now() - timedelta(days=3),
+        )
+        self.transaction_service.rebuild_journal_lines()
+        first_cutoff = make_aware(datetime.now() - timedelta(days=2))
+        self.transaction_service.build_balance_checkpoints(cutoff=first_cutoff, workers=1)
+
+        # nothing new happened, so a later build does not write any checkpoints
+        self.assertEqual(self.transaction_service.build_balance_checkpoints(cutoff=first_cutoff + timedelta(hours=1), workers=1), 0)
+
+        Transaction.objects.create(
+            sending_account_id=self.sending_account.account_id,
+            receiving_account_id=uuid4(),
+            amount=Decimal("1.00"),
+            date=datetime.now() - timedelta(days=1),
+        )
+        self.transaction_service.rebuild_journal_lines()
+        self.assertEqual(self.transaction_service.build_balance_checkpoints(workers=1), 2)
+
+        latest = BalanceCheckpoint.objects.filter(account_id=self.sending_account.account_id).order_by("-checkpoint_date").first()
+        self.assertEqual(latest.balance, Decimal("-11.00"))
+        self.assertEqual(latest.transaction_count, 2)
+
+    def test_build_balance_checkpoints_rejects_cutoff_after_start_of_today(self):
+        with self.assertRaises(ValueError):
+            self.transaction_service.build_balance_checkpoints(cutoff=make_aware(datetime.now() + timedelta(minutes=1)), workers=1)
+
+        with self.assertRaises(CommandError):
+            call_command("build_balance_checkpoints", "--cutoff", (date.today() + timedelta(days=1)).isoformat())
+        self.assertFalse(BalanceCheckpoint.objects.exists())
+
+    def test_get_ledger_balance_at(self):
+        sending_account_id, receiving_account_id = uuid4(), uuid4()
+        first_date = make_aware(datetime.now() - timedelta(days=70))
+        for days, amount in ((0, "10.00"), (30, "20.00"), (60, "40.00")):
+            Transaction.objects.create(
+                sending_account_id=sending_account_id,
+                receiving_account_id=receiving_account_id,
+                amount=Decimal(amount),
+                date=first_date + timedelta(days=days),
+            )
+        self.transaction_service.rebuild_journal_lines()
+        self.transaction_service.rebuild_monthly_rollups()
+
+        self.assertEqual(self.transaction_service.get_ledger_balance_at(receiving_account_id, first_date), Decimal("0.00"))
+        self.assertEqual(self.transaction_service.get_ledger_balance_at(receiving_account_id, first_date + timedelta(days=1)), Decimal("10.00"))
+        self.assertEqual(self.transaction_service.get_ledger_balance_at(receiving_account_id, first_date + timedelta(days=31)), Decimal("30.00"))
+        at = first_date + timedelta(days=61)
+        # rollups of the earlier months plus the journal lines of the month
+        with self.assertNumQueries(3):
+            self.assertEqual(self.transaction_service.get_ledger_balance_at(receiving_account_id, at), Decimal("70.00"))
+        self.assertEqual(self.transaction_service.get_ledger_balance_at(sending_account_id, at), Decimal("-70.00"))
+
+        # a checkpoint within the month replaces the rollups
+        cutoff = max(month_start(month_of(at)), first_date + timedelta(days=60, seconds=1))
+        self.transaction_service.build_balance_checkpoints(cutoff=cutoff, workers=1)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.transaction_service.get_ledger_balance_at(receiving_account_id, at), Decimal("70.00"))
+
+    def test_get_balance_series(self):
+        account_id = uuid4()
+        first_day = make_aware(datetime.combine(date.today() - timedelta(days=10), datetime.min.time()))
+        for days, amount, sending_account_id, receiving_account_id in (
+            (-5, "50.00", None, account_id),
+            (1, "10.00", None, account_id),
+            (1, "2.50", account_id, None),
+            (4, "20.00", None, account_id),
+        ):
+            Transaction.objects.create(
+                sending_account_id=sending_account_id,
+                receiving_account_id=receiving_account_id,
+                amount=Decimal(amount),
+                date=first_day + timedelta(days=days, hours=12),
+            )
+        self.transaction_service.rebuild_journal_lines()
+        self.transaction_service.rebuild_monthly_rollups()
+        date_range = DateRange(start=first_day, end=first_day + timedelta(days=6))
+
+        series = self.transaction_service.get_balance_series(account_id, date_range)
+
+        self.assertEqual([point["date"] for point in series], [first_day + timedelta(days=days) for days in range(6)])
+        self.assertEqual([point["balance"] for point in series], [Decimal(value) for value in ("50.00", "57.50", "57.50", "57.50", "77.50", "77.50")])
+
+        # thinned out series keep the closing balance of every n-th day, ending with the last one
+        thinned = self.transaction_service.get_balance_series(account_id, date_range, max_points=2)
+        self.assertEqual([(point["date"], point["balance"]) for point in thinned], [(first_day + timedelta(days=2), Decimal("57.50")), (first_day + timedelta(days=5), Decimal("77.50"))])
+
+        hourly = self.transaction_service.get_balance_series(account_id, DateRange(start=first_day + timedelta(days=1), end=first_day + timedelta(days=2)), interval="hour")
+        self.assertEqual(len(hourly), 24)
+        self.assertEqual((hourly[11]["balance"], hourly[12]["balance"]), (Decimal("50.00"), Decimal("57.50")))
+
+        # an open start begins at the first transaction
+        self.assertEqual(self.transaction_service.get_balance_series(account_id, "all_time")[0]["date"], first_day - timedelta(days=5))
+        self.assertEqual(self.transaction_service.get_balance_series(uuid4(), "all_time"), [])
+        with self.assertRaises(ValueError):
+            self.transaction_service.get_balance_series(account_id, date_range, interval="week")
+
+    def test_get_transaction_history_page_walks_all_pages(self):
+        other_account_id = uuid4()
+        created_ids = []
+        base_date = datetime.now() - timedelta(days=1)
+        for i in range(7):
+            sending, receiving = (self.sending_account.account_id, other_account_id) if i % 2 else (other_account_id, self.sending_account.account_id)
+            created_ids.append(str(Transaction.objects.create(
+                sending_account_id=sending,
+                receiving_account_id=receiving,
+                amount=Decimal(i + 1),
+                # two transactions share every timestamp to exercise the transaction id tie breaker
+                date=base_date + timedelta(minutes=i // 2),
+            ).transaction_id))
+        # a self transfer is listed only once
+        created_ids.append(str(Transaction.objects.create(
+            sending_account_id=self.sending_account.account_id,
+            receiving_account_id=self.sending_account.account_id,
+            amount=Decimal("1.00"),
+            date=base_date - timedelta(minutes=1),
+        ).transaction_id))
+        self.transaction_service.rebuild_journal_lines()
+
+        seen_ids = []
+        cursor = None
+        pages = 0
+        while True:
+            page = self.transaction_service.get_transaction_history_page(self.sending_account.account_id, "all_time", cursor=cursor, page_size=3)
+            pages += 1
+            self.assertLessEqual(len(page["transactions"]), 3)
+            seen_ids.extend(transaction["transaction_id"] for transaction in page["transactions"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(sorted(seen_ids), sorted(created_ids))
+        self.assertEqual(len(seen_ids), len(set(seen_ids)))
+
+        full_history = self.transaction_service.get_transaction_history(self.sending_account.account_id, "all_time")
+        self.assertEqual([transaction["date"] for transaction in full_history], sorted([transaction["date"] for transaction in full_history], reverse=True))
+
+    def test_get_transaction_history_page_invalid_cursor(self):
+        with self.assertRaises(ValueError) as context:
+            self.transaction_service.get_transaction_history_page(self.sending_account.account_id, "all_time", cursor="not-a-cursor")
+
+        self.assertEqual(str(context.exception), "Invalid cursor.")
+
+    def test_iter_transaction_history(self):
+        base_date = make_aware(datetime.now() - timedelta(days=10))
+        sent = Transaction.objects.create(sending_account_id=self.sending_account.account_id, receiving_account_id=uuid4(), amount=Decimal("3.00"), date=base_date)
+        received = Transaction.objects.create(sending_account_id=uuid4(), receiving_account_id=self.sending_account.account_id, amount=Decimal("4.00"), date=base_date + timedelta(days=1))
+        self_transfer = Transaction.objects.create(sending_account_id=self.sending_account.account_id, receiving_account_id=self.sending_account.account_id, amount=Decimal("5.00"), date=base_date + timedelta(days=2))
+        Transaction.objects.create(sending_account_id=self.sending_account.account_id, receiving_account_id=uuid4(), amount=Decimal("6.00"), date=base_date + timedelta(days=5))
+        self.transaction_service.rebuild_journal_lines()
+
+        rows = list(self.transaction_service.iter_transaction_history(
+            self.sending_account.account_id, start=base_date, end=base_date + timedelta(days=3), chunk_size=1
+        ))
+
+        self.assertEqual([row.transaction_id for row in rows], [sent.transaction_id, received.transaction_id, self_transfer.transaction_id])
+        self.assertEqual(rows[1].amount, Decimal("4.00"))
+        self.assertEqual(rows[1].receiving_account_id, self.sending_account.account_id)
+        self.assertEqual(rows[1].kind, "transfer")
+
+    def test_iter_transaction_history_is_lazy(self):
+        self.transaction_service.create_new_transaction(Decimal("3.00"), self.sending_account.account_id, uuid4())
+
+        with self.assertNumQueries(0):
+            rows = self.transaction_service.iter_transaction_history(self.sending_account.account_id)
+
+        self.assertEqual(len(list(rows)), 1)
+
+    def test_postings_write_balanced_journal_lines(self):
+        self.transaction_service.create_new_transaction(Decimal("10.00"), self.sending_account.account_id, self.receiving_account.account_id)
+        self.transaction_service.create_new_transaction(Decimal("1.00"), self.sending_account.account_id, self.sending_account.account_id)
+        self.transaction_service.create_new_atm_transaction(Decimal("5.00"), self.sending_account.account_id, uuid4())
+
+        lines = JournalLine.objects.all()
+        self.assertEqual(lines.count(), 5)
+        self.assertEqual(
+            sorted(lines.filter(account_id=self.sending_account.account_id).values_list("amount", flat=True)),
+            [Decimal("-10.00"), Decimal("-5.00"), Decimal("-1.00"), Decimal("1.00")],
+        )
+        self.assertEqual(list(lines.filter(account_id=self.receiving_account.account_id).values_list("amount", flat=True)), [Decimal("10.00")])
+
+        expected = sorted(lines.values_list("transaction_id", "account_id", "amount"))
+        self.assertEqual(self.transaction_service.rebuild_journal_lines(), 5)
+        self.assertEqual(sorted(JournalLine.objects.values_list("transaction_id", "account_id", "amount")), expected)
+
+    def _create_history_transactions(self):
+        self.account_id = uuid4()
+        self.second_account_id = uuid4()
+        self.stock_receiving_account_id = uuid4()
+
+        # Create transactions within the last 30 and 60 days
+        self.transaction_30_days = Transaction.objects.create(
+            transaction_id=uuid4(),
+            sending_account_id=self.account_id,
+            receiving_account_id=uuid4(),
+            amount=100.50,
+            date=datetime.now() - timedelta(days=15),
+        )
+        self.transaction_60_days = Transaction.objects.create(
+            transaction_id=uuid4(),
+            sending_account_id=self.account_id,
+            receiving_account_id=uuid4(),
+            amount=200.75,
+            date=datetime.now() - timedelta(days=45),
+        )
+
+        # Create transactions older than 60 days
+        self.transaction_old = Transaction.objects.create(
+            transaction_id=uuid4(),
+            sending_account_id=self.account_id,
+            receiving_account_id=uuid4(),
+            amount=300.25,
+            date=datetime.now() - timedelta(days=90),
+        )
+
+        self.transaction_1_uuid = uuid4()
+        self.transaction_2_uuid = uuid4()
+        self.transaction_3_uuid = uuid4()
+
+        # Create stock transactions within the last 30 and 60 days
+        self.stock_transaction_30_days = StockTransaction.objects.create(
+            transaction_id=self.transaction_1_uuid,
+            stockId=uuid4(),
+            transaction_type="Buy",
+            quantity=10,
+            amount=1500.50,
+            date=datetime.now() - timedelta(days=15),
+            sending_account_id=self.second_account_id,
+            receiving_account_id=self.stock_receiving_account_id,
+        )
+
+        self.stock_transaction_60_days = StockTransaction.objects.create(
+            transaction_id=self.transaction_2_uuid,
+            stockId=uuid4(),
+            transaction_type="Sell",
+            quantity=5,
+            amount=2500.75,
+            date=datetime.now() - timedelta(days=45),
+            sending_account_id=self.second_account_id,
+            receiving_account_id=self.stock_receiving_account_id,
+        )
+
+        # Create stock transactions older than 60 days
+        self.stock_transaction_old = StockTransaction.objects.create(
+            transaction_id=self.transaction_3_uuid,
+            stockId=uuid4(),
+            transaction_type="Buy",
+            quantity=20,
+            amount=3000.25,
+            date=datetime.now() - timedelta(days=90),
+            sending_account_id=self.second_account_id,
+            receiving_account_id=self.stock_receiving_account_id,
+        )
+
+        # rows inserted around the service need a fresh journal
+        self.transaction_service.rebuild_journal_lines()
+
     def test_get_transaction_history_30_days(self):
+        self._create_history_transactions()
+
         result = self.transaction_service.get_transaction_history(account_id=self.account_id, timeframe="30_days")
 
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0]["transaction_id"], str(self.transaction_30_days.transaction_id))
 
     def test_get_transaction_history_60_days(self):
+        self._create_history_transactions()
+
         result = self.transaction_service.get_transaction_history(account_id=self.account_id, timeframe="60_days")
 
         self.assertEqual(len(result), 2)
@@ -209,6 +688,8 @@ class TestTransactionService(unittest.TestCase):
         self.assertIn(str(self.transaction_60_days.transaction_id), transaction_ids)
 
     def test_get_transaction_history_all_time(self):
+        self._create_history_transactions()
+
         result = self.transaction_service.get_transaction_history(account_id=self.account_id, timeframe="all_time")
 
         self.assertEqual(len(result), 3)
@@ -218,12 +699,16 @@ class TestTransactionService(unittest.TestCase):
         self.assertIn(str(self.transaction_old.transaction_id), transaction_ids)
 
     def test_get_stock_transaction_history_30_days(self):
+        self._create_history_transactions()
+
         result = self.transaction_service.get_stock_transaction_history(account_id=self.second_account_id, timeframe="30_days")
 
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0]["transaction_id"], str(self.stock_transaction_30_days.transaction_id))
 
     def test_get_stock_transaction_history_60_days(self):
+        self._create_history_transactions()
+
         result = self.transaction_service.get_stock_transaction_history(account_id=self.second_account_id, timeframe="60_days")
 
         self.assertEqual(len(result), 2)
@@ -232,6 +717,8 @@ class TestTransactionService(unittest.TestCase):
         self.assertIn(str(self.stock_transaction_60_days.transaction_id), transaction_ids)
 
     def test_get_stock_transaction_history_all_time(self):
+        self._create_history_transactions()
+
         result = self.transaction_service.get_stock_transaction_history(account_id=self.second_account_id, timeframe="all_time")
 
         self.assertEqual(len(result), 3)
@@ -240,33 +727,84 @@ class TestTransactionService(unittest.TestCase):
         self.assertIn(str(self.stock_transaction_60_days.transaction_id), transaction_ids)
         self.assertIn(str(self.stock_transaction_old.transaction_id), transaction_ids)
 
-    def test_get_stock_transaction_history_invalid_timeframe(self):
-        with self.assertRaises(ValueError):
-            self.transaction_service.get_stock_transaction_history(account_id=self.second_account_id, timeframe="invalid_timeframe")
-
-
-    def test_new_atm_transaction_success(self):
-
-        result = self.transaction_service.create_new_atm_transaction(
-            amount=100.0,
-            account_id=self.mock_atm_transaction.sending_account_id,
-            atm_id=uuid4())
-
-        self.assertTrue(result)
-        self.assertEqual(self.mock_atm_transaction.amount, 100.0)
-        self.assertEqual(self.mock_atm_transaction.sending_account_id, self.mock_atm_transaction.sending_account_id)
-
-    def test_new_atm_transaction_failure(self):
-        self.transaction_service.create_new_atm_transaction = Mock(side_effect=ValidationError("Atm transaction failed"))
-
-        with self.assertRaises(ValidationError) as context:
-            self.transaction_service.create_new_atm_transaction(
-                amount=100.0,
-                account_id=self.mock_atm_transaction.sending_account_id,
-                atm_id=uuid4()
-            )
+    def test_get_transaction_history_query_count(self):
+        self.transaction_service.create_new_transaction(Decimal("10.00"), self.sending_account.account_id, self.receiving_account.account_id)
+        self.transaction_service.create_new_transaction(Decimal("2.00"), self.receiving_account.account_id, self.sending_account.account_id)
+        self.transaction_service.create_new_transaction(Decimal("1.00"), self.sending_account.account_id, self.sending_account.account_id)
+
+        self.transaction_service.create_new_atm_transaction(Decimal("5.00"), self.sending_account.account_id, uuid4())
+
+        # an open start reads the hot and the archived journal
+        with self.assertNumQueries(2):
+            history = self.transaction_service.get_transaction_history(self.sending_account.account_id, "all_time")
+
+        self.assertEqual(len(history), 4)
+        self.assertEqual(sorted(transaction["kind"] for transaction in history), ["atm", "transfer", "transfer", "transfer"])
+
+        # a recent timeframe lies within the archive age and never reads the archive
+        with self.assertNumQueries(1):
+            self.assertEqual(self.transaction_service.get_transaction_history(self.sending_account.account_id, "30_days"), history)
+
+    def test_get_stock_transaction_history_loads_stock_rows_in_bulk(self):
+        stock_id = uuid4()
+        for quantity in (1, 2, 3):
+            self.transaction_service.create_new_stock_transaction(Decimal("10.00"), self.sending_account.account_id, self.receiving_account.account_id, stock_id, quantity, "buy")
+        self.transaction_service.create_new_transaction(Decimal("1.00"), self.sending_account.account_id, self.receiving_account.account_id)
+
+        # the hot and the archived journal lookups and one bulk query for the stock rows
+        with self.assertNumQueries(3):
+            history = self.transaction_service.get_stock_transaction_history(self.sending_account.account_id, "all_time")
+
+        self.assertEqual(sorted(transaction["quantity"] for transaction in history), [1, 2, 3])
+        self.assertEqual({transaction["stock_id"] for transaction in history}, {str(stock_id)})
+
+        # a recent timeframe skips the archive
+        with self.assertNumQueries(2):
+            self.assertEqual(self.transaction_service.get_stock_transaction_history(self.sending_account.account_id, "30_days"), history)
+
+    def test_benchmark_ledger_refuses_a_database_with_transactions(self):
+        self.transaction_service.create_new_transaction(Decimal("10.00"), self.sending_account.account_id, self.receiving_account.account_id)
+
+        with self.assertRaises(CommandError):
+            call_command("benchmark_ledger", "--in-place", "--rows", "10", "--accounts", "2")
+
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_archive_transactions_reads_stay_transparent(self):
+        old_date = make_aware(datetime.now() - timedelta(days=400))
+        old_transfer = Transaction.objects.create(sending_account_id=self.sending_account.account_id, receiving_account_id=self.receiving_account.account_id, amount=Decimal("10.00"), date=old_date)
+        old_trade = StockTransaction.objects.create(sending_account_id=self.sending_account.account_id, receiving_account_id=self.receiving_account.account_id, amount=Decimal("20.00"), date=old_date + timedelta(days=1), stockId=uuid4(), quantity=2, transaction_type="buy")
+        self.transaction_service.rebuild_journal_lines()
+        self.transaction_service.create_new_transaction(Decimal("5.00"), self.receiving_account.account_id, self.sending_account.account_id)
+        history_before = self.transaction_service.get_transaction_history(self.sending_account.account_id, "all_time")
+        net_amounts_before = self.transaction_service.get_net_amounts()
+
+        self.assertEqual(self.transaction_service.archive_transactions(batch_size=1), 2)
+
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertFalse(StockTransaction.objects.exists())
+        self.assertEqual(JournalLine.objects.count(), 2)
+        self.assertEqual(ArchivedJournalLine.objects.count(), 4)
+        archived_trade = ArchivedTransaction.objects.get(transaction_id=old_trade.transaction_id)
+        self.assertEqual((archived_trade.kind, archived_trade.quantity, archived_trade.transaction_type), ("stock", 2, "buy"))
+
+        self.assertEqual(self.transaction_service.get_transaction_history(self.sending_account.account_id, "all_time"), history_before)
+        self.assertEqual(len(self.transaction_service.get_transaction_history(self.sending_account.account_id, "30_days")), 1)
+        self.assertEqual(self.transaction_service.get_net_amounts(), net_amounts_before)
+        self.assertEqual(self.transaction_service.get_ledger_balance(self.sending_account.account_id), Decimal("-25.00"))
+        self.assertEqual(
+            [row.transaction_id for row in self.transaction_service.iter_transaction_history(self.sending_account.account_id)][:2],
+            [old_transfer.transaction_id, old_trade.transaction_id],
+        )
+        self.assertEqual(self.transaction_service.get_stock_transaction_history(self.sending_account.account_id, "all_time")[0]["quantity"], 2)
+        self.transaction_service.rebuild_monthly_rollups()
+        self.assertEqual(self.transaction_service.aggregate_account_amounts(self.sending_account.account_id, "all_time")["total_sent"], Decimal("30.00"))
 
-        self.assertEqual(str(context.exception), "['Atm transaction failed']")
+        # checkpoints built after archiving still cover the archived history
+        self.transaction_service.build_balance_checkpoints(cutoff=make_aware(datetime.now() - timedelta(days=1)), workers=1)
+        checkpoint = BalanceCheckpoint.objects.get(account_id=self.sending_account.account_id)
+        self.assertEqual((checkpoint.balance, checkpoint.transaction_count), (Decimal("-30.00"), 2))
 
-    def tearDown(self):
-        patch.stopall()
\ No newline at end of file
+    def test_archive_transactions_rejects_young_cutoff(self):
+        with self.assertRaises(ValueError):
+            self.transaction_service.archive_transactions(before=make_aware(datetime.now() - timedelta(days=30)))
@@ -0,0 +1,110 @@
+import os
+import tempfile
+from datetime import datetime, timezone
+from decimal import Decimal
+from uuid import uuid4
+
+from django.test import TestCase
+from django.utils.timezone import make_aware
+
+from core.timeframes import DateRange
+from transactions.models import Transaction
+from transactions.services import TransactionService
+from transactions.snapshot import LedgerSnapshot, write_snapshot
+
+
+class TestLedgerSnapshot(TestCase):
+    def setUp(self):
+        self.transaction_service = TransactionService()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "ledger")
+        self.first, self.second, self.third = uuid4(), uuid4(), uuid4()
+
+        def post(amount, sending_account_id, receiving_account_id, day):
+            Transaction.objects.create(
+                sending_account_id=sending_account_id,
+                receiving_account_id=receiving_account_id,
+                amount=Decimal(amount),
+                date=datetime(2024, 3, day, 12, tzinfo=timezone.utc),
+            )
+
+        post("10.50", self.first, self.second, 1)
+        post("2.25", self.first, self.third, 1)
+        post("4.00", self.second, self.first, 2)
+        post("100.00", self.third, None, 20)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_write_and_open_snapshot(self):
+        report = write_snapshot(self.path, chunk_size=3)
+        snapshot = LedgerSnapshot(self.path)
+
+        self.assertEqual((report["rows"], report["accounts"]), (4, 3))
+        self.assertEqual(len(snapshot), 4)
+        self.assertEqual(sorted(snapshot.amount_cents.tolist()), [225, 400, 1050, 10000])
+        self.assertEqual(snapshot.account_id(snapshot.account_index(self.second)), self.second)
+        self.assertIsNone(snapshot.account_index(uuid4()))
+
+    def test_account_totals_match_the_service(self):
+        # rows inserted around the service need a fresh journal and rollups
+        self.transaction_service.rebuild_journal_lines()
+        self.transaction_service.rebuild_monthly_rollups()
+        write_snapshot(self.path)
+        snapshot = LedgerSnapshot(self.path)
+
+        for account_id in (self.first, self.second, self.third):
+            self.assertEqual(snapshot.account_totals(account_id), self.transaction_service.aggregate_account_amounts(account_id, "all_time"))
+        march_first = DateRange(start=make_aware(datetime(2024, 3, 1)), end=make_aware(datetime(2024, 3, 2)))
+        self.assertEqual(snapshot.account_totals(self.first, march_first)["total_sent"], Decimal("12.75"))
+
+    def test_bucket_totals(self):
+        write_snapshot(self.path)
+        snapshot = LedgerSnapshot(self.path)
+
+        days = snapshot.bucket_totals("day")
+        months = snapshot.bucket_totals("month", account_id=self.first)
+
+        self.assertEqual([(day.day, count, volume) for day, count, volume in days], [(1, 2, Decimal("12.75")), (2, 1, Decimal("4.00")), (20, 1, Decimal("100.00"))])
+        self.assertEqual(months, [(datetime(2024, 3, 1, tzinfo=timezone.utc), 3, Decimal("16.75"))])
+        with self.assertRaises(ValueError):
+            snapshot.bucket_totals("fortnight")
+
+    def test_top_accounts(self):
+        write_snapshot(self.path)
+        snapshot = LedgerSnapshot(self.path)
+
+        self.assertEqual(snapshot.top_accounts(2, by="sent"), [(self.third, Decimal("100.00")), (self.first, Decimal("12.75"))])
+        self.assertEqual(snapshot.top_accounts(1, by="received"), [(self.second, Decimal("10.50"))])
+        self.assertEqual(snapshot.top_accounts(5, date_range=DateRange(start=make_aware(datetime(2024, 3, 3)))), [(self.third, Decimal("100.00"))])
+
+    def test_replace_snapshot(self):
+        write_snapshot(self.path)
+        Transaction.objects.create(sending_account_id=self.first, amount=Decimal("1.00"), date=datetime(2024, 4, 1, tzinfo=timezone.utc))
+
+        # a trailing slash names the same snapshot
+        write_snapshot(self.path + os.sep)
+
+        self.assertEqual(len(LedgerSnapshot(self.path)), 5)
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ["ledger"])
+
+    def test_refuses_to_replace_a_directory_without_snapshot(self):
+        os.makedirs(self.path)
+        with open(os.path.join(self.path, "report.txt"), "w") as file:
+            file.write("keep me")
+
+        with self.assertRaises(ValueError):
+            write_snapshot(self.path)
+
+        self.assertEqual(os.listdir(self.path), ["report.txt"])
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ["ledger"])
+
+    def test_empty_snapshot(self):
+        Transaction.objects.all().delete()
+
+        write_snapshot(self.path)
+        snapshot = LedgerSnapshot(self.path)
+
+        self.assertEqual(len(snapshot), 0)
+        self.assertEqual(snapshot.top_accounts(), [])
+        self.assertEqual(snapshot.bucket_totals(), [])